@@ -8,6 +8,10 @@ from matplotlib.backends.backend_pdf import PdfPages
 from matplotlib.patches import Rectangle
 import matplotlib.patches as mpatches
 
+from pipeline.dir_index import DirIndex
+from pipeline.recon_io import load_reconstruction
+from pipeline.results_db import load_evaluation
+
 
 class QRAnalysisReport:
     def __init__(
@@ -22,6 +26,9 @@ class QRAnalysisReport:
         self.json_path = json_path
         self.tobako_dir = tobako_dir
         self.raimu_dir = raimu_dir
+        # レコードごとに存在確認せず、ディレクトリを1回だけ走査した索引で引く
+        self.tobako_index = DirIndex(tobako_dir)
+        self.raimu_index = DirIndex(raimu_dir)
         self.wrap_width = wrap_width
         self.bg_color = bg_color
         self.panel_color = panel_color
@@ -172,12 +179,8 @@ class QRAnalysisReport:
             )
 
     def generate_pdf(self, output_path="evaluate/analysis_repost.pdf"):
-        # JSONロード
-        if not os.path.exists(self.json_path):
-            raise FileNotFoundError(f"JSON file not found: {self.json_path}")
-
-        with open(self.json_path, "r", encoding="utf-8") as f:
-            evaluation_data = json.load(f)
+        # 評価結果ロード（results.sqlite3 に Step2 の結果があればそちらを優先、なければ JSON）
+        evaluation_data = load_evaluation(self.json_path)
 
         # 軽い（白背景）スタイル
         plt.style.use("default")
@@ -188,8 +191,8 @@ class QRAnalysisReport:
                 if not filename:
                     continue
 
-                original_path = os.path.join(self.tobako_dir, filename)
-                enhanced_path = os.path.join(self.raimu_dir, filename)
+                original = self.tobako_index.find(filename)
+                enhanced = self.raimu_index.get(filename)
 
                 fig = plt.figure(figsize=(12, 4), facecolor=self.bg_color)
                 gs = GridSpec(1, 3, figure=fig, width_ratios=[1, 1, 0.9], wspace=0.25)
@@ -197,8 +200,8 @@ class QRAnalysisReport:
                 # 左: ORIGINAL
                 ax1 = fig.add_subplot(gs[0, 0])
                 ax1.set_facecolor(self.bg_color)
-                if os.path.exists(original_path):
-                    img1 = cv2.imread(original_path)
+                if original is not None:
+                    img1 = cv2.imread(original.path)
                     if img1 is not None:
                         img1 = cv2.cvtColor(img1, cv2.COLOR_BGR2RGB)
                         ax1.imshow(img1)
@@ -210,10 +213,10 @@ class QRAnalysisReport:
                 # 中央: ENHANCED
                 ax2 = fig.add_subplot(gs[0, 1])
                 ax2.set_facecolor(self.bg_color)
-                if os.path.exists(enhanced_path):
-                    img2 = cv2.imread(enhanced_path)
+                if enhanced is not None:
+                    img2 = load_reconstruction(enhanced.path, max_side=1024)
                     if img2 is not None:
-                        img2 = cv2.cvtColor(img2, cv2.COLOR_BGR2RGB)
+                        img2 = cv2.cvtColor(img2, cv2.COLOR_GRAY2RGB)
                         ax2.imshow(img2)
                 ax2.axis("off")
                 ax2.set_title(
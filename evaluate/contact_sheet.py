@@ -0,0 +1,267 @@
+import html
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from pipeline.dir_index import DirIndex
+from pipeline.image_io import load_gray
+from pipeline.recon_io import load_reconstruction
+from pipeline.results_db import load_evaluation
+
+# 状態バーの色（BGR）
+MATCH_COLOR = (60, 160, 40)
+MISMATCH_COLOR = (40, 40, 210)
+
+
+def overlay_tiles(orig: np.ndarray, recon: np.ndarray) -> np.ndarray:
+    """
+    (N, t, t) の元画像・再生成画像のサムネイルを overlay_pdf と同じ配色で重ねた (N, t, t, 3) を返す。
+    白(>=250)は透明扱い。全タイルを1回の配列演算で処理する。
+    """
+    o = orig.astype(np.uint16)
+    r = recon.astype(np.uint16)
+    toba = np.stack([np.zeros_like(o), o, o // 2], axis=-1)
+    toba[orig >= 250] = 255
+    raimu = np.stack([r, r // 2, np.zeros_like(r)], axis=-1)
+    raimu[recon >= 250] = 255
+    return ((toba + raimu + 1) // 2).astype(np.uint8)
+
+
+class ContactSheetReport:
+    """
+    PDF の代わりに、元画像 / 再生成画像 / 重ね合わせのサムネイルを大きなアトラス画像に並べ、
+    一覧用の静的 HTML（一致状態・ペイロード・絞り込み付き）から CSS スプライトで参照する。
+
+    - 1件 = 状態バー＋3枚のサムネイル（thumb px 角）のセル。アトラス1枚に cols×rows 件
+    - 読み込み（元画像は縮小デコード）は workers スレッドで並べ、合成とアトラスへの配置はまとめて配列演算
+    - 処理時間は件数にほぼ比例し、HTML はアトラスを数枚読むだけなので開くのも速い
+    """
+
+    def __init__(
+        self,
+        json_path: str = "evaluate.json",
+        tobako_dir: str = "qr_tobakosan",
+        raimu_dir: str = "qr_raimu",
+        thumb: int = 96,
+        cols: int = 8,
+        rows: int = 64,
+        pad: int = 4,
+        bar: int = 4,
+        workers: int | None = None,
+        jpeg_quality: int = 90,
+    ):
+        self.json_path = json_path
+        self.tobako_dir = tobako_dir
+        self.raimu_dir = raimu_dir
+        # レコードごとに存在確認せず、ディレクトリを1回だけ走査した索引で引く
+        self.tobako_index = DirIndex(tobako_dir)
+        self.raimu_index = DirIndex(raimu_dir)
+        self.thumb = thumb
+        self.cols = cols
+        self.rows = rows
+        self.pad = pad
+        self.bar = bar
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self.jpeg_quality = jpeg_quality
+        self.cell_w = 3 * thumb + 4 * pad
+        self.cell_h = bar + thumb + 2 * pad
+
+    # ---------- サムネイル ----------
+    def _thumb_original(self, filename: str) -> np.ndarray | None:
+        entry = self.tobako_index.find(filename)
+        if entry is None:
+            return None
+        # module=1 として「短辺が thumb px 以上残る最大の縮小倍率」で JPEG/PNG をデコードする
+        img, _ = load_gray(entry.path, 1, self.thumb)
+        return self._fit(img)
+
+    def _thumb_reconstruction(self, filename: str) -> np.ndarray | None:
+        entry = self.raimu_index.get(filename)
+        if entry is None:
+            return None
+        return self._fit(load_reconstruction(entry.path, self.thumb))
+
+    def _thumbs(self, filename: str) -> tuple:
+        return self._thumb_original(filename), self._thumb_reconstruction(filename)
+
+    def _fit(self, img: np.ndarray | None) -> np.ndarray | None:
+        if img is None:
+            return None
+        t = self.thumb
+        if img.shape != (t, t):
+            img = cv2.resize(img, (t, t), interpolation=cv2.INTER_AREA if min(img.shape) >= t else cv2.INTER_NEAREST)
+        return img
+
+    # ---------- アトラス ----------
+    def _compose(self, orig: np.ndarray, recon: np.ndarray, match: np.ndarray) -> np.ndarray:
+        """N 件分のサムネイルを (rows×cell_h, cols×cell_w, 3) のアトラス1枚にする（使った行まで）。"""
+        n, t, p, b = len(orig), self.thumb, self.pad, self.bar
+        cells = np.full((self.rows * self.cols, self.cell_h, self.cell_w, 3), 255, dtype=np.uint8)
+        y = b + p
+        cells[:n, y:y + t, p:p + t] = orig[..., None]
+        cells[:n, y:y + t, 2 * p + t:2 * p + 2 * t] = recon[..., None]
+        cells[:n, y:y + t, 3 * p + 2 * t:3 * p + 3 * t] = overlay_tiles(orig, recon)
+        cells[:n, :b] = np.where(match[:, None, None, None], MATCH_COLOR, MISMATCH_COLOR).astype(np.uint8)
+
+        used_rows = -(-n // self.cols)
+        grid = cells.reshape(self.rows, self.cols, self.cell_h, self.cell_w, 3)[:used_rows]
+        return grid.transpose(0, 2, 1, 3, 4).reshape(used_rows * self.cell_h, self.cols * self.cell_w, 3)
+
+    def generate(self, out_dir: str = os.path.join("evaluate", "contact_sheet"), progress=None) -> str | None:
+        """
+        out_dir に atlas_000.jpg … と index.html を書き、index.html のパスを返す。
+        progress を渡すと QRPipeline.on_progress と同じ形で進み具合を通知する。
+        """
+        try:
+            # results.sqlite3 に Step2 の結果があればそちらを優先
+            records = load_evaluation(self.json_path)
+        except FileNotFoundError:
+            print(f"エラー: '{self.json_path}' が見つかりません。")
+            return None
+        os.makedirs(out_dir, exist_ok=True)
+        if progress is not None:
+            progress({"phase": "contact_sheet", "total": len(records)})
+
+        per_atlas = self.cols * self.rows
+        t = self.thumb
+        items = []
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="contact-sheet")
+        try:
+            for a, start in enumerate(range(0, len(records), per_atlas)):
+                chunk = records[start:start + per_atlas]
+                orig = np.full((len(chunk), t, t), 255, dtype=np.uint8)
+                recon = np.full((len(chunk), t, t), 255, dtype=np.uint8)
+                # cv2 のデコード中は GIL が外れるので、画像の読み込みだけスレッドで並べる
+                for k, (o, r) in enumerate(pool.map(self._thumbs, [rec["file"] for rec in chunk])):
+                    if o is not None:
+                        orig[k] = o
+                    if r is not None:
+                        recon[k] = r
+                    if progress is not None:
+                        progress({"done": chunk[k]["file"], "ok": bool(chunk[k].get("match"))})
+                match = np.array([bool(rec.get("match")) for rec in chunk])
+                atlas_name = f"atlas_{a:03d}.jpg"
+                cv2.imwrite(os.path.join(out_dir, atlas_name), self._compose(orig, recon, match),
+                            [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+                for k, rec in enumerate(chunk):
+                    items.append({
+                        "f": rec["file"],
+                        "m": bool(rec.get("match")),
+                        "o": rec.get("original"),
+                        "r": rec.get("reconstructed"),
+                        "s": rec.get("structure_reject"),
+                        "a": atlas_name,
+                        "x": (k % self.cols) * self.cell_w,
+                        "y": (k // self.cols) * self.cell_h,
+                    })
+        finally:
+            pool.shutdown()
+
+        index_path = os.path.join(out_dir, "index.html")
+        with open(index_path, "w", encoding="utf-8") as f:
+            f.write(self._html(items))
+        ok = sum(1 for it in items if it["m"])
+        print(f"コンタクトシートを '{index_path}' に保存しました（{len(items)} 件、一致 {ok} 件、"
+              f"アトラス {-(-len(items) // per_atlas)} 枚）。")
+        return index_path
+
+    # ---------- HTML ----------
+    def _html(self, items: list) -> str:
+        data = json.dumps(items, ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/")
+        return _TEMPLATE.replace("__CELL_W__", str(self.cell_w)).replace("__CELL_H__", str(self.cell_h)) \
+            .replace("__TITLE__", html.escape(os.path.basename(self.json_path))).replace("__DATA__", data)
+
+
+_TEMPLATE = """<!doctype html>
+<html lang="ja">
+<head>
+<meta charset="utf-8">
+<title>コンタクトシート - __TITLE__</title>
+<style>
+body { font-family: sans-serif; margin: 0; background: #fafafa; }
+header { position: sticky; top: 0; background: #fff; border-bottom: 1px solid #ddd; padding: 8px 12px;
+         display: flex; gap: 12px; align-items: center; flex-wrap: wrap; z-index: 1; }
+#grid { display: flex; flex-wrap: wrap; gap: 6px; padding: 12px; }
+.card { width: __CELL_W__px; background: #fff; border: 1px solid #e0e0e0; font-size: 11px;
+        content-visibility: auto; contain-intrinsic-size: __CELL_W__px calc(__CELL_H__px + 40px); }
+.sprite { width: __CELL_W__px; height: __CELL_H__px; background-repeat: no-repeat; }
+.cap { padding: 2px 4px; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }
+.ng { color: #c62828; }
+#more { margin: 0 12px 24px; }
+</style>
+</head>
+<body>
+<header>
+  <strong>__TITLE__</strong>
+  <label>状態 <select id="status"><option value="">すべて</option><option value="1">一致</option>
+    <option value="0">不一致</option></select></label>
+  <label>構造チェック <select id="reject"><option value="">すべて</option></select></label>
+  <input id="q" type="search" placeholder="ファイル名・ペイロードで絞り込み" size="32">
+  <span id="count"></span>
+  <span>（左から 元画像 / 再生成 / 重ね合わせ）</span>
+</header>
+<div id="grid"></div>
+<button id="more" hidden>さらに表示</button>
+<script>
+const DATA = __DATA__;
+const PAGE = 600;
+const $ = (id) => document.getElementById(id);
+const esc = (s) => String(s ?? "").replace(/[&<>"]/g, (c) => ({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"}[c]));
+let rows = DATA, shown = 0;
+
+for (const r of [...new Set(DATA.map((d) => d.s).filter(Boolean))].sort()) {
+  $("reject").insertAdjacentHTML("beforeend", `<option>${esc(r)}</option>`);
+}
+
+function card(d) {
+  const title = `original: ${d.o ?? "(読めず)"}\\nreconstructed: ${d.r ?? "(読めず)"}` + (d.s ? `\\n構造チェック: ${d.s}` : "");
+  return `<div class="card" title="${esc(title)}">` +
+    `<div class="sprite" style="background-image:url('${d.a}');background-position:-${d.x}px -${d.y}px"></div>` +
+    `<div class="cap${d.m ? "" : " ng"}">${d.m ? "○" : "×"} ${esc(d.f)}</div>` +
+    `<div class="cap">${esc(d.r ?? d.o ?? "-")}</div></div>`;
+}
+
+function more() {
+  $("grid").insertAdjacentHTML("beforeend", rows.slice(shown, shown + PAGE).map(card).join(""));
+  shown = Math.min(rows.length, shown + PAGE);
+  $("more").hidden = shown >= rows.length;
+}
+
+function apply() {
+  const st = $("status").value, rj = $("reject").value, q = $("q").value.trim().toLowerCase();
+  rows = DATA.filter((d) =>
+    (st === "" || String(+d.m) === st) &&
+    (rj === "" || d.s === rj) &&
+    (!q || `${d.f}\\n${d.o ?? ""}\\n${d.r ?? ""}`.toLowerCase().includes(q)));
+  const ok = rows.filter((d) => d.m).length;
+  $("count").textContent = `${rows.length} / ${DATA.length} 件（一致 ${ok}）`;
+  $("grid").innerHTML = "";
+  shown = 0;
+  more();
+}
+
+$("status").onchange = apply;
+$("reject").onchange = apply;
+$("q").oninput = apply;
+$("more").onclick = more;
+apply();
+</script>
+</body>
+</html>
+"""
+
+
+def main():
+    report = ContactSheetReport(
+        json_path="evaluate.json",
+        tobako_dir="qr_tobakosan",
+        raimu_dir="qr_raimu",
+    )
+    report.generate(os.path.join("evaluate", "contact_sheet"))
+
+
+if __name__ == "__main__":
+    main()
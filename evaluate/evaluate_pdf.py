@@ -1,6 +1,10 @@
 import os
-import json
 from fpdf import FPDF
+from PIL import Image
+
+from pipeline.dir_index import DirIndex
+from pipeline.recon_io import load_reconstruction
+from pipeline.results_db import load_evaluation
 
 
 class Evaluator:
@@ -8,7 +12,12 @@ class Evaluator:
         self.json_path = json_path
         self.tobako_dir = tobako_dir
         self.raimu_dir = raimu_dir
+        # レコードごとに存在確認せず、ディレクトリを1回だけ走査した索引で引く
+        self.tobako_index = DirIndex(tobako_dir)
+        self.raimu_index = DirIndex(raimu_dir)
         self.japanese_font_path = "ipaexg.ttf"
+        # 再生成画像は貼り付けサイズに見合う解像度で読む（1モジュール1画素の形式もここで拡大）
+        self.thumb_side = 512
 
     def _create_pdf_report(self, evaluation_data: list):
         pdf = FPDF(orientation="P", unit="mm", format="A4")
@@ -49,14 +58,15 @@ class Evaluator:
             filename = data["file"]
             file_number = os.path.splitext(filename)[0]
 
-            original_path = os.path.join(self.tobako_dir, filename)
-            enhanced_path = os.path.join(self.raimu_dir, filename)
+            original = self.tobako_index.find(filename)
+            enhanced = self.raimu_index.get(filename)
 
-            if os.path.exists(original_path):
-                pdf.image(original_path, x=x, y=y, w=img_w, h=img_h)
-            if os.path.exists(enhanced_path):
+            if original is not None:
+                pdf.image(original.path, x=x, y=y, w=img_w, h=img_h)
+            enhanced_img = load_reconstruction(enhanced.path, self.thumb_side) if enhanced is not None else None
+            if enhanced_img is not None:
                 pdf.image(
-                    enhanced_path, x=x + img_w + gap_between_imgs, y=y, w=img_w, h=img_h
+                    Image.fromarray(enhanced_img), x=x + img_w + gap_between_imgs, y=y, w=img_w, h=img_h
                 )
 
             decode_text = data.get("raimu", "") or data.get("toba", "")
@@ -71,8 +81,8 @@ class Evaluator:
 
     def run(self):
         try:
-            with open(self.json_path, "r", encoding="utf-8") as f:
-                evaluation_data = json.load(f)
+            # results.sqlite3 に Step2 の結果があればそちらを優先
+            evaluation_data = load_evaluation(self.json_path)
         except FileNotFoundError:
             print(f"エラー: '{self.json_path}' が見つかりません。")
             return
@@ -1,22 +1,28 @@
 import os
-import json
 import cv2
 import numpy as np
 from fpdf import FPDF
 import tempfile
 
+from pipeline.dir_index import DirIndex
+from pipeline.recon_io import load_reconstruction
+from pipeline.results_db import load_evaluation
+
 
 class Evaluator:
     def __init__(self, json_path: str, tobako_dir: str, raimu_dir: str):
         self.json_path = json_path
         self.tobako_dir = tobako_dir
         self.raimu_dir = raimu_dir
+        # レコードごとに存在確認せず、ディレクトリを1回だけ走査した索引で引く
+        self.tobako_index = DirIndex(tobako_dir)
+        self.raimu_index = DirIndex(raimu_dir)
         self.japanese_font_path = "ipaexg.ttf"
 
     def _overlay_images(self, path1, path2):
         """QRの黒部分をグラデーションで色付けして重ね合わせる"""
         img1 = cv2.imread(path1, cv2.IMREAD_GRAYSCALE)
-        img2 = cv2.imread(path2, cv2.IMREAD_GRAYSCALE)
+        img2 = load_reconstruction(path2)
 
         if img1 is None or img2 is None:
             return None
@@ -87,10 +93,12 @@ class Evaluator:
             filename = data["file"]
             file_number = os.path.splitext(filename)[0]
 
-            original_path = os.path.join(self.tobako_dir, filename)
-            enhanced_path = os.path.join(self.raimu_dir, filename)
+            original = self.tobako_index.find(filename)
+            enhanced = self.raimu_index.get(filename)
 
-            overlay = self._overlay_images(original_path, enhanced_path)
+            overlay = None
+            if original is not None and enhanced is not None:
+                overlay = self._overlay_images(original.path, enhanced.path)
             if overlay is not None:
                 with tempfile.NamedTemporaryFile(
                     suffix=".png", delete=False
@@ -113,8 +121,8 @@ class Evaluator:
 
     def run(self):
         try:
-            with open(self.json_path, "r", encoding="utf-8") as f:
-                evaluation_data = json.load(f)
+            # results.sqlite3 に Step2 の結果があればそちらを優先
+            evaluation_data = load_evaluation(self.json_path)
         except FileNotFoundError:
             print(f"エラー: '{self.json_path}' が見つかりません。")
             return
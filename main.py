@@ -2,17 +2,22 @@ import sys
 import os
 
 from pipeline.pipeline import QRPipeline
+from pipeline.calibration import CALIBRATED_KEYS
 import evaluate.evaluate_pdf as evaluate_pdf
 import evaluate.overlay_pdf as overlay_pdf
 import evaluate.analysis_pdf as analysis_pdf
+import evaluate.contact_sheet as contact_sheet
 
 def run_editor():
     try:
         from tools.qr_vector_editor_flask.app import start
+        from tools.qr_vector_editor_flask import jobs_api
     except Exception as e:
         print("エラー: エディタの起動モジュールをインポートできませんでした。")
         print("原因:", e)
         return
+    # /api/jobs から実行するステップもメニューと同じ設定のパイプラインを使う
+    jobs_api.configure(pipeline_factory=build_pipeline)
 
     # ★ ここを 0.0.0.0 固定に（Docker/WSL/別PCから見られる）
     host = "0.0.0.0"
@@ -26,8 +31,25 @@ def run_editor():
     start(host=host, port=port, debug=False)
 
 
+def run_enhance_service():
+    try:
+        from tools.qr_vector_editor_flask.enhance_api import start
+    except Exception as e:
+        print("エラー: 鮮明化APIの起動モジュールをインポートできませんでした。")
+        print("原因:", e)
+        return
+
+    host = "0.0.0.0"
+    port = int(os.environ.get("QR_ENHANCE_PORT", "5001"))
 
-def build_pipeline() -> QRPipeline:
+    print("\n--- 鮮明化API（POST /api/enhance）を起動します ---")
+    print(f"URL(ローカル): http://127.0.0.1:{port}/api/enhance")
+    print("停止するには Ctrl+C")
+
+    start(host=host, port=port)
+
+
+def build_pipeline(calibration: bool = False) -> QRPipeline:
     tobako_dir = "qr_tobakosan"
     raimu_dir = "qr_raimu"
     vector_dir = "qr_vector"
@@ -40,7 +62,15 @@ def build_pipeline() -> QRPipeline:
         "avg_thresh": 128,
         "top_row_thresh": 160,
         "finder_size": 7,
+        "localize": False,   # 写真・余白付きスキャンなら True（位置検出＋射影補正）
+        # 8 などにすると1モジュールその px 以上を保てる範囲で縮小読み込み（大きな JPEG が多い時に速い）。
+        # 縮小で読めなかった画像はフル解像度で処理し直すので、読めない画像は2回分の時間がかかる
+        "target_ppm": None,
     }
+    if calibration:
+        # Step0 の calibration.json を使う時は、推定したしきい値を明示指定で上書きしないよう外す
+        for key in CALIBRATED_KEYS:
+            params.pop(key)
 
     return QRPipeline(
         tobako_dir=tobako_dir,
@@ -48,12 +78,37 @@ def build_pipeline() -> QRPipeline:
         vector_dir=vector_dir,
         statistics_dir=statistics_dir,  
         enhancer_params=params,
+        calibration=calibration,
+        # qr_raimu の形式: png8 / png1（1bit, 画素は同じ）/ tiff_g4 / module（1モジュール1画素, 読み手が拡大）
+        raimu_format="png1",
     )
 
 
-def run_step1_vectors():
+def run_step0_calibrate():
     pipeline = build_pipeline()
-    pipeline.step1_make_vectors()
+    pipeline.step0_calibrate_thresholds()
+
+
+def run_video_decode():
+    pipeline = build_pipeline()
+    pipeline.step_video_decode(video_dir="qr_video")
+
+
+def run_sheet_vectors():
+    pipeline = build_pipeline()
+    pipeline.step_sheet_vectors(sheet_dir="qr_sheet")
+
+
+def run_repair_vectors():
+    pipeline = build_pipeline()
+    pipeline.step_repair_vectors()
+
+
+def run_step1_vectors(calibration: bool = False):
+    pipeline = build_pipeline(calibration=calibration)
+    # 同じサイズの画像をまとめて2値化する。dedup_radius（例: 20）を渡すと、ほぼ同一の撮影は
+    # 代表1枚だけ処理する（別コードを取り違えないよう、メンバーは行列が代表と一致する時だけまとめる）
+    pipeline.step1_make_vectors(batch_size=16, dedup_radius=None)
 
 
 def run_step2_reconstruct_and_evaluate():
@@ -73,6 +128,11 @@ def run_step3_reports():
         print("Step1 と Step2 を実行してデータを生成してください。")
 
 
+def run_contact_sheet():
+    # PDF の代わりにサムネイルのアトラス画像＋静的 HTML で一覧する（件数が多い場合向け）
+    contact_sheet.main()
+
+
 if __name__ == "__main__":
     print("\n--- QRコード評価システム ---")
     print("実行したい処理を選択してください:")
@@ -80,6 +140,13 @@ if __name__ == "__main__":
     print("2: Step2 画像再生成＋評価（raimu画像と evaluate.json を生成）")
     print("3: Step3 評価レポートの生成（PDF出力）")
     print("4: QRベクター編集ツールを起動（Flask）")  # ★ 追加
+    print("5: 鮮明化APIサーバを起動（POST /api/enhance）")
+    print("6: Step0 しきい値キャリブレーション（qr_statistics/calibration.json を生成）")
+    print("7: 動画クリップのデコード（qr_video → evaluate_video.json）")
+    print("8: シート（1枚に複数コード）のベクトル作成（qr_sheet → qr_vector/sheet/{名前}/{番号}.json）")
+    print("9: デコードできないベクトルの自動修復（確信度の低いセルから反転して探索）")
+    print("10: コンタクトシート（サムネイル一覧の HTML、evaluate/contact_sheet/index.html）")
+    print("11: Step1 ベクトル作成（Step0 の calibration.json のしきい値を使用）")
     print("それ以外: 終了")
 
     user_input = input("選択肢の番号を入力してください: ").strip()
@@ -92,6 +159,20 @@ if __name__ == "__main__":
         run_step3_reports()
     elif user_input == "4":         # ★ 追加
         run_editor()
+    elif user_input == "5":
+        run_enhance_service()
+    elif user_input == "6":
+        run_step0_calibrate()
+    elif user_input == "7":
+        run_video_decode()
+    elif user_input == "8":
+        run_sheet_vectors()
+    elif user_input == "9":
+        run_repair_vectors()
+    elif user_input == "10":
+        run_contact_sheet()
+    elif user_input == "11":
+        run_step1_vectors(calibration=True)
     else:
         print("システムを終了します。")
         sys.exit()
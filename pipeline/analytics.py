@@ -0,0 +1,217 @@
+import argparse
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from pipeline.dir_index import DirIndex
+
+REGIONS = ("finder", "top_row", "body")
+
+
+@dataclass
+class VectorSet:
+    """
+    N 枚分の module×module 行列を1つの配列で持つ。
+    bits は (N, ceil(module²/8)) の uint8 で、1行が np.packbits した1枚分（results_db の vectors.bits と同じ並び）。
+    """
+    names: List[str]
+    module: int
+    bits: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def from_matrices(cls, names: List[str], matrices) -> "VectorSet":
+        arr = np.asarray(matrices, dtype=np.uint8)
+        if arr.ndim != 3 or arr.shape[1] != arr.shape[2]:
+            raise ValueError(f"(N, module, module) の配列が必要です: {arr.shape}")
+        return cls(list(names), int(arr.shape[1]), np.packbits(arr.reshape(len(arr), -1), axis=1))
+
+    def matrices(self) -> np.ndarray:
+        """(N, module, module) の 0/1 配列に展開する（件数が多い時は subset で絞ってから）。"""
+        n = self.module * self.module
+        return np.unpackbits(self.bits, axis=1, count=n).reshape(len(self), self.module, self.module)
+
+    def subset(self, names: List[str]) -> "VectorSet":
+        if names == self.names:
+            return self
+        pos = {name: i for i, name in enumerate(self.names)}
+        return VectorSet(list(names), self.module, self.bits[[pos[n] for n in names]])
+
+    def save(self, path: str) -> None:
+        np.savez(path, names=np.asarray(self.names), module=self.module, bits=self.bits)
+
+    @classmethod
+    def load(cls, path: str) -> "VectorSet":
+        with np.load(path) as z:
+            return cls(z["names"].tolist(), int(z["module"]), z["bits"])
+
+
+# ---------- 読み込み ----------
+def load_vector_dir(path: str, module: int | None = None) -> VectorSet:
+    """
+    qr_vector 形式の JSON（編集済みの正解でもよい）をまとめて読む。name は JSON の stem。
+    module が違うものは読み飛ばす（省略時は最初の1件に合わせる）。
+    """
+    names: List[str] = []
+    rows: List[np.ndarray] = []
+    for name in DirIndex(path).names(".json"):
+        with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+            obj = json.load(f)
+        m = int(obj["module"])
+        module = module or m
+        if m != module:
+            continue
+        grid = np.asarray(obj["vector"], dtype=np.uint8)[:module, :module]
+        names.append(os.path.splitext(name)[0])
+        rows.append(np.packbits(grid.ravel()))
+    nbytes = (module * module + 7) // 8 if module else 0
+    bits = np.stack(rows) if rows else np.zeros((0, nbytes), dtype=np.uint8)
+    return VectorSet(names, module or 0, bits)
+
+
+def load_vector_db(db_path: str, module: int = 33, step: str | None = None) -> VectorSet:
+    """results_db から name ごとの最新のベクトルを読む（step を指定するとその種類の実行に絞る）。"""
+    from pipeline.results_db import ResultsDB
+
+    db = ResultsDB(db_path)
+    try:
+        rows = db.latest_vector_bits(module, step)
+    finally:
+        db.close()
+    nbytes = (module * module + 7) // 8
+    # blob を連結して1回で配列にする（1行ずつ frombuffer しない）
+    bits = np.frombuffer(b"".join(blob for _, blob in rows), dtype=np.uint8).reshape(len(rows), nbytes)
+    return VectorSet([name for name, _ in rows], module, bits.copy())
+
+
+def load_vectors(source: str, module: int = 33) -> VectorSet:
+    """source の種類（.npz / results.sqlite3 / qr_vector 形式のディレクトリ）で読み方を選ぶ。"""
+    if source.endswith(".npz"):
+        return VectorSet.load(source)
+    if source.endswith((".sqlite3", ".sqlite", ".db")):
+        return load_vector_db(source, module)
+    return load_vector_dir(source, module)
+
+
+# ---------- 集計 ----------
+def region_masks(module: int, finder_size: int = 7) -> Dict[str, np.ndarray]:
+    """
+    finder（3隅の finder_size 角）/ top_row（finder を除いた 0 行目）/ body（それ以外）の
+    重ならない bool マスク。
+    """
+    finder = np.zeros((module, module), dtype=bool)
+    finder[:finder_size, :finder_size] = True
+    finder[:finder_size, module - finder_size:] = True
+    finder[module - finder_size:, :finder_size] = True
+    top_row = np.zeros_like(finder)
+    top_row[0] = True
+    top_row &= ~finder
+    return {"finder": finder, "top_row": top_row, "body": ~(finder | top_row)}
+
+
+@dataclass
+class CorpusErrors:
+    """予測と正解の差分。errors は (N, len(REGIONS)) の領域別誤りセル数、heatmap は位置ごとの誤り回数。"""
+    names: List[str]
+    module: int
+    errors: np.ndarray
+    region_cells: Dict[str, int]
+    heatmap: np.ndarray
+
+    def per_image(self) -> pd.DataFrame:
+        """画像ごとの誤りセル数と誤り率（全体・領域別）。"""
+        df = pd.DataFrame(self.errors, columns=[f"{r}_errors" for r in REGIONS], index=pd.Index(self.names, name="name"))
+        df["errors"] = self.errors.sum(axis=1)
+        df["ber"] = df["errors"] / (self.module * self.module)
+        for r in REGIONS:
+            df[f"{r}_ber"] = df[f"{r}_errors"] / self.region_cells[r]
+        df["exact"] = df["errors"] == 0
+        return df
+
+    def region_summary(self) -> pd.DataFrame:
+        """領域ごとのセル数・誤りセル総数・ビット誤り率・誤りを含む画像の割合。"""
+        n = len(self.names)
+        rows = []
+        for k, r in enumerate(list(REGIONS) + ["all"]):
+            err = self.errors.sum(axis=1) if r == "all" else self.errors[:, k]
+            cells = self.module * self.module if r == "all" else self.region_cells[r]
+            rows.append({
+                "region": r,
+                "cells": cells,
+                "errors": int(err.sum()),
+                "ber": float(err.sum()) / (cells * n) if n else float("nan"),
+                "images_with_error": float((err > 0).mean()) if n else float("nan"),
+            })
+        return pd.DataFrame(rows).set_index("region")
+
+    def heatmap_frame(self, rate: bool = True) -> pd.DataFrame:
+        """位置（行 gy × 列 gx）ごとの誤り率（rate=False なら回数）。"""
+        data = self.heatmap / max(1, len(self.names)) if rate else self.heatmap
+        return pd.DataFrame(data, index=pd.Index(range(self.module), name="gy"),
+                            columns=pd.Index(range(self.module), name="gx"))
+
+
+def compare(pred: VectorSet, truth: VectorSet, finder_size: int = 7, chunk: int = 65536) -> CorpusErrors:
+    """
+    両方にある name だけを突き合わせ、詰めたビットのまま XOR → popcount で誤りを数える。
+    位置ごとのヒートマップだけは chunk 枚ずつ展開して足し込む（メモリは chunk×module² バイト程度）。
+    """
+    if pred.module != truth.module:
+        raise ValueError(f"module が一致しません: pred={pred.module}, truth={truth.module}")
+    module = pred.module
+    names = sorted(set(pred.names) & set(truth.names))
+    p = pred.subset(names).bits
+    t = truth.subset(names).bits
+
+    masks = region_masks(module, finder_size)
+    packed_masks = [np.packbits(masks[r].ravel()) for r in REGIONS]
+    n_cells = module * module
+
+    errors = np.empty((len(names), len(REGIONS)), dtype=np.int32)
+    heatmap = np.zeros(n_cells, dtype=np.int64)
+    for start in range(0, len(names), chunk):
+        diff = np.bitwise_xor(p[start:start + chunk], t[start:start + chunk])
+        for k, m in enumerate(packed_masks):
+            errors[start:start + chunk, k] = np.bitwise_count(diff & m).sum(axis=1, dtype=np.int32)
+        heatmap += np.unpackbits(diff, axis=1, count=n_cells).sum(axis=0, dtype=np.int64)
+
+    return CorpusErrors(
+        names=names,
+        module=module,
+        errors=errors,
+        region_cells={r: int(masks[r].sum()) for r in REGIONS},
+        heatmap=heatmap.reshape(module, module),
+    )
+
+
+def main(argv: List[str] | None = None) -> None:
+    ap = argparse.ArgumentParser(description="ベクトルと正解行列を突き合わせてビット誤り率を集計する")
+    ap.add_argument("pred", help="予測（qr_vector 形式のディレクトリ / results.sqlite3 / .npz）")
+    ap.add_argument("truth", help="正解（同上）")
+    ap.add_argument("--module", type=int, default=33)
+    ap.add_argument("--finder-size", type=int, default=7)
+    ap.add_argument("--out", default=os.path.join("qr_statistics", "analytics"), help="CSV の出力先ディレクトリ")
+    args = ap.parse_args(argv)
+
+    result = compare(load_vectors(args.pred, args.module), load_vectors(args.truth, args.module), args.finder_size)
+    if not result.names:
+        raise SystemExit("エラー: 予測と正解で共通する name がありません。")
+
+    os.makedirs(args.out, exist_ok=True)
+    result.per_image().to_csv(os.path.join(args.out, "per_image.csv"))
+    summary = result.region_summary()
+    summary.to_csv(os.path.join(args.out, "regions.csv"))
+    result.heatmap_frame().to_csv(os.path.join(args.out, "heatmap.csv"))
+    print(f"[Analytics] {len(result.names)} 枚を比較")
+    print(summary.to_string())
+    print(f"[Analytics] per_image.csv / regions.csv / heatmap.csv を '{args.out}' に保存しました。")
+
+
+if __name__ == "__main__":
+    main()
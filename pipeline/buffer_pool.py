@@ -0,0 +1,52 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class BufferPool:
+    """
+    用途名・形・dtype ごとに numpy バッファを使い回すプール。
+
+    - 同じサイズの画像を続けて処理する限り、2回目以降は大きな配列を確保しない
+    - 形がばらばらな入力でメモリが増え続けないよう、max_entries を超えたら古いものから捨てる
+    - スレッドセーフではない。スレッドごとに local_pool() で取得して使う
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._buffers: OrderedDict = OrderedDict()
+        self.allocations = 0   # 新規確保した回数（再利用がきいているかの確認用）
+
+    def get(self, name: str, shape: tuple, dtype=np.uint8) -> np.ndarray:
+        """バッファを返す。中身は前回の値が残っているので、呼び出し側で全体を書き直すこと。"""
+        key = (name, tuple(int(s) for s in shape), np.dtype(dtype).str)
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = np.empty(key[1], dtype=dtype)
+            self._buffers[key] = buf
+            self.allocations += 1
+            while len(self._buffers) > self.max_entries:
+                self._buffers.popitem(last=False)
+        else:
+            self._buffers.move_to_end(key)
+        return buf
+
+    def clear(self) -> None:
+        self._buffers.clear()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(b.nbytes for b in self._buffers.values())
+
+
+_LOCAL = threading.local()
+
+
+def local_pool() -> BufferPool:
+    """呼び出し元スレッド専用の BufferPool（ワーカーごとに1つ）。"""
+    pool = getattr(_LOCAL, "pool", None)
+    if pool is None:
+        pool = BufferPool()
+        _LOCAL.pool = pool
+    return pool
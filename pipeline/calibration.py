@@ -0,0 +1,137 @@
+import json
+import os
+import random
+from datetime import datetime
+from typing import Any, Dict, List
+
+import cv2
+import numpy as np
+
+from pipeline.qr_enhancer import cell_means
+
+# プロファイルが決めるしきい値（QREnhancer の同名の引数）
+CALIBRATED_KEYS = ("top_row_thresh", "avg_thresh")
+
+
+def otsu_threshold(hist: np.ndarray) -> tuple[float, float]:
+    """
+    0〜len(hist)-1 のヒストグラムに大津の方法を適用し (しきい値, 分離度) を返す。
+    分離度はクラス間分散 / 全分散（0〜1、1 に近いほどはっきり二峰）。
+    しきい値は「これ以上なら白」の境界（上側クラスの最小値）として返す。
+    """
+    hist = np.asarray(hist, dtype=np.float64)
+    total = hist.sum()
+    if total == 0:
+        return float("nan"), 0.0
+    levels = np.arange(hist.size, dtype=np.float64)
+    w0 = np.cumsum(hist)
+    w1 = total - w0
+    mu_cum = np.cumsum(hist * levels)
+    mu_t = mu_cum[-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (mu_t * w0 - total * mu_cum) ** 2 / (w0 * w1 * total * total)
+    between = np.nan_to_num(between, nan=0.0, posinf=0.0)
+    k = int(np.argmax(between))
+    var_t = (hist * (levels - mu_t / total) ** 2).sum() / total
+    separability = float(between[k] / var_t) if var_t > 0 else 0.0
+    return float(k + 1), separability
+
+
+class ThresholdCalibrator:
+    """
+    バッチの一部をサンプリングしてセル平均の分布からしきい値を推定する。
+
+    - トップ行（finder 列を除く）と本体（finder 領域を除く）を別々に集計
+    - それぞれ大津の方法で二峰を分けるしきい値を求める
+    - 二峰性が弱い（分離度が min_separability 未満。一様分布で約 0.75）場合は既定値を維持する
+    """
+
+    def __init__(
+        self,
+        module: int = 33,
+        finder_size: int = 7,
+        sample_size: int = 200,
+        min_separability: float = 0.8,
+        seed: int = 0,
+    ):
+        self.module = module
+        self.finder_size = finder_size
+        self.sample_size = sample_size
+        self.min_separability = min_separability
+        self.seed = seed
+
+    def _masks(self) -> tuple[np.ndarray, np.ndarray]:
+        m, fs = self.module, self.finder_size
+        finder = np.zeros((m, m), dtype=bool)
+        finder[:fs, :fs] = True
+        finder[:fs, m - fs:] = True
+        finder[m - fs:, :fs] = True
+        top = np.zeros((m, m), dtype=bool)
+        top[0, :] = True
+        return top & ~finder, ~top & ~finder
+
+    def reset(self) -> None:
+        self._top_hist = np.zeros(256, dtype=np.int64)
+        self._body_hist = np.zeros(256, dtype=np.int64)
+        self._used = 0
+
+    def add_cell_means(self, means: np.ndarray) -> bool:
+        """1画像分の (module, module) セル平均を集計に加える。形が合わなければ False。"""
+        if means.shape != (self.module, self.module):
+            return False
+        if not hasattr(self, "_used"):
+            self.reset()
+        top_mask, body_mask = self._masks()
+        self._top_hist += np.bincount(np.clip(means[top_mask], 0, 255).astype(np.int64), minlength=256)
+        self._body_hist += np.bincount(np.clip(means[body_mask], 0, 255).astype(np.int64), minlength=256)
+        self._used += 1
+        return True
+
+    def fit(self, defaults: Dict[str, Any]) -> Dict[str, Any]:
+        """ここまでの集計からしきい値プロファイルを作る。"""
+        if not hasattr(self, "_used"):
+            self.reset()
+        profile: Dict[str, Any] = {
+            "module": self.module,
+            "method": "otsu",
+            "samples": self._used,
+            "created": datetime.now().isoformat(timespec="seconds"),
+        }
+        for key, hist in zip(CALIBRATED_KEYS, (self._top_hist, self._body_hist)):
+            thresh, sep = otsu_threshold(hist)
+            ok = self._used > 0 and sep >= self.min_separability
+            profile[key] = int(round(thresh)) if ok else int(defaults[key])
+            profile[key + "_fit"] = {
+                "otsu": None if np.isnan(thresh) else thresh,
+                "separability": round(sep, 4),
+                "accepted": bool(ok),
+                "cells": int(hist.sum()),
+            }
+        return profile
+
+    def calibrate(self, paths: List[str], defaults: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        paths からサンプルを読み、しきい値プロファイル（dict）を返す。
+        defaults は {"top_row_thresh": ..., "avg_thresh": ...}（二峰にならない時の値）。
+        """
+        rng = random.Random(self.seed)
+        sample = paths if len(paths) <= self.sample_size else rng.sample(paths, self.sample_size)
+
+        self.reset()
+        for p in sample:
+            img = cv2.imread(p, cv2.IMREAD_GRAYSCALE)
+            if img is None or min(img.shape) < self.module:
+                continue
+            self.add_cell_means(cell_means(img, self.module))
+        return self.fit(defaults)
+
+
+def save_profile(profile: Dict[str, Any], path: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+
+
+def load_profile(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
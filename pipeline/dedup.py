@@ -0,0 +1,110 @@
+import os
+from typing import Dict, List
+
+import cv2
+import numpy as np
+
+HASH_THUMB = 64   # DCT をとる縮小画像の一辺
+HASH_FREQ = 16    # 低周波側 HASH_FREQ×HASH_FREQ 係数（直流を除く 255 ビット）
+
+
+def phash(img: np.ndarray) -> int:
+    """
+    グレースケール画像の知覚ハッシュ（pHash）を int で返す。
+    QR コードは 8×8 程度の低周波ではどれも似て見えるので、16×16 係数まで使う。
+    """
+    thumb = cv2.resize(img, (HASH_THUMB, HASH_THUMB), interpolation=cv2.INTER_AREA).astype(np.float32)
+    coeffs = cv2.dct(thumb)[:HASH_FREQ, :HASH_FREQ].ravel()[1:]
+    bits = coeffs > np.median(coeffs)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def phash_path(path: str) -> int | None:
+    """縮小デコードで読み込んでハッシュを求める（フル解像度で読む必要はない）。"""
+    img = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if img is None or min(img.shape) < HASH_FREQ:
+        img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    return phash(img)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """ハミング距離の BK-tree。半径 r 以内の検索で距離の三角不等式を使って枝を刈る。"""
+
+    def __init__(self):
+        self._root = None   # [hash, item, {distance: child}]
+        self.size = 0
+
+    def add(self, h: int, item) -> None:
+        self.size += 1
+        if self._root is None:
+            self._root = [h, item, {}]
+            return
+        node = self._root
+        while True:
+            d = hamming(h, node[0])
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, item, {}]
+                return
+            node = child
+
+    def query(self, h: int, radius: int) -> List[tuple[int, object]]:
+        """(距離, item) を距離の近い順に返す。"""
+        if self._root is None:
+            return []
+        found = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= radius:
+                found.append((d, node[1]))
+            for cd, child in node[2].items():
+                if d - radius <= cd <= d + radius:
+                    stack.append(child)
+        found.sort(key=lambda t: t[0])
+        return found
+
+
+def cluster_near_duplicates(paths: List[str], radius: int = 20) -> Dict[str, Dict]:
+    """
+    paths を先頭から順に見て、既存の代表から radius 以内なら最も近い代表のメンバーに、
+    そうでなければ新しい代表にする。
+    戻り値は {代表パス: {"members": [(パス, 距離), ...]}}（代表自身は members に含めない）。
+    ハッシュを計算できない画像は単独の代表として扱う。
+    """
+    tree = BKTree()
+    clusters: Dict[str, Dict] = {}
+    for path in paths:
+        h = phash_path(path)
+        if h is not None:
+            near = tree.query(h, radius)
+            if near:
+                d, rep = near[0]
+                clusters[rep]["members"].append((path, d))
+                continue
+            tree.add(h, path)
+        clusters[path] = {"members": []}
+    return clusters
+
+
+def summarize(clusters: Dict[str, Dict]) -> dict:
+    total = sum(1 + len(c["members"]) for c in clusters.values())
+    return {
+        "images": total,
+        "representatives": len(clusters),
+        "reduction": round(total / len(clusters), 3) if clusters else 1.0,
+        "clusters": [
+            {
+                "representative": os.path.basename(rep),
+                "members": [{"file": os.path.basename(p), "distance": d} for p, d in c["members"]],
+            }
+            for rep, c in clusters.items() if c["members"]
+        ],
+    }
@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+from typing import Dict, Iterable, List
+
+# 拡張子違いで元画像を探すときの優先順
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".PNG", ".JPG", ".JPEG")
+
+
+class IndexedFile:
+    """索引の1エントリ。size / mtime_ns は初回参照時に1回だけ stat する。"""
+
+    __slots__ = ("name", "path", "stem", "ext", "_dirent", "_stat")
+
+    def __init__(self, name: str, path: str, dirent: os.DirEntry | None = None):
+        self.name = name
+        self.path = path
+        self.stem, self.ext = os.path.splitext(name)
+        self._dirent = dirent
+        self._stat = None
+
+    def stat(self) -> os.stat_result:
+        if self._stat is None:
+            self._stat = self._dirent.stat() if self._dirent is not None else os.stat(self.path)
+        return self._stat
+
+    @property
+    def size(self) -> int:
+        return self.stat().st_size
+
+    @property
+    def mtime_ns(self) -> int:
+        return self.stat().st_mtime_ns
+
+
+def _ext_filter(exts: Iterable[str] | str | None):
+    if exts is None:
+        return None
+    if isinstance(exts, str):
+        exts = (exts,)
+    return tuple(e.lower() for e in exts)
+
+
+class DirIndex:
+    """
+    1つのディレクトリを os.scandir で1回だけ走査し、ファイル名・stem から実パスを引く索引。
+
+    - 存在確認・拡張子違いの探索・一覧はすべて索引上で行うので、ファイルごとの stat は起きない
+      （size / mtime が必要になったエントリだけ stat する）
+    - 自分で書き出したファイルは add() で登録する（ディレクトリを走査し直さない）
+    - 長時間動くプロセスでは check_interval 秒ごとにディレクトリの mtime を1回だけ調べ、
+      変わっていれば走査し直す。None なら invalidate() / refresh() するまで同じ索引を使う
+    """
+
+    def __init__(self, path: str | os.PathLike, check_interval: float | None = None):
+        self.path = os.fspath(path)
+        self.check_interval = check_interval
+        self.scans = 0   # 走査した回数（索引がきいているかの確認用）
+        self._lock = threading.Lock()
+        self._by_name: Dict[str, IndexedFile] | None = None
+        self._by_stem: Dict[str, Dict[str, IndexedFile]] = {}
+        self._dir_mtime: int | None = None
+        self._last_check = 0.0
+
+    # ---------- 走査・無効化 ----------
+    def _dir_sig(self) -> int | None:
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _scan(self) -> None:
+        self._dir_mtime = self._dir_sig()
+        self._last_check = time.monotonic()
+        self._by_name = {}
+        self._by_stem = {}
+        try:
+            with os.scandir(self.path) as it:
+                for e in it:
+                    if e.is_file():
+                        self._put(IndexedFile(e.name, e.path, e))
+        except FileNotFoundError:
+            pass
+        self.scans += 1
+
+    def _put(self, f: IndexedFile) -> None:
+        self._by_name[f.name] = f
+        self._by_stem.setdefault(f.stem, {})[f.ext] = f
+
+    def _ensure(self) -> Dict[str, IndexedFile]:
+        with self._lock:
+            if self._by_name is None:
+                self._scan()
+            elif self.check_interval is not None and time.monotonic() - self._last_check >= self.check_interval:
+                self._last_check = time.monotonic()
+                if self._dir_sig() != self._dir_mtime:
+                    self._scan()
+            return self._by_name
+
+    def invalidate(self) -> None:
+        """次回のアクセス時に走査し直す。"""
+        with self._lock:
+            self._by_name = None
+
+    def refresh(self) -> None:
+        """いますぐ走査し直す。"""
+        with self._lock:
+            self._scan()
+
+    def add(self, path: str | os.PathLike) -> None:
+        """このプロセスが書き出した（上書きした）ファイルを索引に反映する。"""
+        path = os.fspath(path)
+        with self._lock:
+            if self._by_name is None:
+                return   # まだ走査していなければ次の走査で拾われる
+            name = os.path.basename(path)
+            old = self._by_name.pop(name, None)
+            if old is not None:
+                self._by_stem[old.stem].pop(old.ext, None)
+            self._put(IndexedFile(name, os.path.join(self.path, name)))
+
+    # ---------- 参照 ----------
+    def get(self, name: str) -> IndexedFile | None:
+        return self._ensure().get(name)
+
+    def exists(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def find_stem(self, stem: str, exts: Iterable[str] = IMAGE_EXTS) -> IndexedFile | None:
+        """stem が一致するファイルを exts の優先順で探す。"""
+        self._ensure()
+        with self._lock:
+            by_ext = self._by_stem.get(stem)
+            if not by_ext:
+                return None
+            for ext in exts:
+                f = by_ext.get(ext)
+                if f is not None:
+                    return f
+        return None
+
+    def find(self, name: str, exts: Iterable[str] = IMAGE_EXTS) -> IndexedFile | None:
+        """同名があればそれを、なければ同じ stem の拡張子違いを返す。"""
+        return self.get(name) or self.find_stem(os.path.splitext(name)[0], exts)
+
+    def entries(self, exts: Iterable[str] | str | None = None) -> List[IndexedFile]:
+        """exts（大文字小文字を区別しない）で絞ったエントリをファイル名順に返す。"""
+        wanted = _ext_filter(exts)
+        by_name = self._ensure()
+        with self._lock:
+            files = [f for f in by_name.values() if wanted is None or f.ext.lower() in wanted]
+        return sorted(files, key=lambda f: f.name)
+
+    def names(self, exts: Iterable[str] | str | None = None, key=None) -> List[str]:
+        names = [f.name for f in self.entries(exts)]
+        return sorted(names, key=key) if key is not None else names
@@ -0,0 +1,202 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List
+
+import cv2
+import numpy as np
+
+from pipeline.qr_enhancer import QREnhancer
+from pipeline.qr_decode import QRCodeDecoder
+
+
+class ServiceBusy(Exception):
+    """待ち行列が満杯で新しいリクエストを受け付けられない。"""
+
+
+class MicroBatchScheduler:
+    """
+    画像バイト列の鮮明化リクエストを小さなバッチにまとめてワーカープールへ流すスケジューラ。
+
+    - 収集スレッドが最初の1件を受け取ってから max_wait_ms だけ待ち、最大 max_batch 件を1バッチにする
+    - バッチは QREnhancer.binarize_batch で同じサイズの画像をまとめて配列演算し、
+      バッチどうしはスレッドプールで並列に処理する（cv2/numpy/zbar は GIL を離すので並列に効く）
+    - QREnhancer は状態を持つため、ワーカースレッドごとに1つずつ持つ
+    - 処理中のバッチは workers 個まで。空きがない間は収集スレッドが待つので待ち行列に溜まり、
+      待ち行列は max_queue で打ち切り、溢れたら ServiceBusy（遅延の上限を保つため）
+    """
+
+    def __init__(
+        self,
+        enhancer_params: dict | None = None,
+        workers: int | None = None,
+        max_batch: int = 8,
+        max_wait_ms: float = 5.0,
+        max_queue: int = 1024,
+        decode_scale: int = 4,
+    ):
+        self.enhancer_params = dict(enhancer_params or {})
+        self.enhancer_params.setdefault("verbose", False)
+        self.workers = workers or os.cpu_count() or 1
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.decode_scale = decode_scale
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="qr-enhance")
+        # プールの内部キューは上限がないので、投入できるバッチ数をワーカー数で抑える
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._local = threading.local()
+        self._closed = threading.Event()
+        self._collector = threading.Thread(target=self._collect_loop, name="qr-batcher", daemon=True)
+        self._collector.start()
+
+    # ---------- 公開API ----------
+    def submit(self, data: bytes) -> Future:
+        """画像バイト列を1件投入し、結果 dict を返す Future を得る。"""
+        if self._closed.is_set():
+            raise RuntimeError("scheduler is closed")
+        fut: Future = Future()
+        try:
+            self._queue.put_nowait((data, fut, time.perf_counter()))
+        except queue.Full:
+            raise ServiceBusy("enhance queue is full")
+        return fut
+
+    def enhance(self, data: bytes, timeout: float | None = None) -> Dict[str, Any]:
+        return self.submit(data).result(timeout=timeout)
+
+    def enhance_many(self, items: List[bytes], timeout: float | None = None) -> List[Dict[str, Any]]:
+        """全件の結果を返す。timeout は全体で共有する期限（1件ごとではない）。"""
+        futures = [self.submit(d) for d in items]
+        done, pending = wait(futures, timeout=timeout, return_when=FIRST_EXCEPTION)
+        if pending:
+            for f in pending:
+                f.cancel()
+            failed = next((f for f in done if f.exception() is not None), None)
+            if failed is not None:
+                raise failed.exception()
+            raise TimeoutError(f"enhance_many: {len(pending)}/{len(futures)} 件が期限内に終わりませんでした")
+        return [f.result() for f in futures]
+
+    def close(self) -> None:
+        """新規受付を止め、処理中のバッチは終わらせ、待ち行列に残った分は RuntimeError で終わらせる。"""
+        self._closed.set()
+        self._collector.join(timeout=1.0)
+        while True:
+            try:
+                _, fut, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if fut.set_running_or_notify_cancel():
+                fut.set_exception(RuntimeError("scheduler is closed"))
+        self._pool.shutdown(wait=True)
+
+    # ---------- 内部 ----------
+    def _collect_loop(self) -> None:
+        while not self._closed.is_set():
+            # ワーカーが空くまで待ち行列から取り出さない（取り出さなければ submit 側で ServiceBusy になる）
+            if not self._slots.acquire(timeout=0.1):
+                continue
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                self._slots.release()
+                continue
+            batch = [first]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._pool.submit(self._run_batch, batch)
+            except RuntimeError as e:   # close() でプールが止まった後
+                self._slots.release()
+                for _, fut, _ in batch:
+                    if fut.set_running_or_notify_cancel():
+                        fut.set_exception(e)
+
+    def _worker_state(self) -> tuple[QREnhancer, QRCodeDecoder]:
+        st = getattr(self._local, "state", None)
+        if st is None:
+            st = (QREnhancer(**self.enhancer_params), QRCodeDecoder())
+            self._local.state = st
+        return st
+
+    def _run_batch(self, batch) -> None:
+        try:
+            self._run_batch_items(batch)
+        finally:
+            self._slots.release()
+
+    def _run_batch_items(self, batch) -> None:
+        enhancer, decoder = self._worker_state()
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            results = self._process_batch(enhancer, decoder, [data for data, _, _ in batch])
+        except Exception as e:
+            for _, fut, _ in batch:
+                fut.set_exception(e)
+            return
+        now = time.perf_counter()
+        for (_, fut, t_enqueue), result in zip(batch, results):
+            result["timings"]["queue_ms"] = round((now - t_enqueue) * 1000.0 - result["timings"]["total_ms"], 3)
+            result["batch_size"] = len(batch)
+            fut.set_result(result)
+
+    def _process_batch(self, enhancer: QREnhancer, decoder: QRCodeDecoder, items: List[bytes]) -> List[Dict[str, Any]]:
+        """
+        バッチ内の画像を読み込み、binarize_batch でまとめて鮮明化してから1件ずつデコードする。
+        enhance_ms はバッチ全体の鮮明化時間（各リクエストはその分だけ待つ）。
+        """
+        images: List[np.ndarray | None] = []
+        decode_ms: List[float] = []
+        for data in items:
+            t0 = time.perf_counter()
+            buf = np.frombuffer(data, dtype=np.uint8)
+            images.append(cv2.imdecode(buf, cv2.IMREAD_GRAYSCALE) if buf.size else None)
+            decode_ms.append((time.perf_counter() - t0) * 1000.0)
+        shapes = [None if img is None else img.shape for img in images]
+
+        t1 = time.perf_counter()
+        matrices = enhancer.binarize_batch(images)
+        enhance_ms = (time.perf_counter() - t1) * 1000.0
+
+        results = []
+        for shape, modules, image_decode_ms in zip(shapes, matrices, decode_ms):
+            if shape is None or modules is None:
+                results.append({
+                    "ok": False,
+                    "error": "cannot decode image bytes" if shape is None else f"image too small for module={enhancer.module}",
+                    "timings": {"image_decode_ms": round(image_decode_ms, 3), "total_ms": round(image_decode_ms, 3)},
+                })
+                continue
+            h, w = shape
+            t2 = time.perf_counter()
+            payload = decoder.decode_modules(modules, scale=self.decode_scale)
+            qr_decode_ms = (time.perf_counter() - t2) * 1000.0
+            results.append({
+                "ok": True,
+                "module": enhancer.module,
+                "width": int(w),
+                "height": int(h),
+                "vector": modules.tolist(),
+                "payload": payload,
+                "decoded": payload is not None,
+                "timings": {
+                    "image_decode_ms": round(image_decode_ms, 3),
+                    "enhance_ms": round(enhance_ms, 3),
+                    "qr_decode_ms": round(qr_decode_ms, 3),
+                    "total_ms": round(image_decode_ms + enhance_ms + qr_decode_ms, 3),
+                },
+            })
+        return results
@@ -0,0 +1,109 @@
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+from pipeline.qr_validate import FORMAT_CODEWORDS, _layout
+
+_FORMAT_WEIGHTS = (1 << np.arange(15)).astype(np.int32)
+_FORMAT_INTS = FORMAT_CODEWORDS.astype(np.int32) @ _FORMAT_WEIGHTS
+
+
+def alignment_centers(version: int) -> list[int]:
+    """version ごとのアライメントパターン中心の座標（行・列共通、ISO/IEC 18004 表 E.1 と同じ値）。"""
+    if version == 1:
+        return []
+    n = version // 7 + 2
+    size = 4 * version + 17
+    step = 26 if version == 32 else (version * 4 + n * 2 + 1) // (n * 2 - 2) * 2
+    return [6] + sorted(size - 7 - k * step for k in range(n - 1))
+
+
+@dataclass(frozen=True)
+class FunctionPatterns:
+    """
+    version 固定で決まるセル（finder＋区切り・タイミング・アライメント・dark module・版情報）の
+    bool マスクと 0/1 値（1=黒）、形式情報 2 か所の座標。
+    """
+    version: int
+    mask: np.ndarray
+    values: np.ndarray
+    format_pos: tuple   # ((y1, x1), (y2, x2))、それぞれ bit0 から順の15セル
+
+
+@lru_cache(maxsize=None)
+def function_patterns(module: int) -> FunctionPatterns | None:
+    """module×module の QR コードの機能パターン（module が 21, 25, … 177 以外なら None）。"""
+    if module < 21 or (module - 17) % 4 or module > 177:
+        return None
+    version = (module - 17) // 4
+    mask = np.zeros((module, module), dtype=bool)
+    values = np.zeros((module, module), dtype=np.uint8)
+
+    def put(ys, xs, v) -> None:
+        mask[ys, xs] = True
+        values[ys, xs] = v
+
+    # finder（7×7）と区切りの白（外周1セル）
+    f = np.zeros((9, 9), dtype=np.uint8)
+    f[1:8, 1:8] = 1
+    f[2:7, 2:7] = 0
+    f[3:6, 3:6] = 1
+    for y0, x0 in ((-1, -1), (-1, module - 8), (module - 8, -1)):
+        ys, xs = np.mgrid[0:9, 0:9]
+        yy, xx = ys + y0, xs + x0
+        inside = (yy >= 0) & (yy < module) & (xx >= 0) & (xx < module)
+        put(yy[inside], xx[inside], f[ys[inside], xs[inside]])
+
+    # タイミングパターン（6行目・6列目、偶数位置が黒）
+    t = np.arange(8, module - 8)
+    put(np.full(t.size, 6), t, (t % 2 == 0).astype(np.uint8))
+    put(t, np.full(t.size, 6), (t % 2 == 0).astype(np.uint8))
+
+    # アライメントパターン（finder と重なる3か所は置かない。タイミングとは重なっても値が同じ）
+    a = np.ones((5, 5), dtype=np.uint8)
+    a[1:4, 1:4] = 0
+    a[2, 2] = 1
+    centers = alignment_centers(version)
+    last = centers[-1] if centers else None
+    for cy in centers:
+        for cx in centers:
+            if (cy, cx) in ((6, 6), (6, last), (last, 6)):
+                continue
+            ys, xs = np.mgrid[cy - 2:cy + 3, cx - 2:cx + 3]
+            put(ys, xs, a)
+
+    # dark module（常に黒）
+    put(module - 8, 8, 1)
+
+    # 版情報（version 7 以上、右上と左下の 6×3。位置と符号語は StructureValidator と共有）
+    layout = _layout(module)
+    if "version" in layout:
+        (y1, x1), (y2, x2), code = layout["version"]
+        put(y1, x1, code)
+        put(y2, x2, code)
+
+    mask.setflags(write=False)
+    values.setflags(write=False)
+    # 形式情報は誤り訂正レベルとマスクで値が変わるので位置だけ持つ（snap_format で1枚ごとに合わせる）
+    return FunctionPatterns(version, mask, values, layout["format"])
+
+
+def snap_format(modules: np.ndarray, fp: FunctionPatterns, max_errors: int = 3) -> np.ndarray:
+    """
+    形式情報 2 か所を、2 か所合算のハミング距離が最小の正しい符号語で両方とも書き直す。
+    どちらの写しもその符号語から max_errors（BCH で訂正できる 3 ビット）を超えて離れていればそのまま。
+    modules は (..., module, module) の 0/1 配列で、その場で書き換える。
+    """
+    (y1, x1), (y2, x2) = fp.format_pos
+    c1 = modules[..., y1, x1]
+    c2 = modules[..., y2, x2]
+    # 15 ビットを整数に詰めて XOR → popcount で 32 符号語との距離を一度に求める
+    d1 = np.bitwise_count((c1 @ _FORMAT_WEIGHTS)[..., None] ^ _FORMAT_INTS)
+    d2 = np.bitwise_count((c2 @ _FORMAT_WEIGHTS)[..., None] ^ _FORMAT_INTS)
+    best = (d1 + d2).argmin(axis=-1)[..., None]
+    near = np.minimum(np.take_along_axis(d1, best, axis=-1), np.take_along_axis(d2, best, axis=-1)) <= max_errors
+    code = FORMAT_CODEWORDS[best[..., 0]]
+    modules[..., y1, x1] = np.where(near, code, c1)
+    modules[..., y2, x2] = np.where(near, code, c2)
+    return modules
@@ -0,0 +1,76 @@
+import cv2
+import numpy as np
+from PIL import Image
+
+# 縮小読み込みの倍率 → cv2 のフラグ（JPEG は DCT 段階で縮小されるのでデコード自体が速い）
+_REDUCED_FLAGS = {
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+# EXIF Orientation のうち縦横が入れ替わるもの（90°/270° 回転を含む）
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def read_image_size(path: str) -> tuple[int, int] | None:
+    """
+    ヘッダだけ読んで (width, height) を返す（画素はデコードしない）。
+    cv2.imread は EXIF の向きを適用して読むので、それに合わせて縦横を入れ替えた値にする。
+    """
+    try:
+        with Image.open(path) as im:
+            w, h = im.size
+            if im.getexif().get(0x0112) in _TRANSPOSED_ORIENTATIONS:
+                w, h = h, w
+            return w, h
+    except Exception:
+        return None
+
+
+def choose_reduction(width: int, height: int, module: int, target_ppm: float | None) -> int:
+    """
+    1モジュールあたり target_ppm ピクセル以上を保てる最大の縮小倍率（1/2/4/8）。
+    target_ppm が None なら常に 1（フル解像度）。
+    """
+    if not target_ppm:
+        return 1
+    ppm = min(width, height) / float(module)
+    factor = 1
+    for f in (2, 4, 8):
+        if ppm / f >= target_ppm:
+            factor = f
+    return factor
+
+
+def source_size(path: str, shape: tuple[int, int], scale: int, localized: bool = False) -> tuple[int, int]:
+    """
+    処理した画像の shape (h, w) と縮小倍率から、Step2 の再生成に使う (width, height) を返す。
+    縮小読み込みした場合は元画像のヘッダの値（倍率を掛け戻すと端数でずれるため）。
+    位置検出で正規化した画像は元画像と別の大きさなので、倍率だけ掛け戻す。
+    """
+    h, w = shape
+    if scale > 1 and not localized:
+        size = read_image_size(path)
+        if size is not None:
+            return int(size[0]), int(size[1])
+    return int(round(w * scale)), int(round(h * scale))
+
+
+def load_gray(path: str, module: int = 33, target_ppm: float | None = None) -> tuple[np.ndarray | None, int]:
+    """
+    グレースケールで読み込み (画像, 縮小倍率) を返す。
+    target_ppm を指定するとヘッダのサイズから縮小倍率を決め、縮小デコードする。
+    縮小読み込みに失敗した場合はフル解像度で読み直す。
+    """
+    factor = 1
+    if target_ppm:
+        size = read_image_size(path)
+        if size is not None:
+            factor = choose_reduction(size[0], size[1], module, target_ppm)
+    if factor > 1:
+        img = cv2.imread(path, _REDUCED_FLAGS[factor])
+        if img is not None and min(img.shape) >= module:
+            return img, factor
+    return cv2.imread(path, cv2.IMREAD_GRAYSCALE), 1
@@ -0,0 +1,180 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+
+class JobCancelled(Exception):
+    """キャンセル要求を受けたジョブの進捗通知から投げられる。"""
+
+
+class JobBusy(Exception):
+    """同じ種類のジョブが既に実行中。"""
+
+
+class Job:
+    """
+    1回分のバックグラウンド実行。進捗は QRPipeline.on_progress と同じ形の dict で受け取る。
+    状態が変わるたびに version を進めて待っている購読者を起こす。
+    """
+
+    def __init__(self, kind: str, params: dict, max_failures_kept: int = 50):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.state = "queued"   # queued / running / done / failed / cancelled
+        self.phase: str | None = None
+        self.total = 0
+        self.done = 0
+        self.failures = 0
+        self.failed_items: deque = deque(maxlen=max_failures_kept)
+        self.error: str | None = None
+        self.result: Any = None
+        self.created_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.version = 0
+        self._phase_started = time.monotonic()
+        self._stopped: float | None = None   # 終了時刻（monotonic、最終スループット用）
+        self._cancel = threading.Event()
+        self._cond = threading.Condition()
+
+    # ---------- ワーカー側 ----------
+    def progress(self, event: dict) -> None:
+        if self._cancel.is_set():
+            raise JobCancelled()
+        with self._cond:
+            if "phase" in event:
+                self.phase = event["phase"]
+                self.total = int(event.get("total", 0))
+                self.done = 0
+                self._phase_started = time.monotonic()
+            if "done" in event:
+                self.done += 1
+                if not event.get("ok", True):
+                    self.failures += 1
+                    self.failed_items.append(str(event["done"]))
+            self._touch()
+
+    def _set_state(self, state: str, **fields) -> None:
+        with self._cond:
+            self.state = state
+            if self.finished:
+                self._stopped = time.monotonic()
+            for k, v in fields.items():
+                setattr(self, k, v)
+            self._touch()
+
+    def _touch(self) -> None:
+        self.version += 1
+        self._cond.notify_all()
+
+    # ---------- 呼び出し側 ----------
+    def cancel(self) -> None:
+        """実行中なら次の進捗通知で中断する（実行前なら開始しない）。"""
+        self._cancel.set()
+        with self._cond:
+            self._touch()
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ("done", "failed", "cancelled")
+
+    def wait_change(self, version: int, timeout: float) -> int:
+        """version から変わるか timeout 秒たつまで待ち、現在の version を返す。"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version or self.finished, timeout=timeout)
+            return self.version
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            phase_elapsed = (self._stopped or time.monotonic()) - self._phase_started
+            throughput = self.done / phase_elapsed if self.started_at and phase_elapsed > 0 else None
+            running = self.state == "running"
+            eta = (self.total - self.done) / throughput if running and throughput and self.total >= self.done else None
+            end = self.finished_at or time.time()
+            return {
+                "id": self.id,
+                "step": self.kind,
+                "params": self.params,
+                "state": self.state,
+                "phase": self.phase,
+                "done": self.done,
+                "total": self.total,
+                "failures": self.failures,
+                "failed_items": list(self.failed_items),
+                "throughput": round(throughput, 3) if throughput else None,
+                "eta_sec": round(eta, 1) if eta is not None else None,
+                "elapsed_sec": round(end - self.started_at, 1) if self.started_at else None,
+                "cancel_requested": self._cancel.is_set(),
+                "error": self.error,
+                "result": self.result,
+                "version": self.version,
+            }
+
+
+class JobRunner:
+    """
+    パイプラインのステップをバックグラウンドのスレッドプールで動かす。
+
+    - 種類（step1 / step2 …）ごとに同時に動かせるのは1つだけ（重ねて投入すると JobBusy）
+    - 仕事本体は fn(params, progress) の形で登録する。progress は各件の終了時に呼ばせ、
+      キャンセル要求があればそこで JobCancelled が投げられて中断する
+    - 終わったジョブは新しい順に history 件だけ残す
+    """
+
+    def __init__(self, workers: int = 2, history: int = 50):
+        self.history = history
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="qr-job")
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._active: Dict[str, Job] = {}
+
+    def submit(self, kind: str, fn: Callable[[dict, Callable[[dict], None]], Any], params: dict | None = None) -> Job:
+        params = dict(params or {})
+        with self._lock:
+            active = self._active.get(kind)
+            if active is not None and not active.finished:
+                raise JobBusy(f"{kind} は実行中です (job={active.id})")
+            job = Job(kind, params)
+            self._active[kind] = job
+            self._jobs[job.id] = job
+            self._trim()
+        self._pool.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job: Job, fn) -> None:
+        if job._cancel.is_set():
+            job._set_state("cancelled", finished_at=time.time())
+            return
+        job._set_state("running", started_at=time.time())
+        try:
+            result = fn(job.params, job.progress)
+        except JobCancelled:
+            job._set_state("cancelled", finished_at=time.time())
+        except Exception as e:
+            job._set_state("failed", error=f"{type(e).__name__}: {e}", finished_at=time.time())
+        else:
+            job._set_state("done", result=result, finished_at=time.time())
+
+    def _trim(self) -> None:
+        finished = [j for j in self._jobs.values() if j.finished]
+        for job in finished[: max(0, len(finished) - self.history)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())[::-1]
+
+    def close(self) -> None:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+        self._pool.shutdown(wait=True)
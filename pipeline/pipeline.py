@@ -1,41 +1,160 @@
 import os
 import json
-import cv2
+import time
 import numpy as np
-import matplotlib.pyplot as plt
-from typing import List, Dict, Any
+from typing import Any, Callable, Dict, List
 
 from pipeline.qr_enhancer import QREnhancer
 from pipeline.qr_decode import QRCodeDecoder
+from pipeline.image_io import load_gray, source_size
+from pipeline.top_row_stats import TopRowStatistics, plot_top_row_statistics
+from pipeline.calibration import ThresholdCalibrator, load_profile, save_profile
+from pipeline.video_source import VideoQRSource
+from pipeline.sheet import SheetProcessor
+from pipeline.qr_repair import QRRepairer
+from pipeline.qr_localizer import QRLocalizer
+from pipeline.quality import FAST, QualityRouter, estimate_quality
+from pipeline.qr_validate import StructureValidator
+from pipeline.dedup import cluster_near_duplicates, summarize
+from pipeline.dir_index import DirIndex
+from pipeline.recon_io import RECON_EXTS, recon_ext, write_reconstruction
+from pipeline.results_db import ResultsDB
+from pipeline.shm_transport import SharedMemoryRunner
+
+INPUT_EXTS = (".png", ".jpg", ".jpeg")
+# heavy 経路で avg_thresh をずらして試す順（0 = 現在のしきい値）
+HEAVY_THRESH_OFFSETS = (0, -24, 24, -48, 48)
+
+
+def _round_confidence(confidence: np.ndarray) -> List[List[float]]:
+    return np.round(np.asarray(confidence, dtype=np.float64), 3).tolist()
 
 
 class QRPipeline:
     """
     3ステップ実行に分割可能なパイプライン。
 
+    Step0: しきい値キャリブレーション（任意、qr_statistics/calibration.json。calibration= を渡した時だけ使う）
     Step1: ベクトル作成（qr_vector/*.json）
     Step2: JSON→画像再生成 ＋ デコード評価（evaluate.json）
     Step3: PDF等の外部評価は main.py 側で既存モジュールを呼ぶ
+    動画: qr_video/* をフレーム単位でデコードし evaluate_video.json に保存
+    シート: qr_sheet/* の複数コードを個別にベクトル化し evaluate_sheet.json に保存
+    修復: デコードできないベクトルを確信度の低いセルから反転して探索し、読めたら書き戻す
+
+    raimu_format で qr_raimu の書き出し形式を選ぶ（png8 / png1 / tiff_g4 / module、pipeline.recon_io 参照）。
+    Step1 / Step2 / 修復の結果は JSON に加えて results_db（既定 qr_statistics/results.sqlite3）にも
+    まとめて書く（pipeline.results_db 参照、results_db=False で無効）。
+    on_progress を設定すると各ステップの進み具合を dict で通知する
+    （{"phase", "total"} で段階の開始、{"done", "ok"} で1件終了。例外を投げれば中断できる）。
     """
 
     def __init__(self, tobako_dir: str, raimu_dir: str,
                  enhancer_params: dict = None,
                  vector_dir: str = "qr_vector",
-                 statistics_dir: str = "qr_statistics"):
+                 statistics_dir: str = "qr_statistics",
+                 calibration_path: str | None = None,
+                 calibration: str | bool = False,
+                 raimu_format: str = "png8",
+                 results_db: ResultsDB | str | bool | None = None):
         self.tobako_dir = tobako_dir
         self.raimu_dir = raimu_dir
         self.vector_dir = vector_dir
         self.statistics_dir = statistics_dir
-        self.enhancer = QREnhancer(**(enhancer_params or {}))
-        self.decoder = QRCodeDecoder()
+        self.raimu_format = raimu_format
+        self.calibration_path = calibration_path or os.path.join(statistics_dir, "calibration.json")
+        if results_db is False:
+            self.results_db = None
+        elif isinstance(results_db, ResultsDB):
+            self.results_db = results_db
+        else:
+            self.results_db = ResultsDB(results_db or os.path.join(statistics_dir, "results.sqlite3"))
+        self.enhancer_params = dict(enhancer_params or {})
+        self.enhancer = QREnhancer(**self.enhancer_params)
         self.module = self.enhancer.module
-        self._top_row_avgs_all: list[float] = []
+        self.decoder = QRCodeDecoder(module=self.module, target_ppm=self.enhancer.target_ppm)
+        self.validator = StructureValidator()
+        # 入出力ディレクトリは1回だけ走査し、以降の一覧・存在確認は索引で引く（書き出したものは add で反映）
+        self.tobako_index = DirIndex(tobako_dir)
+        self.raimu_index = DirIndex(raimu_dir)
+        self.vector_index = DirIndex(vector_dir)
+        # キャリブレーション結果は明示的に求められた時だけ使う（True なら calibration_path）
+        if calibration:
+            self.apply_calibration(self.calibration_path if calibration is True else calibration)
+        self._top_row_stats = TopRowStatistics(self.module, self.enhancer.top_row_thresh)
+        self.on_progress: Callable[[dict], None] | None = None
+        self._route_tools: tuple | None = None   # 振り分け用の (位置検出なしの QREnhancer, QRLocalizer, QRRepairer)
+
+    # ========= Step0 =========
+    def apply_calibration(self, profile: dict | str) -> bool:
+        """
+        キャリブレーション結果（dict または JSON パス）のしきい値をこのパイプラインに反映する。
+        enhancer_params で明示したしきい値はプロファイルより優先する。ファイルが無ければ何もせず False。
+        """
+        if isinstance(profile, str):
+            if not os.path.exists(profile):
+                print(f"[Calibration] '{profile}' が見つからないため、enhancer_params のしきい値を使います。")
+                return False
+            source, profile = profile, load_profile(profile)
+        else:
+            source = "Step0 の結果"
+        kept = [k for k in profile if k in self.enhancer_params and k != "module"]
+        self.enhancer.load_profile({k: v for k, v in profile.items() if k not in kept})
+        self._top_row_stats = TopRowStatistics(self.module, self.enhancer.top_row_thresh)
+        print(f"[Calibration] {source} のしきい値を使用: "
+              f"top_row_thresh={self.enhancer.top_row_thresh}, avg_thresh={self.enhancer.avg_thresh}"
+              + (f"（明示指定を優先: {', '.join(kept)}）" if kept else ""))
+        return True
+
+    def step0_calibrate_thresholds(self, sample_size: int = 200, apply: bool = False) -> dict | None:
+        """
+        入力画像の一部をサンプリングしてセル平均の分布から top_row_thresh / avg_thresh を推定し、
+        calibration.json に保存する。Step1 で使うには calibration= を渡してパイプラインを作るか、
+        apply=True でこのパイプラインに反映する（どちらも enhancer_params の明示指定が優先）。
+        """
+        if not os.path.exists(self.tobako_dir):
+            print(f"エラー: 入力ディレクトリ '{self.tobako_dir}' が見つかりません。")
+            return None
+        paths = [f.path for f in self.tobako_index.entries(INPUT_EXTS)]
+        self._progress(phase="calibrate", total=1)
+        calibrator = ThresholdCalibrator(
+            module=self.module,
+            finder_size=self.enhancer.finder_size,
+            sample_size=sample_size,
+        )
+        profile = calibrator.calibrate(
+            paths,
+            defaults={"top_row_thresh": self.enhancer.top_row_thresh, "avg_thresh": self.enhancer.avg_thresh},
+        )
+        save_profile(profile, self.calibration_path)
+        self._progress(done=self.calibration_path, ok=True)
+        if apply:
+            self.apply_calibration(profile)
+
+        for key in ("top_row_thresh", "avg_thresh"):
+            fit = profile[key + "_fit"]
+            state = "採用" if fit["accepted"] else "二峰性が弱いため既定値を維持"
+            print(f"[Calibration] {key}={profile[key]} (otsu={fit['otsu']}, 分離度={fit['separability']}, {state})")
+        print(f"[Calibration] {profile['samples']} 枚から推定し '{self.calibration_path}' に保存しました。")
+        return profile
 
     # ========= Step1 =========
-    def step1_make_vectors(self) -> None:
+    def step1_make_vectors(self, batch_size: int = 1, dedup_radius: int | None = None,
+                           processes: int = 1, router: QualityRouter | bool | None = None) -> None:
         """
         すべての入力画像を2値化→module×moduleの0/1ベクトルにし、qr_vector に JSON 保存。
-        併せてトップ行セル平均を集約し、qr_statistics/sikiiti.png を1枚だけ保存。
+        併せてトップ行セル平均をストリーミング集計し、qr_statistics/sikiiti.json と
+        sikiiti.png（集計から描画）を1組だけ保存。
+        batch_size > 1 なら同じサイズの画像をまとめて QREnhancer.binarize_batch で処理する。
+        dedup_radius を指定すると知覚ハッシュがその距離以内の画像をまとめ、代表1枚だけ処理して
+        他のメンバーには同じベクトルを "duplicate_of" 付きで保存する（qr_statistics/dedup.json）。
+        別のコードでもハッシュが近いことはあるので、メンバー自身の行列が代表と一致しなければ
+        そのメンバーは単独で処理する（既定の None なら重複をまとめない）。
+        processes > 1 なら SharedMemoryRunner で複数プロセスに分け、画像は共有メモリで受け渡す
+        （batch_size は使わない）。
+        router（True なら既定のしきい値の QualityRouter）を渡すと縮小画像の画質で1枚ずつ fast / heavy に
+        振り分け、判断と経路ごとのスループットを qr_statistics/routing.json と results_db に残す
+        （batch_size / processes は使わない）。
         """
         if not os.path.exists(self.tobako_dir):
             print(f"エラー: 入力ディレクトリ '{self.tobako_dir}' が見つかりません。")
@@ -51,50 +170,323 @@ class QRPipeline:
             except ValueError:
                 return 10**9
 
-        sorted_files = sorted(os.listdir(self.tobako_dir), key=_key)
+        sorted_files = self.tobako_index.names(INPUT_EXTS, key=_key)
 
-        for filename in sorted_files:
-            if not filename.lower().endswith((".png", ".jpg", ".jpeg")):
-                continue
-
-            print(f"\n[Step1] ベクトル化: '{filename}'")
-            in_path = os.path.join(self.tobako_dir, filename)
-            binary = self.enhancer.binarize(in_path)
-            if binary is None:
-                print(f"  警告: 読み込みor処理失敗: {in_path}")
+        members: Dict[str, List[tuple[str, int]]] = {}
+        if dedup_radius is not None:
+            clusters = cluster_near_duplicates(
+                [os.path.join(self.tobako_dir, f) for f in sorted_files], radius=dedup_radius
+            )
+            members = {
+                os.path.basename(rep): [(os.path.basename(p), d) for p, d in c["members"]]
+                for rep, c in clusters.items()
+            }
+            sorted_files = list(members)
+            summary = summarize(clusters)
+            print(f"[Dedup] {summary['images']} 枚 → 代表 {summary['representatives']} 枚を処理します")
+
+        if router is True:
+            router = QualityRouter()
+        db = self.results_db
+        params = self._run_params(batch_size=batch_size, dedup_radius=dedup_radius, processes=processes,
+                                  router=router.thresholds() if router else None)
+        run_id = db.begin_run("step1", params) if db is not None else None
+
+        self._progress(phase="vectorize", total=len(sorted_files))
+        standalone: List[str] = []   # 代表と行列が一致しなかったメンバー（単独で処理し直す）
+        for filename, res, per_image_ms in self._vectorized(sorted_files, batch_size, processes, router):
+            self._progress(done=filename, ok=res is not None)
+            if res is None:
+                standalone.extend(m for m, _ in members.get(filename, []))
                 continue
-
-            h, w = binary.shape
-            vector = self._binary_to_module_vector(binary)
-            out_json = os.path.join(self.vector_dir, f"{os.path.splitext(filename)[0]}.json")
-            with open(out_json, "w", encoding="utf-8") as f:
-                json.dump(
-                    {
-                        "file": filename,
-                        "module": self.module,
-                        "width": int(w),
-                        "height": int(h),
-                        "vector": vector,  # 0/1
-                    },
-                    f, ensure_ascii=False
-                )
-            print(f"  保存: {out_json}")
-
-            # トップ行平均の集約（NaN除外）
-            avgs = self.enhancer.get_top_row_avgs()
-            self._top_row_avgs_all.extend([float(a) for a in avgs if a == a])
+            obj = self._save_vector(filename, res, per_image_ms, db, run_id)
+
+            # 重複画像には、そのメンバー自身の行列が代表と一致する場合だけ代表の結果を配る
+            for member, distance in members.get(filename, []):
+                if not self._same_modules(member, obj["vector"]):
+                    print(f"  '{member}' は '{filename}' と行列が異なるため単独で処理します")
+                    standalone.append(member)
+                    continue
+                # 幅・高さはメンバー自身の元画像の値（比較で読んだ結果から）
+                mw, mh = source_size(os.path.join(self.tobako_dir, member), self.enhancer.last_shape,
+                                     self.enhancer.last_scale, self.enhancer.localizer is not None)
+                dup = dict(obj, file=member, width=mw, height=mh, duplicate_of=filename, duplicate_distance=distance)
+                dup_json = os.path.join(self.vector_dir, f"{os.path.splitext(member)[0]}.json")
+                with open(dup_json, "w", encoding="utf-8") as f:
+                    json.dump(dup, f, ensure_ascii=False)
+                self.vector_index.add(dup_json)
+                print(f"  保存: {dup_json}（'{filename}' の重複）")
+                if db is not None:
+                    db.add_vector(run_id, os.path.splitext(member)[0], member, obj["vector"],
+                                  mw, mh, res[4], duplicate_of=filename)
+
+        if standalone:
+            self._progress(phase="vectorize_standalone", total=len(standalone))
+            for filename, res, per_image_ms in self._vectorized(standalone, batch_size, processes, router):
+                self._progress(done=filename, ok=res is not None)
+                if res is not None:
+                    self._save_vector(filename, res, per_image_ms, db, run_id)
+
+        if dedup_radius is not None:
+            # 代表と一致せず単独で処理したメンバーも残す（半径の調整に使う）
+            summary["standalone"] = standalone
+            with open(os.path.join(self.statistics_dir, "dedup.json"), "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=4, ensure_ascii=False)
+            print(f"[Dedup] 代表と行列が一致せず単独で処理したもの {len(standalone)} 枚")
+        if router:
+            self._save_routing(router, db, run_id)
+        if db is not None:
+            db.end_run(run_id)
 
         # 1枚だけ統合プロットを保存（qr_statistics）
         self._save_combined_top_row_statistics(
             out_path=os.path.join(self.statistics_dir, "sikiiti.png"),
-            thresh=self.enhancer.top_row_thresh,
         )
 
+    def _save_vector(self, filename: str, res: tuple, per_image_ms: float,
+                     db: ResultsDB | None, run_id: int | None) -> dict:
+        """1枚分の結果を qr_vector/*.json と results_db に書き、トップ行平均を集計に足す。書いた dict を返す。"""
+        vector, w, h, top_avgs, confidence = res
+        obj = {
+            "file": filename,
+            "module": self.module,
+            "width": int(w),
+            "height": int(h),
+            "vector": vector,  # 0/1
+            "confidence": _round_confidence(confidence),  # 0〜1（低いほど判定が怪しい）
+        }
+        out_json = os.path.join(self.vector_dir, f"{os.path.splitext(filename)[0]}.json")
+        with open(out_json, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False)
+        self.vector_index.add(out_json)
+        print(f"  保存: {out_json}")
+        name = os.path.splitext(filename)[0]
+        if db is not None:
+            db.add_image(run_id, filename, w, h)
+            db.add_vector(run_id, name, filename, vector, w, h, confidence)
+            db.add_top_row(run_id, name, top_avgs, self.enhancer.top_row_thresh)
+            db.add_timing(run_id, name, "vectorize", per_image_ms)
+
+        # トップ行平均の集約（NaN は欠損として除外）
+        self._top_row_stats.update(top_avgs)
+        return obj
+
+    def _same_modules(self, filename: str, vector: List[List[int]]) -> bool:
+        """
+        ハッシュが近いだけの別コードに代表の結果を配らないよう、メンバー自身を（縮小読み込みのまま）
+        2値化して代表の行列と比べる。デコードより安く、一致しなければ単独で処理し直す。
+        """
+        modules = self.enhancer.modules_from_path(os.path.join(self.tobako_dir, filename))
+        return modules is not None and np.array_equal(modules, np.asarray(vector, dtype=modules.dtype))
+
+    def _vectorized(self, filenames: List[str], batch_size: int, processes: int,
+                    router: QualityRouter | None = None):
+        """(ファイル名, _vectorize_one と同じ結果 or None, 1枚あたりの処理時間 ms) を入力順に返す。"""
+        if router:
+            for filename in filenames:
+                t0 = time.perf_counter()
+                res = self._vectorize_routed(filename, router)
+                yield filename, res, (time.perf_counter() - t0) * 1000.0
+            return
+
+        if processes > 1:
+            params = {
+                key: getattr(self.enhancer, key)
+                for key in ("module", "white_thresh", "black_thresh", "avg_thresh", "top_row_thresh",
+                            "finder_size", "target_ppm", "function_patterns")
+            }
+            params["localize"] = self.enhancer.localizer is not None
+            with SharedMemoryRunner(enhancer_params=params, processes=processes, decode=False) as runner:
+                paths = [os.path.join(self.tobako_dir, f) for f in filenames]
+                for filename, r in zip(filenames, runner.imap(paths)):
+                    print(f"\n[Step1] ベクトル化(プロセス): '{filename}'")
+                    if "error" in r:
+                        print(f"  警告: 読み込みor処理失敗: {r['file']} ({r['error']})")
+                        yield filename, None, r["elapsed_ms"]
+                        continue
+                    res = (r["modules"].tolist(), r["width"], r["height"], r["top_row_avgs"], r["confidence"])
+                    yield filename, res, r["elapsed_ms"]
+                stats = runner.stats
+            print(f"[Step1] {stats['images']} 枚を {processes} プロセスで処理"
+                  f"（共有メモリ経由 {stats['shm_bytes'] / 1e6:.1f} MB, 枠に入らず各プロセスで読んだもの {stats['oversize']} 枚）")
+            return
+
+        for start in range(0, len(filenames), max(1, batch_size)):
+            chunk = filenames[start:start + max(1, batch_size)]
+            t0 = time.perf_counter()
+            if batch_size > 1:
+                results = self._vectorize_batch(chunk)
+            else:
+                results = [self._vectorize_one(chunk[0])]
+            # バッチ処理では1枚ごとの時間は取れないので平均を記録する
+            per_image_ms = (time.perf_counter() - t0) * 1000.0 / len(chunk)
+            for filename, res in zip(chunk, results):
+                yield filename, res, per_image_ms
+
+    def _vectorize_one(self, filename: str) -> tuple | None:
+        """1枚を (vector, width, height, トップ行平均, 確信度) にする。幅・高さは元画像の解像度。"""
+        print(f"\n[Step1] ベクトル化: '{filename}'")
+        in_path = os.path.join(self.tobako_dir, filename)
+        modules = self.enhancer.modules_from_path(in_path)
+        if modules is None:
+            print(f"  警告: 読み込みor処理失敗: {in_path}")
+            return None
+
+        # 縮小読み込みの結果が読めない場合はフル解像度でやり直す（構造が崩れていればデコードせずに判断）
+        if self.enhancer.last_scale > 1 and not self._decodable(modules):
+            print(f"  縮小読み込み(1/{self.enhancer.last_scale})でデコード不可 → フル解像度で再処理")
+            modules = self.enhancer.modules_from_path(in_path, full_res=True)
+            if modules is None:
+                print(f"  警告: 読み込みor処理失敗: {in_path}")
+                return None
+        vector = modules.tolist()
+
+        # 幅・高さは元画像の解像度で記録（Step2 の再生成サイズ）
+        w, h = source_size(in_path, self.enhancer.last_shape, self.enhancer.last_scale,
+                           self.enhancer.localizer is not None)
+        return vector, w, h, self.enhancer.get_top_row_avgs(), self.enhancer.last_confidence
+
+    def _vectorize_routed(self, filename: str, router: QualityRouter) -> tuple | None:
+        """
+        読み込んだ画像の縮小版で画質を見積もり、router の判断で fast / heavy のどちらかで処理する。
+        fast: 位置検出なしで1回2値化し、構造チェックだけで受け入れる（デコードしない）
+        heavy: フル解像度で位置検出 → avg_thresh を振り直して読めるものを探す → 読めなければ修復探索
+        fast で構造チェックに通らなかったものは heavy でやり直す。戻り値は _vectorize_one と同じ形。
+        """
+        print(f"\n[Step1] ベクトル化(振り分け): '{filename}'")
+        in_path = os.path.join(self.tobako_dir, filename)
+        t0 = time.perf_counter()
+        img, scale = load_gray(in_path, self.module, self.enhancer.target_ppm)
+        if img is None:
+            print(f"  警告: 読み込みor処理失敗: {in_path}")
+            return None
+        quality = estimate_quality(img, self.module)
+        route, reason = router.route(quality)
+        enhancer = self._routing_tools()[0]
+
+        res, ok, escalated = None, False, False
+        if route == FAST:
+            modules = enhancer.binarize_modules(img)
+            if modules is not None and self.validator.validate(modules).ok:
+                res, ok = self._routed_result(enhancer, modules, in_path, scale), True
+            else:
+                print("  fast で構造チェック不合格 → heavy で再処理")
+                escalated = True
+        if res is None:
+            res, ok = self._vectorize_heavy(in_path)
+        router.record(os.path.splitext(filename)[0], route, reason, quality,
+                      (time.perf_counter() - t0) * 1000.0, ok, escalated)
+        return res
+
+    def _vectorize_heavy(self, in_path: str) -> tuple[tuple | None, bool]:
+        """フル解像度・位置検出・しきい値の振り直し・修復探索で1枚を処理する。(結果, 構造チェック合格) を返す。"""
+        enhancer, localizer, repairer = self._routing_tools()
+        img, _ = load_gray(in_path, self.module, None)
+        if img is None:
+            print(f"  警告: 読み込みor処理失敗: {in_path}")
+            return None, False
+        img = localizer.normalize(img)
+
+        base = enhancer.avg_thresh
+        best = None   # (構造スコア, 結果, 構造チェック合格)
+        try:
+            for offset in HEAVY_THRESH_OFFSETS:
+                enhancer.avg_thresh = int(np.clip(base + offset, 1, 254))
+                modules = enhancer.binarize_modules(img)
+                if modules is None:
+                    continue
+                check = self.validator.validate(modules)
+                res = self._routed_result(enhancer, modules, in_path, 1)
+                if check.ok and self.decoder.decode_modules(modules) is not None:
+                    print(f"  heavy: avg_thresh={enhancer.avg_thresh} で読めました")
+                    return res, True
+                if best is None or check.score > best[0]:
+                    best = (check.score, res, check.ok)
+        finally:
+            enhancer.avg_thresh = base
+        if best is None:
+            return None, False
+
+        _, res, ok = best
+        vector, w, h, top_avgs, confidence = res
+        result = repairer.repair(vector, confidence)
+        if result.payload is None:
+            print(f"  heavy: しきい値の振り直し・修復探索でも読めず（{result.decodes} 回デコード）")
+            return res, ok
+        print(f"  heavy: {len(result.flipped)} セル反転で読めました")
+        return (result.modules.tolist(), w, h, top_avgs, confidence), True
+
+    def _routing_tools(self) -> tuple:
+        """振り分け処理用の部品を初回だけ作る（しきい値は現在の enhancer から写す）。"""
+        if self._route_tools is None:
+            params = {
+                key: getattr(self.enhancer, key)
+                for key in ("module", "white_thresh", "black_thresh", "avg_thresh", "top_row_thresh",
+                            "finder_size", "target_ppm", "function_patterns", "verbose")
+            }
+            self._route_tools = (
+                QREnhancer(**params),
+                self.enhancer.localizer or QRLocalizer(module=self.module, finder_size=self.enhancer.finder_size),
+                QRRepairer(decoder=self.decoder, validator=self.validator, max_decodes=100),
+            )
+        return self._route_tools
+
+    def _routed_result(self, enhancer: QREnhancer, modules: np.ndarray, in_path: str, scale: int) -> tuple:
+        w, h = source_size(in_path, enhancer.last_shape, scale, enhancer.localizer is not None)
+        return modules.tolist(), w, h, enhancer.get_top_row_avgs(), enhancer.last_confidence
+
+    def _save_routing(self, router: QualityRouter, db: ResultsDB | None, run_id: int | None) -> None:
+        """振り分けの判断（1枚ごと）と経路ごとの集計を routing.json と results_db に残す。"""
+        summary = router.summary()
+        out_path = os.path.join(self.statistics_dir, "routing.json")
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump({"thresholds": router.thresholds(), "routes": summary, "images": router.decisions},
+                      f, indent=4, ensure_ascii=False)
+        if db is not None:
+            for d in router.decisions:
+                db.add_route(run_id, **d)
+        for route, s in summary.items():
+            print(f"[Route] {route}: {s['images']} 枚, 構造チェック合格 {s['ok']}, heavy へ回した {s['escalated']}, "
+                  f"{s['ms_per_image']} ms/枚 ({s['images_per_sec']} 枚/秒)")
+        print(f"[Route] 振り分けの記録を '{out_path}' に保存しました。")
+
+    def _vectorize_batch(self, filenames: List[str]) -> List[tuple | None]:
+        """_vectorize_one と同じ結果を、読み込み後にまとめて2値化して求める。"""
+        loaded = [
+            load_gray(os.path.join(self.tobako_dir, f), self.module, self.enhancer.target_ppm)
+            for f in filenames
+        ]
+        images = [img for img, _ in loaded]
+        # 位置検出ありの場合 images は正規化後の画像に置き換わる（binarize と同じサイズを記録するため）
+        matrices = self.enhancer.binarize_batch(images)
+        top_avgs = self.enhancer.batch_top_row_avgs
+        confidence = self.enhancer.batch_confidence
+
+        results: List[tuple | None] = []
+        for k, filename in enumerate(filenames):
+            print(f"\n[Step1] ベクトル化(バッチ): '{filename}'")
+            scale = loaded[k][1]
+            if matrices[k] is None:
+                print(f"  警告: 読み込みor処理失敗: {os.path.join(self.tobako_dir, filename)}")
+                results.append(None)
+                continue
+            if scale > 1 and not self._decodable(matrices[k]):
+                # 縮小読み込みで読めないものだけ1枚ずつフル解像度でやり直す
+                results.append(self._vectorize_one(filename))
+                continue
+            w, h = source_size(os.path.join(self.tobako_dir, filename), images[k].shape, scale,
+                               self.enhancer.localizer is not None)
+            results.append((matrices[k].tolist(), w, h, top_avgs[k], confidence[k]))
+        return results
+
     # ========= Step2 =========
-    def step2_build_images_and_evaluate(self) -> None:
+    def step2_build_images_and_evaluate(self, skip_rejected: bool = False) -> None:
         """
-        qr_vector/*.json から画像を再生成し qr_raimu/*.png へ保存。
+        qr_vector/*.json から画像を再生成し qr_raimu へ raimu_format の形式で保存。
         その後、元画像 vs 再生成画像でデコード比較し evaluate.json に保存。
+        構造チェックの結果は各件に並べて記録するだけで、デコードは常に行う。
+        skip_rejected=True なら構造チェックで却下されたものの画像デコードを省く
+        （速くなるが、誤って却下したものは不一致として数えられる）。
         """
         if not os.path.exists(self.vector_dir):
             print(f"エラー: ベクトルディレクトリ '{self.vector_dir}' が見つかりません。まず Step1 を実行してください。")
@@ -108,46 +500,69 @@ class QRPipeline:
             except ValueError:
                 return 10**9
 
-        vector_files = sorted(
-            [f for f in os.listdir(self.vector_dir) if f.lower().endswith(".json")],
-            key=_key
-        )
+        vector_files = self.vector_index.names(".json", key=_key)
 
-        # JSON→画像
+        # JSON→画像（併せてベクトルの構造チェック。出力画像名 → 結果）
+        structure: Dict[str, Any] = {}
+        duplicate_of: Dict[str, str] = {}   # 出力画像名 → 代表の出力画像名
+        self._progress(phase="reconstruct", total=len(vector_files))
         for vec_name in vector_files:
             vec_path = os.path.join(self.vector_dir, vec_name)
             with open(vec_path, "r", encoding="utf-8") as f:
                 obj = json.load(f)
 
+            if "index" in obj:
+                # シート由来（旧形式で qr_vector 直下にあるもの）は qr_tobakosan に元画像がないので比較しない
+                print(f"[Step2] スキップ: {vec_name}（シート '{obj.get('file')}' の {obj['index']} 番、evaluate_sheet.json を参照）")
+                self._progress(done=vec_name, ok=True)
+                continue
             filename = obj.get("file") or f"{os.path.splitext(vec_name)[0]}.png"
             w = int(obj["width"])
             h = int(obj["height"])
             module = int(obj["module"])
             vector = obj["vector"]
 
-            img = self._vector_to_image(vector, width=w, height=h, module=module)
-            out_img_path = os.path.join(self.raimu_dir, os.path.splitext(filename)[0] + ".png")
-            cv2.imwrite(out_img_path, img)
+            stem = os.path.splitext(filename)[0]
+            out_img_path = write_reconstruction(
+                os.path.join(self.raimu_dir, stem), np.asarray(vector)[:module, :module], w, h, self.raimu_format
+            )
+            self.raimu_index.add(out_img_path)
+            out_name = os.path.basename(out_img_path)
+            structure[out_name] = self.validator.validate(vector)
+            if obj.get("duplicate_of"):
+                duplicate_of[out_name] = os.path.splitext(obj["duplicate_of"])[0] + recon_ext(self.raimu_format)
             print(f"[Step2] 生成: {out_img_path}")
+            self._progress(done=vec_name, ok=True)
 
         # 評価
         print("\n[Step2] デコード評価（original vs reconstructed）")
         evaluation_results: List[Dict[str, Any]] = []
-
-        out_images = sorted(
-            [f for f in os.listdir(self.raimu_dir) if f.lower().endswith((".png", ".jpg", ".jpeg"))],
-            key=_key,
-        )
-        for filename in out_images:
-            orig_path = os.path.join(self.tobako_dir, filename)
-            if not os.path.exists(orig_path):
-                alt = self._find_alt_original(filename)
-                orig_path = alt or orig_path
-
+        db = self.results_db
+        run_id = db.begin_run("step2", self._run_params(raimu_format=self.raimu_format)) if db is not None else None
+        recon_cache: Dict[str, str | None] = {}   # 再生成画像のデコード結果（重複は代表の結果を使う）
+
+        # 形式を変えて作り直した場合、同じ stem の古い出力（拡張子違い）は評価しない
+        written = {os.path.splitext(n)[0]: n for n in structure}
+        self._progress(phase="evaluate", total=len(written))
+        for filename in self.raimu_index.names(RECON_EXTS, key=_key):
+            if written.get(os.path.splitext(filename)[0], filename) != filename:
+                continue
+            # 同名がなければ拡張子違い（.jpg / .jpeg / .png）の元画像を使う
+            orig_file = self.tobako_index.find(filename)
             recon_path = os.path.join(self.raimu_dir, filename)
 
-            orig = self.decoder.decode_from_path(orig_path) if os.path.exists(orig_path) else None
-            recon = self.decoder.decode_from_path(recon_path)
+            t0 = time.perf_counter()
+            orig = self.decoder.decode_from_path(orig_file.path) if orig_file is not None else None
+            check = structure.get(filename)
+            rep = duplicate_of.get(filename)
+            if rep in recon_cache:
+                recon = recon_cache[rep]
+            elif skip_rejected and check is not None and not check.ok:
+                recon = None
+            else:
+                recon = self.decoder.decode_reconstruction(recon_path)
+            recon_cache[filename] = recon
+            elapsed_ms = (time.perf_counter() - t0) * 1000.0
 
             match = (orig is not None) and (orig == recon)
             result = {
@@ -156,13 +571,174 @@ class QRPipeline:
                 "reconstructed": recon,
                 "match": match,
             }
+            if check is not None:
+                result["structure_score"] = round(check.score, 4)
+                result["structure_reject"] = check.reason
             evaluation_results.append(result)
-            print(f"  {filename}: match={match} | original={orig} | reconstructed={recon}")
+            self._progress(done=filename, ok=match)
+            if db is not None:
+                db.add_decode(run_id, filename, orig, recon, match,
+                              result.get("structure_score"), result.get("structure_reject"))
+                db.add_timing(run_id, os.path.splitext(filename)[0], "decode", elapsed_ms)
+            reject = f" | 構造NG={check.reason}" if check is not None and not check.ok else ""
+            print(f"  {filename}: match={match} | original={orig} | reconstructed={recon}{reject}")
 
         with open("evaluate.json", "w", encoding="utf-8") as f:
             json.dump(evaluation_results, f, indent=4, ensure_ascii=False)
+        if db is not None:
+            db.end_run(run_id)
         print("完了: 評価結果を 'evaluate.json' に保存しました。")
 
+    # ========= 動画 =========
+    def step_video_decode(self, video_dir: str = "qr_video",
+                          out_path: str = "evaluate_video.json", **video_params) -> List[Dict[str, Any]]:
+        """
+        video_dir の動画クリップを cv2.VideoCapture で読み、クリップごとに最初に安定して
+        読めたペイロードを evaluate_video.json に保存する（フレームの書き出しは不要）。
+        """
+        if not os.path.exists(video_dir):
+            print(f"エラー: 動画ディレクトリ '{video_dir}' が見つかりません。")
+            return []
+        params = {
+            key: getattr(self.enhancer, key)
+            for key in ("module", "white_thresh", "black_thresh", "avg_thresh", "top_row_thresh", "finder_size")
+        }
+        source = VideoQRSource(enhancer_params=params, decoder=self.decoder, **video_params)
+        results = source.process_dir(video_dir)
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4, ensure_ascii=False)
+        ok = sum(1 for r in results if r["decoded"])
+        print(f"完了: {ok}/{len(results)} クリップをデコードし '{out_path}' に保存しました。")
+        return results
+
+    # ========= シート（1枚に複数コード） =========
+    def step_sheet_vectors(self, sheet_dir: str = "qr_sheet",
+                           out_path: str = "evaluate_sheet.json", **sheet_params) -> List[Dict[str, Any]]:
+        """
+        sheet_dir のスキャン画像からコードを全て検出し、コードごとに
+        qr_vector/sheet/{stem}/{index}.json（file と index で識別、bbox・ペイロード付き）を保存する。
+        通常の入力（qr_vector 直下）と名前がぶつからないよう別ディレクトリに置き、
+        Step2 の元画像との比較には含めない（読めたかどうかは evaluate_sheet.json に残る）。
+        """
+        if not os.path.exists(sheet_dir):
+            print(f"エラー: シートディレクトリ '{sheet_dir}' が見つかりません。")
+            return []
+        os.makedirs(self.vector_dir, exist_ok=True)
+        params = {
+            key: getattr(self.enhancer, key)
+            for key in ("module", "white_thresh", "black_thresh", "avg_thresh", "top_row_thresh", "finder_size")
+        }
+        processor = SheetProcessor(enhancer_params=params, **sheet_params)
+        results: List[Dict[str, Any]] = []
+        try:
+            for filename in sorted(os.listdir(sheet_dir)):
+                if not filename.lower().endswith((".png", ".jpg", ".jpeg", ".tif", ".tiff")):
+                    continue
+                print(f"\n[Sheet] '{filename}'")
+                sheet = processor.process_path(os.path.join(sheet_dir, filename))
+                out_dir = os.path.join(self.vector_dir, "sheet", os.path.splitext(filename)[0])
+                os.makedirs(out_dir, exist_ok=True)
+                for code in sheet["codes"]:
+                    if code["vector"] is None:
+                        continue
+                    x, y, bw, bh = code["bbox"]
+                    out_json = os.path.join(out_dir, f"{code['index']}.json")
+                    with open(out_json, "w", encoding="utf-8") as f:
+                        json.dump(
+                            {
+                                "file": filename,
+                                "module": self.module,
+                                "width": int(bw),
+                                "height": int(bh),
+                                "vector": code["vector"],
+                                "confidence": _round_confidence(code["confidence"]),
+                                "index": code["index"],
+                                "bbox": code["bbox"],
+                                "payload": code["payload"],
+                            },
+                            f, ensure_ascii=False
+                        )
+                ok = sum(1 for c in sheet["codes"] if c["payload"] is not None)
+                print(f"  {len(sheet['codes'])} 件検出, {ok} 件デコード ({sheet.get('elapsed_ms')} ms)")
+                for code in sheet["codes"]:
+                    code.pop("vector", None)
+                    code.pop("confidence", None)
+                results.append(sheet)
+        finally:
+            processor.close()
+
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4, ensure_ascii=False)
+        print(f"完了: シートの結果を '{out_path}' に保存しました。")
+        return results
+
+    # ========= 修復 =========
+    def step_repair_vectors(self, max_decodes: int = 200, max_flips: int = 3) -> List[Dict[str, Any]]:
+        """
+        qr_vector/*.json のうちデコードできないものを QRRepairer で探索し、
+        読めた場合は vector を書き換えて "repair" に反転したセルを記録する。
+        結果の一覧は qr_statistics/repair.json に保存。
+        """
+        if not os.path.exists(self.vector_dir):
+            print(f"エラー: ベクトルディレクトリ '{self.vector_dir}' が見つかりません。まず Step1 を実行してください。")
+            return []
+        os.makedirs(self.statistics_dir, exist_ok=True)
+        repairer = QRRepairer(decoder=self.decoder, validator=self.validator,
+                              max_decodes=max_decodes, max_flips=max_flips)
+        summary: List[Dict[str, Any]] = []
+        db = self.results_db
+        run_id = db.begin_run("repair", {"max_decodes": max_decodes, "max_flips": max_flips}) \
+            if db is not None else None
+
+        vec_names = self.vector_index.names(".json")
+        self._progress(phase="repair", total=len(vec_names))
+        for vec_name in vec_names:
+            vec_path = os.path.join(self.vector_dir, vec_name)
+            with open(vec_path, "r", encoding="utf-8") as f:
+                obj = json.load(f)
+            if "confidence" not in obj:
+                print(f"[Repair] {vec_name}: confidence がないためスキップ（Step1 をやり直してください）")
+                self._progress(done=vec_name, ok=False)
+                continue
+            if self.decoder.decode_modules(obj["vector"]) is not None:
+                self._progress(done=vec_name, ok=True)
+                continue
+
+            result = repairer.repair(obj["vector"], obj["confidence"])
+            entry = {
+                "file": vec_name,
+                "repaired": result.payload is not None,
+                "payload": result.payload,
+                "flipped": [list(c) for c in result.flipped],
+                "decodes": result.decodes,
+                "rejected": result.rejected,
+                "elapsed_ms": round(result.elapsed_ms, 2),
+            }
+            summary.append(entry)
+            self._progress(done=vec_name, ok=result.payload is not None)
+            if result.payload is None:
+                print(f"[Repair] {vec_name}: 見つからず（{result.decodes} 回デコード）")
+                continue
+
+            obj["vector"] = result.modules.tolist()
+            obj["repair"] = {"flipped": entry["flipped"], "decodes": result.decodes, "payload": result.payload}
+            with open(vec_path, "w", encoding="utf-8") as f:
+                json.dump(obj, f, ensure_ascii=False)
+            self.vector_index.add(vec_path)
+            if db is not None:
+                db.add_vector(run_id, os.path.splitext(vec_name)[0], obj.get("file") or vec_name, result.modules,
+                              obj["width"], obj["height"], obj["confidence"])
+            print(f"[Repair] {vec_name}: {len(result.flipped)} セル反転で読めました → {result.payload}")
+
+        out_path = os.path.join(self.statistics_dir, "repair.json")
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=4, ensure_ascii=False)
+        if db is not None:
+            db.end_run(run_id)
+        ok = sum(1 for e in summary if e["repaired"])
+        print(f"完了: デコード不可 {len(summary)} 件中 {ok} 件を修復し '{out_path}' に保存しました。")
+        return summary
+
     # ========= 元の一括 run（必要なら） =========
     def run(self) -> None:
         """従来互換: Step1→Step2 を続けて実行"""
@@ -171,89 +747,35 @@ class QRPipeline:
 
     # ========= Helpers =========
 
-    def _binary_to_module_vector(self, binary: np.ndarray) -> List[List[int]]:
-        """
-        2値画像（0/255）を module x module の 0/1 ベクトルに落とす。
-        1=黒(0側)、0=白(255側)
-        """
-        h, w = binary.shape
-        module = self.module
-        cell_w = w // module
-        cell_h = h // module
-
-        vec: List[List[int]] = []
-        for gy in range(module):
-            row: List[int] = []
-            y0 = gy * cell_h
-            y1 = (gy + 1) * cell_h if gy < module - 1 else h
-            for gx in range(module):
-                x0 = gx * cell_w
-                x1 = (gx + 1) * cell_w if gx < module - 1 else w
-                cell = binary[y0:y1, x0:x1]
-                v = 1 if np.mean(cell) < 128 else 0  # 保険として平均で判定
-                row.append(int(v))
-            vec.append(row)
-        return vec
-
-    def _vector_to_image(self, vector: List[List[int]], width: int, height: int, module: int) -> np.ndarray:
-        """
-        module x module の 0/1 ベクトルから元サイズの2値画像(0/255)を再生成。
-        1=黒 → 0, 0=白 → 255
-        """
-        img = np.ones((height, width), dtype=np.uint8) * 255
-        cell_w = width // module
-        cell_h = height // module
-
-        for gy in range(module):
-            y0 = gy * cell_h
-            y1 = (gy + 1) * cell_h if gy < module - 1 else height
-            for gx in range(module):
-                x0 = gx * cell_w
-                x1 = (gx + 1) * cell_w if gx < module - 1 else width
-                val = 0 if vector[gy][gx] == 1 else 255
-                img[y0:y1, x0:x1] = val
-        return img
-
-    def _find_alt_original(self, filename: str) -> str | None:
+    def _progress(self, **event) -> None:
+        if self.on_progress is not None:
+            self.on_progress(event)
+
+    def _run_params(self, **extra) -> dict:
+        """results_db の param_sets に記録する、結果を左右するパラメータ。"""
+        params = {
+            key: getattr(self.enhancer, key)
+            for key in ("module", "white_thresh", "black_thresh", "avg_thresh", "top_row_thresh", "finder_size",
+                        "target_ppm", "function_patterns")
+        }
+        params.update(extra)
+        return params
+
+    def _decodable(self, modules) -> bool:
+        """構造チェックを通ったものだけ実際にデコードして確かめる。"""
+        return self.validator.validate(modules).ok and self.decoder.decode_modules(modules) is not None
+
+    def _save_combined_top_row_statistics(self, out_path: str):
         """
-        同名拡張子違い（.jpg / .jpeg / .png）で元画像を探索。
+        集計済みの統計を out_path と同名の .json（サイドカー）に保存し、そこからグラフを描く。
+        シャードごとの JSON は `python -m pipeline.top_row_stats` で合成・再描画できる。
         """
-        stem = os.path.splitext(filename)[0]
-        for ext in (".png", ".jpg", ".jpeg", ".PNG", ".JPG", ".JPEG"):
-            p = os.path.join(self.tobako_dir, stem + ext)
-            if os.path.exists(p):
-                return p
-        return None
-
-    def _save_combined_top_row_statistics(self, out_path: str, thresh: float):
-        data = np.array(self._top_row_avgs_all, dtype=float)
-        if data.size == 0:
+        stats = self._top_row_stats
+        if stats.count == 0:
             print("[TopRow-Combined] データがないため統計グラフを作成しません。")
             return
 
-        fig = plt.figure(figsize=(10, 6), layout="constrained")
-        ax1 = fig.add_subplot(2, 1, 1)
-        ax2 = fig.add_subplot(2, 1, 2)
-
-        ax1.plot(np.arange(data.size), data, linewidth=1, color="#377eb8", label="mean intensity")
-        ax1.axhline(thresh, color="r", linestyle="--", label=f"threshold={thresh}")
-        ax1.set_title("Top-row cell means (all images, concatenated)")
-        ax1.set_xlabel("appearance index")
-        ax1.set_ylabel("mean intensity (0-255)")
-        ax1.set_ylim(0, 255)
-        ax1.grid(True, alpha=0.3)
-        ax1.legend(loc="best")
-
-        ax2.hist(data, bins=40, color="#4C72B0", alpha=0.9, edgecolor="black")
-        ax2.axvline(thresh, color="r", linestyle="--", label=f"threshold={thresh}")
-        ax2.set_title("Distribution of top-row cell means (all images)")
-        ax2.set_xlabel("mean intensity")
-        ax2.set_ylabel("count")
-        ax2.set_xlim(0, 255)
-        ax2.grid(True, alpha=0.3)
-        ax2.legend(loc="best")
-
-        fig.suptitle("Top-row statistics (aggregated)", fontsize=14)
-        fig.savefig(out_path, dpi=150)
-        plt.close(fig)
-        print(f"[TopRow-Combined] 統計グラフを '{out_path}' に保存しました。")
+        sidecar = os.path.splitext(out_path)[0] + ".json"
+        stats.save(sidecar)
+        plot_top_row_statistics(stats, out_path)
+        print(f"[TopRow-Combined] 統計を '{sidecar}'、グラフを '{out_path}' に保存しました。")
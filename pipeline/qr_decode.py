@@ -1,12 +1,25 @@
 import cv2
+import numpy as np
 from pyzbar.pyzbar import decode
 
+from pipeline.buffer_pool import local_pool
+from pipeline.image_io import load_gray
+from pipeline.qr_enhancer import render_modules
+from pipeline.recon_io import read_module_grid
+
 
 class QRCodeDecoder:
     """
     QRコード画像のデコードを扱うクラス。
+
+    target_ppm を指定すると、まず1モジュールがそのピクセル数以上になる範囲で
+    縮小読み込みしてデコードし、失敗した時だけフル解像度で読み直す。
     """
 
+    def __init__(self, module: int = 33, target_ppm: int | None = None):
+        self.module = module
+        self.target_ppm = target_ppm
+
     def decode_from_path(self, qr_path: str) -> str or None:
         """
         指定された画像パスからQRコードを読み取り、デコードした文字列を返す。
@@ -17,6 +30,14 @@ class QRCodeDecoder:
         Returns:
             str or None: デコードされた文字列。読み取りに失敗した場合はNone。
         """
+        if self.target_ppm:
+            img, scale = load_gray(qr_path, self.module, self.target_ppm)
+            if img is not None and scale > 1:
+                result = self.decode_from_path_from_image(img)
+                if result is not None:
+                    return result
+                # 縮小で読めなければフル解像度で再挑戦
+
         # 画像を読み込む
         img = cv2.imread(qr_path)
         if img is None:
@@ -47,3 +68,32 @@ class QRCodeDecoder:
             return decoded_objects[0].data.decode("utf-8")
 
         return None
+
+    def decode_modules(self, modules, scale: int = 4, quiet: int = 4) -> str or None:
+        """
+        module×module の 0/1 行列（1=黒）をディスクに書かずに小さく描画してデコードする。
+
+        Args:
+            modules: 0/1 の2次元配列（list でも numpy.ndarray でも可）。
+            scale (int): 1モジュールあたりのピクセル数。小さいほど速い。
+            quiet (int): 周囲に付けるクワイエットゾーン（モジュール数）。
+        """
+        grid = np.asarray(modules, dtype=np.uint8)
+        if grid.ndim != 2 or grid.size == 0:
+            return None
+        pad = quiet * scale
+        gh, gw = grid.shape
+        img = local_pool().get("decode", (gh * scale + 2 * pad, gw * scale + 2 * pad), np.uint8)
+        img.fill(255)
+        render_modules(grid, gw * scale, gh * scale, out=img[pad:pad + gh * scale, pad:pad + gw * scale])
+        return self.decode_from_path_from_image(img)
+
+    def decode_reconstruction(self, path: str) -> str or None:
+        """
+        qr_raimu の再生成画像をデコードする。
+        1モジュール1画素（module 形式）のものは元サイズに拡大せず decode_modules で読む。
+        """
+        m = read_module_grid(path)
+        if m is not None:
+            return self.decode_modules(m[0])
+        return self.decode_from_path(path)
@@ -1,13 +1,73 @@
 import cv2
 import numpy as np
 
+from pipeline.buffer_pool import local_pool
+from pipeline.function_patterns import function_patterns, snap_format
+from pipeline.qr_localizer import QRLocalizer
+from pipeline.image_io import load_gray
+
+
+def grid_starts(n: int, module: int) -> np.ndarray:
+    """
+    長さ n の辺を module 分割したときの各セルの開始位置。
+    最後のセルは端まで伸びる（binarize と同じ区切り）。
+    """
+    g = max(1, n // module)
+    starts = np.arange(module) * g
+    return starts[starts < n]
+
+
+def cell_means(img: np.ndarray, module: int) -> np.ndarray:
+    """
+    グレースケール画像のセルごとの平均輝度を (module, module) で返す（ループなし）。
+    img は縦横とも module ピクセル以上（未満だとセルが足りず正方にならないので ValueError）。
+    """
+    h, w = img.shape
+    if min(h, w) < module:
+        raise ValueError(f"画像が小さすぎます: {w}x{h} < module={module}")
+    ys = grid_starts(h, module)
+    xs = grid_starts(w, module)
+    sums = np.add.reduceat(np.add.reduceat(img, ys, axis=0, dtype=np.float64), xs, axis=1)
+    ch = np.diff(np.append(ys, h))
+    cw = np.diff(np.append(xs, w))
+    return sums / (ch[:, None] * cw[None, :])
+
+
+def binary_to_modules(binary: np.ndarray, module: int) -> np.ndarray:
+    """2値画像（0/255）を module×module の 0/1 行列（1=黒）にする。"""
+    return (cell_means(binary, module) < 128).astype(np.uint8)
+
+
+def render_modules(modules, width: int, height: int, out: np.ndarray | None = None) -> np.ndarray:
+    """
+    module×module の 0/1 行列（1=黒）を width×height の 0/255 画像に描く。
+    out（uint8, (height, width)）を渡すとそこへ書き込む（新しい大きな配列を確保しない）。
+    セルの区切りは binarize と同じ（最後のセルが端まで伸びる）。
+    """
+    grid = np.asarray(modules)
+    module = grid.shape[0]
+    if out is None:
+        out = np.empty((height, width), dtype=np.uint8)
+    ys = grid_starts(height, module)
+    xs = grid_starts(width, module)
+    col_of = np.repeat(np.arange(xs.size), np.diff(np.append(xs, width)))
+    rows = np.where(grid[: ys.size, : xs.size] == 1, 0, 255).astype(np.uint8)
+    bounds = np.append(ys, height)
+    for gy in range(ys.size):
+        out[bounds[gy]:bounds[gy + 1]] = rows[gy, col_of]
+    return out
+
 
 class QREnhancer:
     """
     QRコード画像を加工するクラス。
+    - （任意）位置検出と射影補正（localize=True のとき、grid 処理の前）
     - 一番上の行の特別処理（グレースケール段階）
     - 通常のgrid二値化（上一行を除外）
     - finder pattern の塗りつぶし
+      （function_patterns=True かつ画像が module ピクセル以上なら、finder・区切り・タイミング・
+      アライメント・dark module・版情報を version ごとのテンプレートで一括反映し、形式情報は
+      最も近い正しい符号語に揃える）
     - 最後にトップ行の判定結果を強制反映
     """
 
@@ -19,6 +79,11 @@ class QREnhancer:
         avg_thresh: int = 128,       # 通常の平均値しきい値
         top_row_thresh: int = 160,   # 上一行専用の黒寄りしきい値
         finder_size: int = 7,        # finder pattern の外枠サイズ（セル単位）
+        verbose: bool = True,        # トップ行のセルごとのログを出すか
+        localize: bool = False,      # 写真・余白付きスキャン向けの位置検出＋射影補正
+        localize_budget_ms: float = 50.0,
+        target_ppm: int | None = None,  # 指定時は1モジュールがこのピクセル数以上になる範囲で縮小読み込み（読めなければ呼び出し側でフル解像度に戻す）
+        function_patterns: bool = True,  # 機能パターン全体をテンプレートで反映（False なら finder だけ）
     ):
         self.module = module
         self.white_thresh = white_thresh
@@ -26,71 +91,291 @@ class QREnhancer:
         self.avg_thresh = avg_thresh
         self.top_row_thresh = top_row_thresh
         self.finder_size = finder_size
+        self.verbose = verbose
+        self.target_ppm = target_ppm
+        self.function_patterns = function_patterns
+        self.last_scale = 1   # 直近の binarize で使った縮小倍率（出力 1px = 元画像 last_scale px）
+        self.localizer = (
+            QRLocalizer(module=module, finder_size=finder_size, time_budget_ms=localize_budget_ms)
+            if localize else None
+        )
         self._top_row_values: list[int] | None = None   # 0/255
         self._top_row_avgs: list[float] | None = None   # 平均値(グレースケール)
+        self.batch_top_row_avgs: list[list[float] | None] = []   # 直近の binarize_batch の画像ごとの値
+        self._shape_cache: dict = {}   # (h, w) → セル区切り・機能パターン（finder）テンプレート
+        self.last_shape: tuple[int, int] | None = None   # 直近に処理した（正規化後の）画像サイズ
+        self.last_confidence: np.ndarray | None = None   # 直近の結果のモジュールごとの確信度（0〜1）
+        self.batch_confidence: list[np.ndarray | None] = []
+
+    def load_profile(self, profile: dict | str) -> None:
+        """
+        キャリブレーション結果（dict または JSON パス）のしきい値を反映する。
+        含まれないキーは現在値のまま。
+        """
+        if isinstance(profile, str):
+            import json
+            with open(profile, "r", encoding="utf-8") as f:
+                profile = json.load(f)
+        if "module" in profile and int(profile["module"]) != self.module:
+            raise ValueError(f"module が一致しません: profile={profile['module']}, enhancer={self.module}")
+        for key in ("top_row_thresh", "avg_thresh", "white_thresh", "black_thresh"):
+            if key in profile:
+                setattr(self, key, int(profile[key]))
 
-    def binarize(self, path: str) -> np.ndarray | None:
+    def binarize(self, path: str, full_res: bool = False) -> np.ndarray | None:
         """
         QRコード画像を読み込み、鮮明化した2値画像を返す。
+        target_ppm 指定時は縮小読み込みした解像度の2値画像になる（倍率は last_scale）。
+        full_res=True なら常にフル解像度で読む。
         """
-        img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        img, scale = load_gray(path, self.module, None if full_res else self.target_ppm)
         if img is None:
             return None
+        self.last_scale = scale
+        return self.binarize_image(img)
 
-        # Step 1: 上一行を先に補正（グレースケール）
-        img = self._fix_top_row(img)
+    def modules_from_path(self, path: str, full_res: bool = False) -> np.ndarray | None:
+        """
+        binarize と同じ処理で module×module の 0/1 行列（1=黒）だけを返す（2値画像は作らない）。
+        処理した画像のサイズは last_shape、縮小倍率は last_scale。
+        """
+        img, scale = load_gray(path, self.module, None if full_res else self.target_ppm)
+        if img is None:
+            return None
+        self.last_scale = scale
+        return self.binarize_modules(img)
 
+    def binarize_image(self, img: np.ndarray) -> np.ndarray | None:
+        """
+        読み込み済みのグレースケール画像（numpy.ndarray）を鮮明化した2値画像にする。
+        img は書き換えない。
+        """
+        if img is None or img.ndim != 2 or img.size == 0:
+            return None
+        if self.localizer is not None:
+            img = self.localizer.normalize(img)
+        if not self._large_enough(img):
+            return None
+        binary = np.empty(img.shape, dtype=np.uint8)
+        self._binarize_core(img, binary)
+        return binary
+
+    def binarize_modules(self, img: np.ndarray, out: np.ndarray | None = None) -> np.ndarray | None:
+        """
+        鮮明化の結果を module×module の 0/1 行列（1=黒）で返す。
+        out（uint8, 処理する画像と同じ形）を渡すと2値画像をそこへ描く。
+        作業用の配列はスレッドごとの BufferPool から取るので、同じサイズが続く限り大きな確保はしない。
+        モジュールごとの確信度（0〜1、finder は 1.0）は last_confidence に入る。
+        位置検出ありの場合、処理する画像は正規化後（サイズは last_shape）。
+        縦横どちらかが module ピクセル未満の画像は module×module に分けられないので None。
+        """
+        if img is None or img.ndim != 2 or img.size == 0:
+            return None
+        if self.localizer is not None:
+            img = self.localizer.normalize(img)
+        if not self._large_enough(img):
+            return None
+        if out is not None and out.shape != img.shape:
+            raise ValueError(f"out の形が一致しません: out={out.shape}, image={img.shape}")
+        return self._binarize_core(img, out)
+
+    def _large_enough(self, img: np.ndarray) -> bool:
+        """全セルに1画素以上あるか（なければ結果が module×module にならない）。"""
+        if min(img.shape) >= self.module:
+            return True
+        if self.verbose:
+            print(f"  画像が小さすぎます: {img.shape[1]}x{img.shape[0]} < module={self.module}")
+        return False
+
+    def _binarize_core(self, img: np.ndarray, out: np.ndarray | None) -> np.ndarray:
+        """
+        1) セルごとの最大・最小・平均をまとめて求める
+        2) 上一行は平均と top_row_thresh だけで判定（グレースケール段階の補正）
+        3) それ以外は白/黒の有無、混在なら平均と avg_thresh で判定
+        4) 機能パターンのテンプレートをセル単位で反映（使えない場合は finder を画素単位で強制塗り）
+        """
         h, w = img.shape
-        grid_size_x = max(1, w // self.module)
-        grid_size_y = max(1, h // self.module)
-        fs = self.finder_size
+        self.last_shape = (h, w)
+        plan = self._shape_plan(h, w)
+        pool = local_pool()
+        ys, xs = plan["ys"], plan["xs"]
+        ny, nx = ys.size, xs.size
 
-        binary = np.ones_like(img, dtype=np.uint8) * 255  # 白で初期化
+        # 行方向 → 列方向の2段の reduceat（途中結果はプールのバッファに書く）
+        rmax = np.maximum.reduceat(img, ys, axis=0, out=pool.get("rmax", (ny, w), np.uint8))
+        cmax = np.maximum.reduceat(rmax, xs, axis=1)
+        rmin = np.minimum.reduceat(img, ys, axis=0, out=pool.get("rmin", (ny, w), np.uint8))
+        cmin = np.minimum.reduceat(rmin, xs, axis=1)
+        # 合計は帯ごとに uint32 で（reduceat に dtype を渡すと画像全体の型変換コピーができる）
+        rsum = pool.get("rsum", (ny, w), np.uint32)
+        bounds = np.append(ys, h)
+        for gy in range(ny):
+            np.add.reduce(img[bounds[gy]:bounds[gy + 1]], axis=0, dtype=np.uint32, out=rsum[gy])
+        means = np.add.reduceat(rsum, xs, axis=1, dtype=np.float64) / plan["area"]
 
-        # Step 2: 上一行は fix_top_row の結果をそのままコピー
-        y0, y1 = 0, grid_size_y
-        binary[y0:y1, :] = img[y0:y1, :]
+        white, confidence = self._decide(cmax, cmin, means)
+        self._record_top_row(means[0])
+        self.last_confidence = np.where(plan["fixed"], 1.0, confidence).astype(np.float32)
+        cells, modules = self._apply_patterns(white, plan)
 
-        # Step 3: 通常のgrid二値化（上一行はスキップ）
-        for gy in range(1, self.module):
-            for gx in range(self.module):
-                x0 = gx * grid_size_x
-                y0 = gy * grid_size_y
-                x1 = (gx + 1) * grid_size_x if gx < self.module - 1 else w
-                y1 = (gy + 1) * grid_size_y if gy < self.module - 1 else h
+        if out is not None:
+            col_of = plan["col_of"]
+            for gy in range(ny):
+                out[bounds[gy]:bounds[gy + 1]] = cells[gy, col_of]
+            if plan["template"] is None:
+                np.copyto(out, plan["finder_vals"], where=plan["finder_mask"])
+        return modules
 
-                if x0 >= w or y0 >= h:
-                    continue
+    def _decide(self, cmax: np.ndarray, cmin: np.ndarray, means: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        セル統計（最後の2軸が行・列）から (白セルを True とする判定, 確信度) を求める。
+        確信度は白/黒の一方だけを含むセルで 1.0、それ以外は平均としきい値の距離を 0〜1 にしたもの。
+        """
+        has_white = cmax >= self.white_thresh
+        has_black = cmin <= self.black_thresh
+        pure = has_white ^ has_black
+        white = np.where(pure, has_white, means >= self.avg_thresh)
+        confidence = np.where(pure, 1.0, np.abs(means - self.avg_thresh) / max(self.avg_thresh, 255 - self.avg_thresh))
+        # トップ行はグレースケール平均と専用しきい値だけで決める
+        top = means[..., 0, :]
+        white[..., 0, :] = top >= self.top_row_thresh
+        confidence[..., 0, :] = np.abs(top - self.top_row_thresh) / max(self.top_row_thresh, 255 - self.top_row_thresh)
+        return white, np.clip(confidence, 0.0, 1.0)
+
+    def _apply_patterns(self, white: np.ndarray, plan: dict) -> tuple[np.ndarray, np.ndarray]:
+        """
+        白判定（最後の2軸が行・列）に機能パターンを反映し、(セル値 0/255, 0/1 行列) を返す。
+        テンプレートがあれば1回のマスク代入＋形式情報の補正、なければ従来どおり finder を画素で重ねる。
+        """
+        fp = plan["template"]
+        if fp is None:
+            cells = np.where(white, 255, 0).astype(np.uint8)
+            return cells, self._cells_to_modules(cells, plan)
+        modules = np.logical_not(white).astype(np.uint8)
+        np.copyto(modules, fp.values, where=fp.mask)
+        snap_format(modules, fp)
+        return np.where(modules == 1, 0, 255).astype(np.uint8), modules
 
-                cell = img[y0:y1, x0:x1]
+    def _cells_to_modules(self, cells: np.ndarray, plan: dict) -> np.ndarray:
+        """
+        セル値（0/255）と finder テンプレートから、2値画像を描いた場合のセル平均 < 128 を求める。
+        finder がセル境界とずれる場合（辺が module で割り切れない）も描画結果と一致する。
+        """
+        covered = plan["finder_count"]
+        mean = (plan["finder_sum"] + cells * (plan["area"] - covered)) / plan["area"]
+        return (mean < 128).astype(np.uint8)
 
-                has_white = np.any(cell >= self.white_thresh)
-                has_black = np.any(cell <= self.black_thresh)
+    def _record_top_row(self, avgs: np.ndarray) -> None:
+        top_avgs = [float(a) for a in avgs]
+        top_vals = [0 if a < self.top_row_thresh else 255 for a in top_avgs]
+        if self.verbose:
+            for gx, avg in enumerate(top_avgs):
+                label = "BLACK" if avg < self.top_row_thresh else "WHITE"
+                print(f"[TopRow] gx={gx:02d}, avg={avg:.2f}, thresh={self.top_row_thresh}, -> {label}")
+        # 画像が module ピクセル未満の場合、存在しないセルは白・欠損扱い
+        missing = self.module - len(top_avgs)
+        self._top_row_values = top_vals + [255] * missing
+        self._top_row_avgs = top_avgs + [np.nan] * missing
 
-                if has_white and not has_black:
-                    value = 255
-                elif has_black and not has_white:
-                    value = 0
-                else:
-                    avg = np.mean(cell)
-                    value = 255 if avg >= self.avg_thresh else 0
+    def binarize_batch(self, images: list[np.ndarray]) -> list[np.ndarray | None]:
+        """
+        複数のグレースケール画像をまとめて処理し、画像ごとの module×module の 0/1 行列（1=黒）を
+        入力と同じ順で返す（読めない画像・module ピクセル未満の画像は None）。
 
-                binary[y0:y1, x0:x1] = value
+        同じ (height, width) の画像を (N, H, W) に積み、セル統計（最大・最小・平均）、
+        しきい値判定、トップ行の補正、finder の反映を配列全体に対して一度に行う。
+        結果は binarize_modules と同じ。
+        画像ごとのトップ行セル平均は batch_top_row_avgs、確信度は batch_confidence に入る。
+        位置検出ありの場合、images の各要素は正規化後の画像に置き換えられる。
+        """
+        out: list[np.ndarray | None] = [None] * len(images)
+        self.batch_top_row_avgs = [None] * len(images)
+        self.batch_confidence = [None] * len(images)
+        groups: dict[tuple[int, int], list[int]] = {}
+        for i, img in enumerate(images):
+            if img is None or img.ndim != 2 or img.size == 0:
+                continue
+            if self.localizer is not None:
+                img = self.localizer.normalize(img)
+                images[i] = img
+            if not self._large_enough(img):
+                continue
+            groups.setdefault(img.shape, []).append(i)
 
-        # Step 4: finder を強制塗り
-        binary = self._fill_finder_patterns(binary)
+        for shape, idx in groups.items():
+            stack = np.stack([images[i] for i in idx])
+            modules, top_avgs, confidence = self._binarize_stack(stack)
+            for k, i in enumerate(idx):
+                out[i] = modules[k]
+                self.batch_top_row_avgs[i] = top_avgs[k].tolist() + [np.nan] * (self.module - top_avgs.shape[1])
+                self.batch_confidence[i] = confidence[k]
+        return out
 
-        # Step 5: トップ行の判定結果を最終的に強制反映（finder列は除外）
-        if self._top_row_values is not None:
-            y0, y1 = 0, grid_size_y
-            for gx, val in enumerate(self._top_row_values):
-                if gx < fs or gx >= self.module - fs:
-                    continue
-                x0 = gx * grid_size_x
-                x1 = (gx + 1) * grid_size_x if gx < self.module - 1 else w
-                binary[y0:y1, x0:x1] = val
+    def _shape_plan(self, h: int, w: int) -> dict:
+        """
+        (h, w) ごとのセル区切り・画素→セルの対応・機能パターン（1度だけ作る）。
+        version は module で決まるので、キャッシュは実質 (version, h, w) ごと。
+        """
+        plan = self._shape_cache.get((h, w))
+        if plan is None:
+            ys, xs = grid_starts(h, self.module), grid_starts(w, self.module)
+            ch = np.diff(np.append(ys, h))
+            cw = np.diff(np.append(xs, w))
+            # finder は既存の描画処理をそのまま使い、描かれた画素をマスクとして保存
+            probe = np.full((h, w), 128, dtype=np.uint8)
+            self._fill_finder_patterns(probe)
+            mask = probe != 128
+            # トップ行の判定は finder 列以外では finder より優先（小さい画像で重なる場合）
+            col_of = np.repeat(np.arange(xs.size), cw)
+            fs = self.finder_size
+            mask[: ch[0], (col_of >= fs) & (col_of < self.module - fs)] = False
+            # 全セルがそろう大きさなら version ごとのテンプレート（finder も含む）をセル単位で使う
+            template = None
+            if self.function_patterns and self.finder_size == 7 and ys.size == xs.size == self.module:
+                template = function_patterns(self.module)
+            finder_count = np.add.reduceat(np.add.reduceat(mask, ys, axis=0, dtype=np.float64), xs, axis=1)
+            plan = {
+                "ys": ys,
+                "xs": xs,
+                "area": (ch[:, None] * cw[None, :]).astype(np.float64),
+                "col_of": col_of,
+                "template": template,
+                "fixed": template.mask if template is not None else finder_count > 0,   # 確信度 1.0 のセル
+                "finder_mask": mask,
+                "finder_vals": probe,
+                "finder_count": finder_count,
+                "finder_sum": np.add.reduceat(
+                    np.add.reduceat(np.where(mask, probe, 0), ys, axis=0, dtype=np.float64), xs, axis=1
+                ),
+            }
+            self._shape_cache[(h, w)] = plan
+        return plan
 
-        return binary
+    def _binarize_stack(self, stack: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(N, H, W) の uint8 を (N, module, module) の 0/1・(N, module) のトップ行平均・確信度にする。"""
+        n, h, w = stack.shape
+        plan = self._shape_plan(h, w)
+        ys, xs = plan["ys"], plan["xs"]
+
+        cmax = np.maximum.reduceat(np.maximum.reduceat(stack, ys, axis=1), xs, axis=2)
+        cmin = np.minimum.reduceat(np.minimum.reduceat(stack, ys, axis=1), xs, axis=2)
+        bounds = np.append(ys, h)
+        rsum = np.empty((n, ys.size, w), dtype=np.uint32)
+        for gy in range(ys.size):
+            np.add.reduce(stack[:, bounds[gy]:bounds[gy + 1]], axis=1, dtype=np.uint32, out=rsum[:, gy])
+        means = np.add.reduceat(rsum, xs, axis=2, dtype=np.float64) / plan["area"]
+
+        white, confidence = self._decide(cmax, cmin, means)
+        confidence = np.where(plan["fixed"], 1.0, confidence).astype(np.float32)
+        top_avgs = means[:, 0, :]
+        if self.verbose:
+            for k in range(n):
+                for gx, avg in enumerate(top_avgs[k]):
+                    label = "WHITE" if avg >= self.top_row_thresh else "BLACK"
+                    print(f"[TopRow] gx={gx:02d}, avg={avg:.2f}, thresh={self.top_row_thresh}, -> {label}")
+
+        _, modules = self._apply_patterns(white, plan)
+        return modules, top_avgs, confidence
 
     def _fill_finder_patterns(self, binary: np.ndarray) -> np.ndarray:
         """
@@ -122,43 +407,6 @@ class QREnhancer:
 
         return binary
 
-    def _fix_top_row(self, img: np.ndarray) -> np.ndarray:
-        """
-        グレースケール段階で QRコードの一番上の行を補正。
-        併せてセルごとの平均値/最終値を保存。
-        """
-        h, w = img.shape
-        grid_size_x = max(1, w // self.module)
-        grid_size_y = max(1, h // self.module)
-
-        y0, y1 = 0, grid_size_y
-        top_vals: list[int] = []
-        top_avgs: list[float] = []
-
-        for gx in range(self.module):
-            x0 = gx * grid_size_x
-            x1 = (gx + 1) * grid_size_x if gx < self.module - 1 else w
-
-            cell = img[y0:y1, x0:x1]
-            if cell.size == 0:
-                top_vals.append(255)
-                top_avgs.append(np.nan)
-                continue
-
-            avg = float(np.mean(cell))
-            value = 0 if avg < self.top_row_thresh else 255
-            label = "BLACK" if value == 0 else "WHITE"
-
-            print(f"[TopRow] gx={gx:02d}, avg={avg:.2f}, thresh={self.top_row_thresh}, -> {label}")
-
-            img[y0:y1, x0:x1] = value
-            top_vals.append(value)
-            top_avgs.append(avg)
-
-        self._top_row_values = top_vals
-        self._top_row_avgs = top_avgs
-        return img
-
     # トップ行の平均値配列を取得（コピーを返す）
     def get_top_row_avgs(self) -> list[float]:
         return list(self._top_row_avgs or [])
@@ -0,0 +1,315 @@
+import time
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+
+@dataclass
+class Localization:
+    """位置検出の結果（座標はすべて入力のフル解像度画像基準）。"""
+    corners: np.ndarray        # (4, 2) float32: 左上, 右上, 右下, 左下 の外周コーナー
+    homography: np.ndarray     # (3, 3) 入力 → 正規化画像 の射影変換
+    pixels_per_module: int     # 正規化画像の1モジュールあたりピクセル数
+    size: int                  # 正規化画像の一辺（module * pixels_per_module）
+    method: str                # "finder+align" / "finder" / "detector"
+    elapsed_ms: float
+    source_shape: tuple = ()   # 検出した入力画像の (height, width)
+
+
+class QRLocalizer:
+    """
+    写真や余白の大きいスキャンから QR コードを見つけ、軸平行の正方形に射影補正する。
+
+    1. 画像ピラミッド（cv2.pyrDown）で長辺 max_side 以下まで縮小
+    2. 縮小画像で3つの finder pattern（黒・白・黒の入れ子輪郭）を検出
+    3. フル解像度で各 finder の中央 3×3 黒の重心を求め直して精密化
+    4. 右下の alignment pattern（version 2 以上）をテンプレート照合で探し、
+       finder 中心3点＋alignment 中心の4点対応から射影変換を求める
+       （見つからなければ3点のアフィン近似）
+    5. module × pixels_per_module の正方形へ cv2.warpPerspective
+       （1モジュールが整数ピクセルになるので、以降の grid 処理としきい値がそのまま使える）
+
+    finder が見つからない場合は cv2.QRCodeDetector の4隅検出にフォールバック。
+    補正後の3隅が finder pattern に見えない場合、time_budget_ms を超えた場合、
+    検出に失敗した場合は補正せずに元画像を返す。
+    """
+
+    def __init__(
+        self,
+        module: int = 33,
+        finder_size: int = 7,
+        max_side: int = 480,
+        min_ppm: int = 4,
+        time_budget_ms: float = 50.0,
+        min_finder_score: float = 0.6,
+    ):
+        self.module = module
+        self.finder_size = finder_size
+        self.max_side = max_side
+        self.min_ppm = min_ppm
+        self.time_budget_ms = time_budget_ms
+        self.min_finder_score = min_finder_score
+        self.last_result: Localization | None = None
+
+    # ---------- 公開API ----------
+    def normalize(self, img: np.ndarray, reuse: Localization | None = None) -> np.ndarray:
+        """
+        検出できれば射影補正した画像、できなければ元画像を返す。
+        reuse を渡すとまずその変換を使い（動画の静止フレーム向け）、
+        finder が崩れていれば通常の検出をやり直す。
+        """
+        if reuse is not None and reuse.size and img.shape[:2] == reuse.source_shape:
+            warped = self.warp(img, reuse)
+            if self.finder_score(warped) >= self.min_finder_score:
+                self.last_result = reuse
+                return warped
+
+        loc = self.locate(img)
+        if loc is not None:
+            warped = self.warp(img, loc)
+            if self.finder_score(warped) >= self.min_finder_score:
+                self.last_result = loc
+                return warped
+        self.last_result = None
+        return img
+
+    def finder_score(self, normalized: np.ndarray) -> float:
+        """
+        正規化画像の3隅のセル平均と finder pattern の相関（-1〜1）。
+        補正結果の妥当性確認に使う。
+        """
+        m, fs = self.module, self.finder_size
+        cells = cv2.resize(normalized, (m, m), interpolation=cv2.INTER_AREA).astype(np.float64)
+        tpl = np.zeros((fs, fs))
+        tpl[1:fs - 1, 1:fs - 1] = 1.0
+        tpl[2:fs - 2, 2:fs - 2] = 0.0
+        regions = np.concatenate([
+            cells[:fs, :fs].ravel(), cells[:fs, m - fs:].ravel(), cells[m - fs:, :fs].ravel()
+        ])
+        ref = np.tile(tpl.ravel(), 3)
+        if regions.std() == 0:
+            return 0.0
+        return float(np.corrcoef(regions, ref)[0, 1])
+
+    def warp(self, img: np.ndarray, loc: Localization) -> np.ndarray:
+        return cv2.warpPerspective(
+            img, loc.homography, (loc.size, loc.size),
+            flags=cv2.INTER_AREA if loc.pixels_per_module > 1 else cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_CONSTANT, borderValue=255,
+        )
+
+    def locate(self, img: np.ndarray) -> Localization | None:
+        t0 = time.perf_counter()
+
+        # Step 1: ピラミッド
+        small, scale = img, 1
+        while max(small.shape[:2]) > self.max_side:
+            small = cv2.pyrDown(small)
+            scale *= 2
+
+        # Step 2: 粗い検出（縮小画像）
+        trio = self._find_finder_trio(small)
+        if self._over_budget(t0):
+            return None
+        if trio is None:
+            corners = self._corners_from_detector(small)
+            if corners is None:
+                return None
+            corners = corners * scale + (scale - 1) / 2.0
+            side = (np.linalg.norm(corners[1] - corners[0]) + np.linalg.norm(corners[3] - corners[0])) / 2.0
+            ppm = max(self.min_ppm, int(round(side / self.module)))
+            s = float(self.module * ppm)
+            dst = np.array([[0, 0], [s, 0], [s, s], [0, s]], dtype=np.float32)
+            H = cv2.getPerspectiveTransform(corners.astype(np.float32), dst)
+            return self._result(H, ppm, "detector", t0, img.shape)
+
+        # Step 3: フル解像度で finder 中心を精密化
+        centers = np.array([t[1] for t in trio]) * scale + (scale - 1) / 2.0
+        pitch = np.linalg.norm(centers[1] - centers[0]) / (self.module - self.finder_size)
+        centers = np.array([self._refine_center(img, c, pitch) for c in centers])
+        pitch = (
+            np.linalg.norm(centers[1] - centers[0]) + np.linalg.norm(centers[2] - centers[0])
+        ) / 2.0 / (self.module - self.finder_size)
+        ppm = max(self.min_ppm, int(round(pitch)))
+        if self._over_budget(t0):
+            return None
+
+        # Step 4: モジュール座標との対応から変換を求める
+        c = self.finder_size / 2.0
+        m = self.module
+        src_mod = np.array([[c, c], [m - c, c], [c, m - c]], dtype=np.float64)
+        A = cv2.getAffineTransform(src_mod.astype(np.float32), centers.astype(np.float32))  # モジュール座標 → 画像
+        align = self._find_alignment(img, A)
+        if align is not None:
+            u = m - 6.5
+            mod_pts = np.vstack([src_mod, [[u, u]]])
+            img_pts = np.vstack([centers, [align]])
+            H = cv2.getPerspectiveTransform(img_pts.astype(np.float32), (mod_pts * ppm).astype(np.float32))
+            method = "finder+align"
+        else:
+            Ai = cv2.invertAffineTransform(A)
+            H = np.vstack([Ai * [[ppm], [ppm]], [0, 0, 1]])
+            method = "finder"
+        return self._result(H, ppm, method, t0, img.shape)
+
+    # ---------- 内部 ----------
+    def _result(self, H: np.ndarray, ppm: int, method: str, t0: float, shape: tuple) -> Localization | None:
+        if self._over_budget(t0):
+            return None
+        size = self.module * ppm
+        out = np.array([[0, 0], [size, 0], [size, size], [0, size]], dtype=np.float32).reshape(-1, 1, 2)
+        corners = cv2.perspectiveTransform(out, np.linalg.inv(H)).reshape(4, 2)
+        return Localization(
+            corners=corners.astype(np.float32),
+            homography=H,
+            pixels_per_module=ppm,
+            size=size,
+            method=method,
+            elapsed_ms=(time.perf_counter() - t0) * 1000.0,
+            source_shape=tuple(shape[:2]),
+        )
+
+    def _over_budget(self, t0: float) -> bool:
+        return self.time_budget_ms is not None and (time.perf_counter() - t0) * 1000.0 > self.time_budget_ms
+
+    @staticmethod
+    def _finder_candidates(small: np.ndarray) -> list[tuple[np.ndarray, np.ndarray, float]]:
+        """(輪郭点列, 中心, 面積) の finder 候補一覧。"""
+        _, bw = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+        contours, hierarchy = cv2.findContours(bw, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        if hierarchy is None:
+            return []
+        hier = hierarchy[0]
+        out = []
+        for i, c in enumerate(contours):
+            child = hier[i][2]
+            if child < 0:
+                continue
+            grand = hier[child][2]
+            if grand < 0:
+                continue
+            area = cv2.contourArea(c)
+            inner = cv2.contourArea(contours[grand])
+            if area < 16 or inner <= 0:
+                continue
+            # 外黒 7x7 と中央黒 3x3 の面積比は 49/9 ≒ 5.4（射影・ぼけを見込んで広めに）
+            if not 2.5 <= area / inner <= 12.0:
+                continue
+            (_, _), (rw, rh), _ = cv2.minAreaRect(c)
+            if min(rw, rh) <= 0 or max(rw, rh) / min(rw, rh) > 2.0:
+                continue
+            mo = cv2.moments(contours[grand])
+            if mo["m00"] == 0:
+                continue
+            center = np.array([mo["m10"] / mo["m00"], mo["m01"] / mo["m00"]])
+            out.append((c.reshape(-1, 2).astype(np.float64), center, area))
+        return out
+
+    def _find_finder_trio(self, small: np.ndarray):
+        """面積が揃い直角に近い3つの finder を (左上, 右上, 左下) の順で返す。"""
+        cands = self._finder_candidates(small)
+        if len(cands) < 3:
+            return None
+        cands.sort(key=lambda t: -t[2])
+        best, best_cost = None, np.inf
+        n = min(len(cands), 8)
+        for i in range(n):
+            for j in range(i + 1, n):
+                for k in range(j + 1, n):
+                    trio = (cands[i], cands[j], cands[k])
+                    areas = np.array([t[2] for t in trio])
+                    size_cost = areas.max() / areas.min() - 1.0
+                    ordered = self._order_trio(trio)
+                    if ordered is None:
+                        continue
+                    tl, tr, bl = (t[1] for t in ordered)
+                    a, b = tr - tl, bl - tl
+                    cos = abs(np.dot(a, b)) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-9)
+                    len_cost = abs(np.linalg.norm(a) / (np.linalg.norm(b) + 1e-9) - 1.0)
+                    cost = size_cost + 2.0 * cos + len_cost
+                    if cost < best_cost:
+                        best, best_cost = ordered, cost
+        if best is None or best_cost > 1.5:
+            return None
+        return best
+
+    @staticmethod
+    def _order_trio(trio):
+        """3つの finder を (左上, 右上, 左下) に並べる。"""
+        pts = [t[1] for t in trio]
+        d01 = np.linalg.norm(pts[0] - pts[1])
+        d02 = np.linalg.norm(pts[0] - pts[2])
+        d12 = np.linalg.norm(pts[1] - pts[2])
+        # 最長辺の対角が左上
+        if d12 >= d01 and d12 >= d02:
+            tl, p, q = 0, 1, 2
+        elif d02 >= d01 and d02 >= d12:
+            tl, p, q = 1, 0, 2
+        else:
+            tl, p, q = 2, 0, 1
+        a = pts[p] - pts[tl]
+        b = pts[q] - pts[tl]
+        cross = a[0] * b[1] - a[1] * b[0]
+        if cross == 0:
+            return None
+        # 画像座標（y 下向き）で cross > 0 なら p が右上
+        return (trio[tl], trio[p], trio[q]) if cross > 0 else (trio[tl], trio[q], trio[p])
+
+    @staticmethod
+    def _refine_center(img: np.ndarray, center: np.ndarray, pitch: float) -> np.ndarray:
+        """フル解像度で finder 中央 3×3 黒の重心を求め直す（失敗時は元の値）。"""
+        r = int(np.ceil(2.0 * pitch))
+        h, w = img.shape[:2]
+        cx, cy = int(round(center[0])), int(round(center[1]))
+        x0, y0 = max(0, cx - r), max(0, cy - r)
+        x1, y1 = min(w, cx + r + 1), min(h, cy + r + 1)
+        patch = img[y0:y1, x0:x1]
+        if patch.size == 0 or not (x0 <= cx < x1 and y0 <= cy < y1):
+            return center
+        _, bw = cv2.threshold(patch, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+        n, labels, stats, cents = cv2.connectedComponentsWithStats(bw, connectivity=8)
+        lab = labels[cy - y0, cx - x0]
+        if lab == 0:
+            return center
+        # 中央黒が外側の黒枠とつながった（ぼけすぎ）場合は採用しない
+        bx, by, bw_, bh_, _ = stats[lab]
+        if bx == 0 or by == 0 or bx + bw_ >= patch.shape[1] or by + bh_ >= patch.shape[0]:
+            return center
+        return cents[lab] + [x0, y0]
+
+    def _find_alignment(self, img: np.ndarray, A: np.ndarray) -> np.ndarray | None:
+        """右下 alignment pattern の中心（画像座標）。version 1 や見つからない場合は None。"""
+        m = self.module
+        if m < 25:
+            return None
+        ppm = 8
+        u = m - 6.5
+        win = 4.0  # 予測位置の ±4 モジュールを探索
+        # 探索窓をモジュール座標で切り出すアフィン変換（出力 → モジュール座標 → 画像）
+        u0 = u - win - 2.5
+        S = int((2 * win + 5) * ppm)
+        T = np.array([[1.0 / ppm, 0, u0], [0, 1.0 / ppm, u0], [0, 0, 1]])
+        M = np.vstack([A, [0, 0, 1]]) @ T
+        patch = cv2.warpAffine(
+            img, M[:2], (S, S), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+            borderMode=cv2.BORDER_CONSTANT, borderValue=255,
+        )
+        tpl = np.full((5, 5), 0, dtype=np.uint8)
+        tpl[1:4, 1:4] = 255
+        tpl[2, 2] = 0
+        tpl = np.repeat(np.repeat(tpl, ppm, axis=0), ppm, axis=1)
+        res = cv2.matchTemplate(patch, tpl, cv2.TM_CCOEFF_NORMED)
+        _, score, _, loc = cv2.minMaxLoc(res)
+        if score < 0.5:
+            return None
+        found_u = u0 + (loc[0] + 2.5 * ppm) / ppm
+        found_v = u0 + (loc[1] + 2.5 * ppm) / ppm
+        return A @ np.array([found_u, found_v, 1.0])
+
+    @staticmethod
+    def _corners_from_detector(small: np.ndarray) -> np.ndarray | None:
+        ok, pts = cv2.QRCodeDetector().detect(small)
+        if not ok or pts is None:
+            return None
+        return pts.reshape(4, 2).astype(np.float64)
@@ -0,0 +1,94 @@
+import heapq
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from pipeline.qr_decode import QRCodeDecoder
+from pipeline.qr_validate import StructureValidator
+
+
+@dataclass
+class RepairResult:
+    """修復探索の結果。payload が None なら予算内に読める組み合わせが見つからなかった。"""
+    payload: str | None
+    modules: np.ndarray                            # 反転を適用した後の 0/1 行列（失敗時は入力のまま）
+    flipped: list = field(default_factory=list)    # 反転したセル [(gy, gx), ...]
+    decodes: int = 0
+    rejected: int = 0                              # 構造チェックでデコードせずに捨てた候補数
+    elapsed_ms: float = 0.0
+
+
+class QRRepairer:
+    """
+    デコードできないモジュール行列を、確信度の低いセルから反転して読める形を探す。
+
+    - 確信度が低い順に max_candidates 個のセルを候補にする（確信度 1.0 のセル＝finder や
+      白/黒だけのセルは対象外）
+    - 「反転するセルの組」を確信度の合計が小さい順に取り出す最良優先探索
+      （子は「最後に追加したセルより後ろの候補を1つ足した組」なので重複なく列挙される）
+    - 各組はまず StructureValidator で構造を確かめ（finder・タイミング・形式情報を壊す反転は
+      デコードせずに捨てる）、通ったものだけメモリ上の高速デコードで確認する
+    - デコード回数が max_decodes、構造チェックで捨てた候補がその 20 倍に達したら打ち切る
+    """
+
+    def __init__(
+        self,
+        decoder: QRCodeDecoder | None = None,
+        validator: StructureValidator | None = None,
+        max_decodes: int = 200,
+        max_flips: int = 3,
+        max_candidates: int = 16,
+        decode_scale: int = 4,
+    ):
+        self.decoder = decoder or QRCodeDecoder()
+        self.validator = validator or StructureValidator()
+        self.max_decodes = max_decodes
+        self.max_flips = max_flips
+        self.max_candidates = max_candidates
+        self.decode_scale = decode_scale
+
+    def candidates(self, confidence: np.ndarray) -> list[tuple[int, int]]:
+        conf = np.asarray(confidence, dtype=np.float64)
+        order = np.argsort(conf, axis=None, kind="stable")
+        cells = [np.unravel_index(i, conf.shape) for i in order[: self.max_candidates]]
+        return [(int(y), int(x)) for y, x in cells if conf[y, x] < 1.0]
+
+    def repair(self, modules, confidence) -> RepairResult:
+        t0 = time.perf_counter()
+        grid = np.array(modules, dtype=np.uint8)
+        conf = np.asarray(confidence, dtype=np.float64)
+        if grid.shape != conf.shape:
+            raise ValueError(f"vector と confidence の形が一致しません: {grid.shape} != {conf.shape}")
+
+        decodes = 1
+        payload = self.decoder.decode_modules(grid, scale=self.decode_scale)
+        if payload is not None:
+            return RepairResult(payload, grid, [], decodes, 0, (time.perf_counter() - t0) * 1000.0)
+
+        cands = self.candidates(conf)
+        cost = [conf[c] for c in cands]
+        heap = [(cost[i], (i,)) for i in range(len(cands))]
+        heapq.heapify(heap)
+
+        rejected = 0
+        while heap and decodes < self.max_decodes and rejected < 20 * self.max_decodes:
+            total, combo = heapq.heappop(heap)
+            cells = [cands[i] for i in combo]
+            for y, x in cells:
+                grid[y, x] ^= 1
+            if self.validator.validate(grid).ok:
+                payload = self.decoder.decode_modules(grid, scale=self.decode_scale)
+                decodes += 1
+                if payload is not None:
+                    return RepairResult(payload, grid, cells, decodes, rejected, (time.perf_counter() - t0) * 1000.0)
+            else:
+                rejected += 1
+            for y, x in cells:
+                grid[y, x] ^= 1
+
+            if len(combo) < self.max_flips:
+                for j in range(combo[-1] + 1, len(cands)):
+                    heapq.heappush(heap, (total + cost[j], combo + (j,)))
+
+        return RepairResult(None, grid, [], decodes, rejected, (time.perf_counter() - t0) * 1000.0)
@@ -0,0 +1,163 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+import numpy as np
+
+FORMAT_MASK = 0x5412
+FORMAT_GENERATOR = 0x537    # BCH(15,5)
+VERSION_GENERATOR = 0x1F25  # Golay(18,6)
+
+
+def _bch_remainder(value: int, generator: int, data_bits: int, total_bits: int) -> int:
+    ecc_bits = total_bits - data_bits
+    rem = value << ecc_bits
+    for shift in range(data_bits - 1, -1, -1):
+        if rem >> (shift + ecc_bits) & 1:
+            rem ^= generator << shift
+    return rem
+
+
+def _bits(value: int, n: int) -> np.ndarray:
+    """value の下位 n ビット（bit0 が先頭）。"""
+    return (value >> np.arange(n)) & 1
+
+
+# 正しい形式情報 32 通り（誤り訂正レベル2ビット＋マスク3ビット）の15ビット表
+FORMAT_CODEWORDS = np.array([
+    _bits(((d << 10) | _bch_remainder(d, FORMAT_GENERATOR, 5, 15)) ^ FORMAT_MASK, 15) for d in range(32)
+], dtype=np.uint8)
+
+
+def version_codeword(version: int) -> np.ndarray:
+    return _bits((version << 12) | _bch_remainder(version, VERSION_GENERATOR, 6, 18), 18).astype(np.uint8)
+
+
+@dataclass
+class ValidationResult:
+    """構造チェックの結果。ok=False の行列はデコードしても読めない見込みが高い。"""
+    ok: bool
+    score: float                 # 0〜1（高いほど QR コードらしい）
+    reason: str | None = None    # 却下理由: "size" / "finder" / "timing" / "dark_module" / "format" / "version"
+    details: dict = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return {"ok": self.ok, "score": round(self.score, 4), "reason": self.reason, **self.details}
+
+
+@lru_cache(maxsize=None)
+def _layout(size: int) -> dict:
+    """module 数ごとの検査位置（行・列のインデックス配列と期待値）。"""
+    # finder（7×7）＋区切りの白（内側1列）
+    f = np.zeros((8, 8), dtype=np.uint8)
+    f[:7, :7] = 1
+    f[1:6, 1:6] = 0
+    f[2:5, 2:5] = 1
+    ys, xs = np.mgrid[0:8, 0:8]
+    fy = np.concatenate([ys.ravel(), ys.ravel(), size - 1 - ys.ravel()])
+    fx = np.concatenate([xs.ravel(), size - 1 - xs.ravel(), xs.ravel()])
+    fexp = np.tile(f.ravel(), 3)
+
+    # タイミングパターン（6行目・6列目、偶数位置が黒）
+    t = np.arange(8, size - 8)
+    ty = np.concatenate([np.full(t.size, 6), t])
+    tx = np.concatenate([t, np.full(t.size, 6)])
+    texp = ((np.concatenate([t, t]) % 2) == 0).astype(np.uint8)
+
+    # 形式情報 2 か所（bit0 から順の位置）
+    i = np.arange(15)
+    c1y = np.array([0, 1, 2, 3, 4, 5, 7, 8, 8, 8, 8, 8, 8, 8, 8])
+    c1x = np.array([8, 8, 8, 8, 8, 8, 8, 8, 7, 5, 4, 3, 2, 1, 0])
+    c2y = np.where(i < 8, 8, size - 15 + i)
+    c2x = np.where(i < 8, size - 1 - i, 8)
+
+    layout = {
+        "finder": (fy, fx, fexp),
+        "timing": (ty, tx, texp),
+        "format": ((c1y, c1x), (c2y, c2x)),
+        "dark": (size - 8, 8),
+    }
+    version = (size - 17) // 4
+    if version >= 7:
+        k = np.arange(18)
+        a = size - 11 + k % 3
+        b = k // 3
+        layout["version"] = ((b, a), (a, b), version_codeword(version))
+    return layout
+
+
+class StructureValidator:
+    """
+    module×module の 0/1 行列（1=黒）が QR コードとして成り立っているかを、デコードせずに調べる。
+
+    - finder pattern（3隅＋区切り）とタイミングパターンの一致率
+    - 右下寄りの dark module（常に黒）
+    - 形式情報 2 か所と正しい 32 符号語との最小ハミング距離（BCH で 3 ビットまで訂正可能）
+    - version 7 以上では版情報 2 か所と期待符号語との距離
+
+    すべてインデックス配列の一括参照なので 1 行列あたり数十マイクロ秒で済む。
+    """
+
+    def __init__(self, min_finder: float = 0.9, min_timing: float = 0.8, max_format_errors: int = 3,
+                 max_version_errors: int = 3):
+        self.min_finder = min_finder
+        self.min_timing = min_timing
+        self.max_format_errors = max_format_errors
+        self.max_version_errors = max_version_errors
+
+    def validate(self, modules) -> ValidationResult:
+        grid = np.asarray(modules, dtype=np.uint8)
+        size = grid.shape[0] if grid.ndim == 2 else 0
+        if grid.ndim != 2 or grid.shape[1] != size or size < 21 or (size - 17) % 4:
+            return ValidationResult(False, 0.0, "size", {"size": list(grid.shape)})
+        layout = _layout(size)
+
+        fy, fx, fexp = layout["finder"]
+        finder = float((grid[fy, fx] == fexp).mean())
+        ty, tx, texp = layout["timing"]
+        timing = float((grid[ty, tx] == texp).mean())
+        dark = bool(grid[layout["dark"]] == 1)
+
+        # 2 か所のうち近い方を採用
+        best = None
+        for cy, cx in layout["format"]:
+            dist = (grid[cy, cx][None, :] != FORMAT_CODEWORDS).sum(axis=1)
+            d = int(dist.min())
+            if best is None or d < best[0]:
+                best = (d, int(dist.argmin()))
+        format_errors, fmt = best
+        details = {
+            "finder": round(finder, 4),
+            "timing": round(timing, 4),
+            "dark_module": dark,
+            "format_errors": format_errors,
+            "ec_level": ("M", "L", "H", "Q")[fmt >> 3],
+            "mask": fmt & 7,
+        }
+
+        version_errors = 0
+        if "version" in layout:
+            (vy1, vx1), (vy2, vx2), expected = layout["version"]
+            version_errors = int(min((grid[vy1, vx1] != expected).sum(), (grid[vy2, vx2] != expected).sum()))
+            details["version_errors"] = version_errors
+
+        score = (
+            0.3 * finder
+            + 0.3 * timing
+            + 0.3 * max(0.0, 1.0 - format_errors / 7.0)
+            + 0.1 * (1.0 if dark else 0.0)
+        )
+        if "version" in layout:
+            score = 0.9 * score + 0.1 * max(0.0, 1.0 - version_errors / 9.0)
+
+        reason = None
+        if finder < self.min_finder:
+            reason = "finder"
+        elif timing < self.min_timing:
+            reason = "timing"
+        elif not dark:
+            reason = "dark_module"
+        elif format_errors > self.max_format_errors:
+            reason = "format"
+        elif version_errors > self.max_version_errors:
+            reason = "version"
+        return ValidationResult(reason is None, float(score), reason, details)
@@ -0,0 +1,145 @@
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List
+
+import cv2
+import numpy as np
+
+from pipeline.calibration import otsu_threshold
+
+FAST = "fast"
+HEAVY = "heavy"
+
+
+@dataclass
+class QualityEstimate:
+    """縮小画像から求める画質の目安（どれも大きいほど素直な画像）。"""
+    sharpness: float     # 縮小画像のラプラシアン分散 / contrast²（ぼけると小さい。明るさ・コントラストによらない）
+    bimodality: float    # module×module のセル平均の大津の分離度（0〜1、白黒がはっきり分かれるほど 1 に近い）
+    contrast: float      # 縮小画像の輝度の 5〜95 パーセンタイル幅（0〜255）
+    pitch: float         # 推定モジュールピッチ（元画像の px）
+    pitch_error: float   # pitch×module と画像の短辺のずれの割合（余白・傾き・歪みがあると大きい）
+    elapsed_ms: float
+
+    def to_dict(self) -> Dict[str, float]:
+        return {k: round(float(v), 4) for k, v in asdict(self).items()}
+
+
+def _run_lengths(binary: np.ndarray) -> np.ndarray:
+    """各行の同じ値が続く長さ（行の両端で途切れるものは除く）をまとめて返す。"""
+    change = binary[:, 1:] != binary[:, :-1]
+    ys, xs = np.nonzero(change)
+    if xs.size < 2:
+        return np.zeros(0, dtype=np.int64)
+    lengths = np.diff(xs)
+    return lengths[ys[1:] == ys[:-1]]
+
+
+def estimate_quality(img: np.ndarray, module: int = 33, ppm: int = 4) -> QualityEstimate:
+    """
+    グレースケール画像を 1モジュール ppm px 程度の縮小画像にしてから画質の目安を求める
+    （33×33 なら 132px 角。元画像の大きさによらず 1 枚あたり 1ms 未満）。
+    """
+    t0 = time.perf_counter()
+    h, w = img.shape
+    side = min(h, w)
+    scale = min(1.0, module * ppm / float(side))
+    thumb = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA) \
+        if scale < 1.0 else img
+
+    lo, hi = np.percentile(thumb, (5, 95))
+    sharpness = float(cv2.Laplacian(thumb, cv2.CV_32F).var()) / max(1.0, float(hi - lo)) ** 2
+    cells = cv2.resize(img, (module, module), interpolation=cv2.INTER_AREA)
+    _, bimodality = otsu_threshold(np.bincount(cells.ravel(), minlength=256))
+
+    # 輝度幅の中央で2値化し、縦横の黒白の連続長のうち最頻値付近（1 モジュール分）の中央値をピッチとする
+    binary = thumb >= (lo + hi) / 2.0
+    runs = np.concatenate([_run_lengths(binary), _run_lengths(binary.T)])
+    if runs.size:
+        # ぼけで 1 モジュール分の長さが ±1px ばらつくので隣と合算した頻度の最大を取る
+        mode = max(1, int(np.convolve(np.bincount(runs), np.ones(3), mode="same").argmax()))
+        pitch = float(np.median(runs[runs <= 1.5 * mode])) / scale
+    else:
+        pitch = float(side)
+    return QualityEstimate(
+        sharpness=sharpness,
+        bimodality=float(bimodality),
+        contrast=float(hi - lo),
+        pitch=pitch,
+        pitch_error=abs(pitch * module - side) / side,
+        elapsed_ms=(time.perf_counter() - t0) * 1000.0,
+    )
+
+
+class QualityRouter:
+    """
+    画質の目安で画像を fast（そのまま1回2値化して構造チェックだけ）と heavy（位置検出・しきい値の
+    振り直し・修復探索）に振り分け、経路ごとの枚数・成功数・処理時間を数える。
+
+    - しきい値はどれか1つでも下回れば heavy（理由は最初に外れた項目名）
+    - fast で構造チェックに通らなかったものは heavy でやり直し、fast の escalated として数える
+      （escalated が多いならしきい値が甘い、heavy の多くが一発で読めるなら厳しすぎる）
+    - decisions に1枚ごとの目安の値と結果を残す（results_db の routes / routing.json に書いて調整に使う）
+    """
+
+    def __init__(
+        self,
+        min_sharpness: float = 0.05,
+        min_bimodality: float = 0.9,
+        min_contrast: float = 120.0,
+        max_pitch_error: float = 0.1,
+    ):
+        self.min_sharpness = min_sharpness
+        self.min_bimodality = min_bimodality
+        self.min_contrast = min_contrast
+        self.max_pitch_error = max_pitch_error
+        self.stats: Dict[str, Dict[str, float]] = {}
+        self.decisions: List[Dict[str, Any]] = []
+
+    def thresholds(self) -> Dict[str, float]:
+        return {
+            "min_sharpness": self.min_sharpness,
+            "min_bimodality": self.min_bimodality,
+            "min_contrast": self.min_contrast,
+            "max_pitch_error": self.max_pitch_error,
+        }
+
+    def route(self, quality: QualityEstimate) -> tuple[str, str | None]:
+        """(経路, heavy にした理由 or None)。"""
+        if quality.contrast < self.min_contrast:
+            return HEAVY, "contrast"
+        if quality.bimodality < self.min_bimodality:
+            return HEAVY, "bimodality"
+        if quality.sharpness < self.min_sharpness:
+            return HEAVY, "sharpness"
+        if quality.pitch_error > self.max_pitch_error:
+            return HEAVY, "pitch"
+        return FAST, None
+
+    def record(self, name: str, route: str, reason: str | None, quality: QualityEstimate,
+               elapsed_ms: float, ok: bool, escalated: bool = False) -> None:
+        """1枚分の判断と結果を decisions に残し、経路ごとの集計に足す（elapsed_ms は読み込みから最後まで）。"""
+        self.decisions.append({
+            "name": name, "route": route, "reason": reason, "quality": quality.to_dict(),
+            "escalated": bool(escalated), "ok": bool(ok), "elapsed_ms": round(float(elapsed_ms), 3),
+        })
+        s = self.stats.setdefault(route, {"images": 0, "ok": 0, "escalated": 0, "elapsed_ms": 0.0})
+        s["images"] += 1
+        s["ok"] += int(bool(ok))
+        s["escalated"] += int(bool(escalated))
+        s["elapsed_ms"] += float(elapsed_ms)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """経路ごとの枚数・成功率・1枚あたりの時間・スループット（枚/秒）。"""
+        out = {}
+        for route, s in sorted(self.stats.items()):
+            n = s["images"]
+            out[route] = {
+                "images": n,
+                "ok": s["ok"],
+                "success_rate": round(s["ok"] / n, 4) if n else None,
+                "escalated": s["escalated"],
+                "ms_per_image": round(s["elapsed_ms"] / n, 3) if n else None,
+                "images_per_sec": round(n * 1000.0 / s["elapsed_ms"], 2) if s["elapsed_ms"] > 0 else None,
+            }
+        return out
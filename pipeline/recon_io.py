@@ -0,0 +1,91 @@
+import os
+
+import cv2
+import numpy as np
+from PIL import Image, PngImagePlugin
+
+from pipeline.buffer_pool import local_pool
+from pipeline.qr_enhancer import render_modules
+
+# 再生成画像（qr_raimu）の書き出し形式
+#   png8   : 8bit グレースケール PNG（従来どおり）
+#   png1   : 1bit PNG。画素は 0/255 だけなので png8 と同じ画像を数十分の一のサイズで保存できる
+#   tiff_g4: CCITT Group4 圧縮の 1bit TIFF（FAX・文書スキャン系のツールに渡す場合）
+#   module : 1モジュール1画素の 1bit PNG。元サイズはテキストチャンクに記録し、読み手が必要な時に拡大する
+RECON_FORMATS = ("png8", "png1", "tiff_g4", "module")
+RECON_EXTS = (".png", ".jpg", ".jpeg", ".tif", ".tiff")
+MODULE_SIZE_KEY = "qr-size"
+
+_PNG1_PARAMS = [cv2.IMWRITE_PNG_BILEVEL, 1, cv2.IMWRITE_PNG_COMPRESSION, 6]
+
+
+def recon_ext(fmt: str) -> str:
+    return ".tif" if fmt == "tiff_g4" else ".png"
+
+
+def write_reconstruction(path_stem: str, modules, width: int, height: int, fmt: str = "png8") -> str:
+    """
+    0/1 のモジュール行列（1=黒）から再生成画像を fmt で書き出し、書いたパスを返す。
+    path_stem は拡張子なしのパス（拡張子は fmt で決まる）。
+    """
+    if fmt not in RECON_FORMATS:
+        raise ValueError(f"unknown reconstruction format: {fmt} (choose from {RECON_FORMATS})")
+    grid = np.asarray(modules, dtype=np.uint8)
+    path = path_stem + recon_ext(fmt)
+
+    if fmt == "module":
+        info = PngImagePlugin.PngInfo()
+        info.add_text(MODULE_SIZE_KEY, f"{int(width)}x{int(height)}")
+        Image.fromarray(grid == 0).save(path, pnginfo=info)   # True=白 の 1bit 画像
+        return path
+
+    img = render_modules(grid, width, height, out=local_pool().get("reconstruct", (height, width), np.uint8))
+    if fmt == "png8":
+        cv2.imwrite(path, img)
+    elif fmt == "png1":
+        cv2.imwrite(path, img, _PNG1_PARAMS)
+    else:
+        Image.fromarray(img >= 128).save(path, compression="group4")
+    return path
+
+
+def read_module_grid(path: str) -> tuple[np.ndarray, int, int] | None:
+    """module 形式なら (0/1 行列, 元の幅, 元の高さ) を、それ以外の画像なら None を返す。"""
+    if os.path.splitext(path)[1].lower() != ".png":
+        return None
+    try:
+        with Image.open(path) as im:
+            size = im.info.get(MODULE_SIZE_KEY)
+            if size is None:
+                return None
+            grid = (np.asarray(im.convert("L")) < 128).astype(np.uint8)
+        width, height = (int(v) for v in size.split("x"))
+    except (OSError, ValueError):
+        return None
+    return grid, width, height
+
+
+def _fit(width: int, height: int, max_side: int | None) -> tuple[int, int]:
+    if not max_side or max(width, height) <= max_side:
+        return width, height
+    f = max_side / float(max(width, height))
+    return max(1, int(round(width * f))), max(1, int(round(height * f)))
+
+
+def load_reconstruction(path: str, max_side: int | None = None) -> np.ndarray | None:
+    """
+    qr_raimu の再生成画像を形式によらず 0/255 のグレースケールで読む。
+    module 形式は記録された元サイズに拡大する。max_side を指定すると長辺をそれ以下に抑える
+    （レポートのサムネイル用。module 形式なら最初からその大きさで描くので拡大の無駄がない）。
+    """
+    m = read_module_grid(path)
+    if m is not None:
+        grid, width, height = m
+        return render_modules(grid, *_fit(width, height, max_side))
+    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    size = _fit(img.shape[1], img.shape[0], max_side)
+    if size != (img.shape[1], img.shape[0]):
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    return img
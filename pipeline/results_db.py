@@ -0,0 +1,422 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+DEFAULT_DB_PATH = os.path.join("qr_statistics", "results.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS param_sets (
+    id INTEGER PRIMARY KEY,
+    digest TEXT NOT NULL UNIQUE,
+    params TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    step TEXT NOT NULL,
+    param_set_id INTEGER REFERENCES param_sets(id),
+    started_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS runs_step ON runs(step, id);
+
+CREATE TABLE IF NOT EXISTS images (
+    file TEXT PRIMARY KEY,
+    width INTEGER,
+    height INTEGER,
+    size INTEGER,
+    mtime_ns INTEGER,
+    last_run_id INTEGER REFERENCES runs(id)
+);
+
+CREATE TABLE IF NOT EXISTS vectors (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    file TEXT NOT NULL,
+    module INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    bits BLOB NOT NULL,
+    confidence BLOB,
+    duplicate_of TEXT
+);
+CREATE INDEX IF NOT EXISTS vectors_name ON vectors(name, id);
+CREATE INDEX IF NOT EXISTS vectors_run ON vectors(run_id);
+
+CREATE TABLE IF NOT EXISTS decodes (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    file TEXT NOT NULL,
+    original TEXT,
+    reconstructed TEXT,
+    match INTEGER,
+    structure_score REAL,
+    structure_reject TEXT
+);
+CREATE INDEX IF NOT EXISTS decodes_name ON decodes(name, id);
+CREATE INDEX IF NOT EXISTS decodes_run ON decodes(run_id, match);
+CREATE INDEX IF NOT EXISTS decodes_match ON decodes(match, run_id);
+
+CREATE TABLE IF NOT EXISTS top_row (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    thresh REAL,
+    avgs BLOB NOT NULL,
+    min_margin REAL
+);
+CREATE INDEX IF NOT EXISTS top_row_name ON top_row(name, id);
+CREATE INDEX IF NOT EXISTS top_row_margin ON top_row(min_margin);
+
+CREATE TABLE IF NOT EXISTS timings (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    elapsed_ms REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timings_run ON timings(run_id, stage);
+CREATE INDEX IF NOT EXISTS timings_name ON timings(name, id);
+
+CREATE TABLE IF NOT EXISTS routes (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    route TEXT NOT NULL,
+    reason TEXT,
+    sharpness REAL,
+    bimodality REAL,
+    contrast REAL,
+    pitch REAL,
+    pitch_error REAL,
+    escalated INTEGER NOT NULL,
+    ok INTEGER NOT NULL,
+    elapsed_ms REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS routes_run ON routes(run_id, route);
+"""
+
+_INSERT = {
+    "images": "INSERT INTO images (file, width, height, size, mtime_ns, last_run_id) VALUES (?, ?, ?, ?, ?, ?) "
+              "ON CONFLICT(file) DO UPDATE SET width=excluded.width, height=excluded.height, size=excluded.size, "
+              "mtime_ns=excluded.mtime_ns, last_run_id=excluded.last_run_id",
+    "vectors": "INSERT INTO vectors (run_id, name, file, module, width, height, bits, confidence, duplicate_of) "
+               "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    "decodes": "INSERT INTO decodes (run_id, name, file, original, reconstructed, match, structure_score, "
+               "structure_reject) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+    "top_row": "INSERT INTO top_row (run_id, name, thresh, avgs, min_margin) VALUES (?, ?, ?, ?, ?)",
+    "timings": "INSERT INTO timings (run_id, name, stage, elapsed_ms) VALUES (?, ?, ?, ?)",
+    "routes": "INSERT INTO routes (run_id, name, route, reason, sharpness, bimodality, contrast, pitch, pitch_error, "
+              "escalated, ok, elapsed_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+}
+
+
+# ---------- 行列のパック ----------
+def pack_vector(modules) -> bytes:
+    """0/1 行列を 1セル1ビットに詰める（33×33 で 137 バイト）。"""
+    return np.packbits(np.asarray(modules, dtype=np.uint8).ravel()).tobytes()
+
+
+def unpack_vector(blob: bytes, module: int) -> np.ndarray:
+    bits = np.unpackbits(np.frombuffer(blob, dtype=np.uint8), count=module * module)
+    return bits.reshape(module, module)
+
+
+def pack_confidence(confidence) -> bytes:
+    """確信度（0〜1）を JSON と同じ小数3桁の精度で uint16 に詰める。"""
+    return np.round(np.asarray(confidence, dtype=np.float64) * 1000.0).astype("<u2").tobytes()
+
+
+def unpack_confidence(blob: bytes, module: int) -> np.ndarray:
+    return (np.frombuffer(blob, dtype="<u2").astype(np.float64) / 1000.0).reshape(module, module)
+
+
+def _name(filename: str) -> str:
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+class ResultsDB:
+    """
+    処理結果をまとめて持つ SQLite（標準ライブラリ sqlite3、WAL モード）。
+
+    - runs / param_sets: 実行単位（Step1・Step2 など）と、その時のパラメータ（同じ組は1行にまとめる）
+    - images: 元画像のサイズ・解像度、vectors: ビットに詰めた 0/1 行列と確信度
+    - decodes: デコード結果と構造チェック、top_row: トップ行セル平均としきい値からの最小距離
+    - timings: 画像ごと・段階ごとの処理時間
+    - routes: 画質による振り分け（fast / heavy）の判断材料・結果・処理時間（しきい値の調整用）
+
+    各表は name（qr_vector の stem。qr_raimu の画像名とも一致）で結び付けられる。
+    add_* は batch_size 行たまるまでメモリに溜め、executemany でまとめて1トランザクションに書く。
+    接続はスレッドごとに持つので、Flask のワーカースレッドからも使える。
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, batch_size: int = 500):
+        self.path = path
+        self.batch_size = batch_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending: Dict[str, List[tuple]] = {table: [] for table in _INSERT}
+        self._pending_rows = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        self.flush()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # ---------- 書き込み ----------
+    def _queue(self, table: str, row: tuple) -> None:
+        with self._lock:
+            self._pending[table].append(row)
+            self._pending_rows += 1
+            full = self._pending_rows >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        """溜めた行を1トランザクションで書き込む。"""
+        with self._lock:
+            pending = {t: rows for t, rows in self._pending.items() if rows}
+            self._pending = {table: [] for table in _INSERT}
+            self._pending_rows = 0
+        if not pending:
+            return
+        conn = self._conn()
+        with conn:
+            for table, rows in pending.items():
+                conn.executemany(_INSERT[table], rows)
+
+    def begin_run(self, step: str, params: dict | None = None) -> int:
+        conn = self._conn()
+        with conn:
+            param_set_id = None
+            if params is not None:
+                text = json.dumps(params, sort_keys=True, ensure_ascii=False)
+                digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+                conn.execute("INSERT OR IGNORE INTO param_sets (digest, params) VALUES (?, ?)", (digest, text))
+                param_set_id = conn.execute("SELECT id FROM param_sets WHERE digest = ?", (digest,)).fetchone()[0]
+            cur = conn.execute(
+                "INSERT INTO runs (step, param_set_id, started_at) VALUES (?, ?, ?)", (step, param_set_id, time.time())
+            )
+        return int(cur.lastrowid)
+
+    def end_run(self, run_id: int) -> None:
+        self.flush()
+        conn = self._conn()
+        with conn:
+            conn.execute("UPDATE runs SET finished_at = ? WHERE id = ?", (time.time(), run_id))
+
+    def add_image(self, run_id: int, file: str, width: int, height: int,
+                  size: int | None = None, mtime_ns: int | None = None) -> None:
+        self._queue("images", (file, int(width), int(height), size, mtime_ns, run_id))
+
+    def add_vector(self, run_id: int, name: str, file: str, modules, width: int, height: int,
+                   confidence=None, duplicate_of: str | None = None) -> None:
+        grid = np.asarray(modules, dtype=np.uint8)
+        self._queue("vectors", (
+            run_id, name, file, int(grid.shape[0]), int(width), int(height), pack_vector(grid),
+            pack_confidence(confidence) if confidence is not None else None, duplicate_of,
+        ))
+
+    def add_decode(self, run_id: int, file: str, original: str | None, reconstructed: str | None,
+                   match: bool | None, structure_score: float | None = None,
+                   structure_reject: str | None = None) -> None:
+        self._queue("decodes", (
+            run_id, _name(file), file, original, reconstructed,
+            None if match is None else int(bool(match)), structure_score, structure_reject,
+        ))
+
+    def add_top_row(self, run_id: int, name: str, avgs, thresh: float) -> None:
+        arr = np.asarray(avgs, dtype=np.float32)
+        valid = arr[~np.isnan(arr)]
+        margin = float(np.abs(valid - thresh).min()) if valid.size else None
+        self._queue("top_row", (run_id, name, float(thresh), arr.tobytes(), margin))
+
+    def add_timing(self, run_id: int, name: str, stage: str, elapsed_ms: float) -> None:
+        self._queue("timings", (run_id, name, stage, float(elapsed_ms)))
+
+    def add_route(self, run_id: int, name: str, route: str, reason: str | None, quality: dict,
+                  escalated: bool, ok: bool, elapsed_ms: float) -> None:
+        self._queue("routes", (
+            run_id, name, route, reason,
+            *(quality.get(k) for k in ("sharpness", "bimodality", "contrast", "pitch", "pitch_error")),
+            int(bool(escalated)), int(bool(ok)), float(elapsed_ms),
+        ))
+
+    # ---------- 読み出し ----------
+    def latest_run(self, step: str) -> int | None:
+        row = self._conn().execute("SELECT max(id) FROM runs WHERE step = ?", (step,)).fetchone()
+        return row[0]
+
+    def run_finished_at(self, run_id: int) -> float | None:
+        """実行の終了時刻（途中で止まった実行は None）。"""
+        row = self._conn().execute("SELECT finished_at FROM runs WHERE id = ?", (run_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def latest_vector(self, name: str) -> Dict[str, Any] | None:
+        row = self._conn().execute(
+            "SELECT * FROM vectors WHERE name = ? ORDER BY id DESC LIMIT 1", (name,)
+        ).fetchone()
+        if row is None:
+            return None
+        module = row["module"]
+        return {
+            "run_id": row["run_id"],
+            "file": row["file"],
+            "module": module,
+            "width": row["width"],
+            "height": row["height"],
+            "vector": unpack_vector(row["bits"], module),
+            "confidence": unpack_confidence(row["confidence"], module) if row["confidence"] is not None else None,
+            "duplicate_of": row["duplicate_of"],
+        }
+
+    def latest_vector_bits(self, module: int, step: str | None = None) -> List[tuple]:
+        """name ごとの最新の (name, 詰めたビット) を name 順に返す（step 指定でその種類の実行に絞る）。"""
+        rows = self._conn().execute(
+            """
+            SELECT name, bits FROM vectors WHERE id IN (
+                SELECT max(v.id) FROM vectors v JOIN runs r ON r.id = v.run_id
+                WHERE v.module = ? AND (? IS NULL OR r.step = ?)
+                GROUP BY v.name
+            )
+            ORDER BY name
+            """,
+            (module, step, step),
+        )
+        return [(name, bits) for name, bits in rows]
+
+    def decode_records(self, run_id: int | None = None) -> List[Dict[str, Any]]:
+        """Step2 の評価結果を evaluate.json と同じ形で返す（run_id 省略時は最新の Step2）。"""
+        if run_id is None:
+            run_id = self.latest_run("step2")
+            if run_id is None:
+                return []
+        rows = self._conn().execute(
+            "SELECT file, original, reconstructed, match, structure_score, structure_reject "
+            "FROM decodes WHERE run_id = ? ORDER BY id", (run_id,)
+        ).fetchall()
+        records = []
+        for r in rows:
+            rec = {"file": r["file"], "original": r["original"], "reconstructed": r["reconstructed"],
+                   "match": bool(r["match"])}
+            if r["structure_score"] is not None or r["structure_reject"] is not None:
+                rec["structure_score"] = r["structure_score"]
+                rec["structure_reject"] = r["structure_reject"]
+            records.append(rec)
+        return records
+
+    def match_by_name(self, names: List[str] | None = None) -> Dict[str, bool]:
+        """
+        name → 最新の Step2 での一致結果。names を渡すとその名前だけを decodes_name 索引で引く
+        （一覧の1ページ分など。省略すると全件）。
+        """
+        run_id = self.latest_run("step2")
+        if run_id is None:
+            return {}
+        conn = self._conn()
+        if names is None:
+            rows = conn.execute("SELECT name, match FROM decodes WHERE run_id = ?", (run_id,)).fetchall()
+        else:
+            names = list(dict.fromkeys(names))
+            rows = []
+            # SQLite のプレースホルダ数の上限（既定 999）を超えないよう分ける
+            for i in range(0, len(names), 500):
+                chunk = names[i:i + 500]
+                rows += conn.execute(
+                    f"SELECT name, match FROM decodes WHERE run_id = ? AND name IN ({','.join('?' * len(chunk))})",
+                    (run_id, *chunk),
+                ).fetchall()
+        return {name: bool(match) for name, match in rows}
+
+    def route_summary(self, run_id: int | None = None) -> List[Dict[str, Any]]:
+        """経路ごとの枚数・成功数・fast から回された数・1枚あたりの時間（run_id 省略時は最新の Step1）。"""
+        run_id = run_id if run_id is not None else self.latest_run("step1")
+        rows = self._conn().execute(
+            """
+            SELECT route, count(*) AS images, sum(ok) AS ok, sum(escalated) AS escalated,
+                   avg(elapsed_ms) AS ms_per_image, min(sharpness) AS min_sharpness,
+                   min(bimodality) AS min_bimodality, min(contrast) AS min_contrast, max(pitch_error) AS max_pitch_error
+            FROM routes WHERE run_id = ? GROUP BY route ORDER BY route
+            """,
+            (run_id,),
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def failures_near_threshold(self, margin: float = 10.0, since: float | None = None) -> List[Dict[str, Any]]:
+        """
+        デコードが一致しなかった画像のうち、トップ行平均がしきい値から margin 以内だったもの。
+        since（UNIX 時刻）以降に始まった実行に絞れる。
+        """
+        rows = self._conn().execute(
+            """
+            SELECT d.name, d.file, d.original, d.reconstructed, d.structure_reject,
+                   t.min_margin, t.thresh, r.id AS run_id, r.started_at
+            FROM decodes d
+            JOIN runs r ON r.id = d.run_id
+            JOIN top_row t ON t.id = (SELECT max(id) FROM top_row WHERE name = d.name)
+            WHERE d.match = 0 AND r.started_at >= ? AND t.min_margin <= ?
+            ORDER BY t.min_margin, d.id
+            """,
+            (since or 0.0, margin),
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+
+def load_evaluation(json_path: str = "evaluate.json", db_path: str = DEFAULT_DB_PATH) -> List[Dict[str, Any]]:
+    """
+    レポート用の評価結果。results.sqlite3 の最新の Step2 が json_path より新しい（json_path を書いた後に
+    終わった）場合だけ DB から、それ以外は json_path から読む。results_db=False で Step2 をやり直した後や、
+    別の評価結果の JSON を渡した場合に古い DB の行を見せないため。どちらもない場合は FileNotFoundError。
+    """
+    json_mtime = os.path.getmtime(json_path) if os.path.exists(json_path) else None
+    if os.path.exists(db_path):
+        db = ResultsDB(db_path)
+        try:
+            run_id = db.latest_run("step2")
+            finished = db.run_finished_at(run_id) if run_id is not None else None
+            if finished is not None and (json_mtime is None or finished >= json_mtime):
+                return db.decode_records(run_id)
+        finally:
+            db.close()
+    with open(json_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv: List[str] | None = None) -> None:
+    ap = argparse.ArgumentParser(description="トップ行平均がしきい値付近で失敗した画像を一覧する")
+    ap.add_argument("db", nargs="?", default=DEFAULT_DB_PATH)
+    ap.add_argument("--margin", type=float, default=10.0, help="しきい値からの距離の上限")
+    ap.add_argument("--days", type=float, default=7.0, help="何日前までの実行を対象にするか")
+    args = ap.parse_args(argv)
+    if not os.path.exists(args.db):
+        raise SystemExit(f"エラー: '{args.db}' が見つかりません。")
+    db = ResultsDB(args.db)
+    since = time.time() - args.days * 86400.0 if math.isfinite(args.days) else None
+    print(json.dumps(db.failures_near_threshold(args.margin, since), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
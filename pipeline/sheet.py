@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import cv2
+import numpy as np
+
+from pipeline.qr_decode import QRCodeDecoder
+from pipeline.qr_enhancer import QREnhancer
+
+
+def _iou(a: tuple, b: tuple) -> float:
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+class SheetProcessor:
+    """
+    1枚のスキャン（A3 など）に並んだ複数の QR コードを個別に処理する。
+
+    1. 長辺 detect_side 以下に縮小したコピーでコード領域を検出
+       （cv2.QRCodeDetector.detectMulti と、黒モジュールの塊を膨張でつなげた矩形を併用）
+    2. フル解像度からマージン付きでタイルを切り出す（コピーせず view のまま渡す）
+    3. タイルごとに位置検出＋鮮明化＋デコードをスレッドプールで並列実行
+       （QREnhancer は状態を持つので、ワーカースレッドごとに1つずつ持つ）
+
+    結果は読み順（上の行から左→右）に index を振って返す。
+    """
+
+    def __init__(
+        self,
+        enhancer_params: dict | None = None,
+        workers: int | None = None,
+        detect_side: int = 1600,     # 検出用縮小画像の長辺
+        margin: float = 0.15,        # タイルの余白（コード一辺に対する割合）
+        min_side_px: int = 24,       # 縮小画像上でこれより小さい領域は無視
+        decode_scale: int = 4,
+    ):
+        self.enhancer_params = dict(enhancer_params or {})
+        self.enhancer_params["verbose"] = False
+        # タイル内のコード位置・傾きは一定でないので位置検出は常に行う
+        self.enhancer_params["localize"] = True
+        self.enhancer_params.pop("target_ppm", None)
+        self.module = int(self.enhancer_params.get("module", 33))
+        self.workers = workers or os.cpu_count() or 1
+        self.detect_side = detect_side
+        self.margin = margin
+        self.min_side_px = min_side_px
+        self.decode_scale = decode_scale
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="qr-sheet")
+        self._local = threading.local()
+        self._detector = cv2.QRCodeDetector()
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True)
+
+    # ---------- 領域検出 ----------
+    def detect_regions(self, gray: np.ndarray) -> List[tuple[int, int, int, int]]:
+        """コード領域の (x, y, w, h) をフル解像度の座標で返す（読み順）。"""
+        h, w = gray.shape
+        factor = max(1.0, max(h, w) / float(self.detect_side))
+        small = gray if factor == 1.0 else cv2.resize(
+            gray, (int(round(w / factor)), int(round(h / factor))), interpolation=cv2.INTER_AREA
+        )
+
+        boxes: List[tuple[int, int, int, int]] = []
+        try:
+            ok, points = self._detector.detectMulti(small)
+        except cv2.error:
+            ok, points = False, None
+        if ok and points is not None:
+            for quad in points:
+                x, y, bw, bh = cv2.boundingRect(np.asarray(quad, dtype=np.float32))
+                if min(bw, bh) >= self.min_side_px:
+                    boxes.append((x, y, bw, bh))
+
+        # detectMulti が取りこぼした分を塊検出で補う
+        for box in self._blob_regions(small):
+            if all(_iou(box, b) < 0.3 for b in boxes):
+                boxes.append(box)
+
+        full = [
+            (int(x * factor), int(y * factor), int(np.ceil(bw * factor)), int(np.ceil(bh * factor)))
+            for x, y, bw, bh in boxes
+        ]
+        return self._reading_order(full)
+
+    def _blob_regions(self, small: np.ndarray) -> List[tuple[int, int, int, int]]:
+        """黒い部分を閉処理でつなげ、ほぼ正方形で中身の詰まった塊をコード候補とする。"""
+        _, dark = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        k = max(3, min(small.shape) // 100) | 1
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (k, k))
+        closed = cv2.morphologyEx(dark, cv2.MORPH_CLOSE, kernel, iterations=2)
+        contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        boxes = []
+        for c in contours:
+            x, y, bw, bh = cv2.boundingRect(c)
+            if min(bw, bh) < self.min_side_px:
+                continue
+            if not 0.7 <= bw / float(bh) <= 1.4:
+                continue
+            fill = cv2.contourArea(c) / float(bw * bh)
+            if fill < 0.6:
+                continue
+            boxes.append((x, y, bw, bh))
+        return boxes
+
+    @staticmethod
+    def _reading_order(boxes: List[tuple[int, int, int, int]]) -> List[tuple[int, int, int, int]]:
+        if not boxes:
+            return boxes
+        row_h = float(np.median([b[3] for b in boxes]))
+        return sorted(boxes, key=lambda b: (int((b[1] + b[3] / 2) // row_h), b[0]))
+
+    # ---------- タイル処理 ----------
+    def _worker_state(self) -> tuple[QREnhancer, QRCodeDecoder]:
+        st = getattr(self._local, "state", None)
+        if st is None:
+            st = (QREnhancer(**self.enhancer_params), QRCodeDecoder(module=self.module))
+            self._local.state = st
+        return st
+
+    def _tile(self, gray: np.ndarray, box: tuple[int, int, int, int]) -> np.ndarray:
+        x, y, bw, bh = box
+        m = int(round(max(bw, bh) * self.margin))
+        h, w = gray.shape
+        return gray[max(0, y - m):min(h, y + bh + m), max(0, x - m):min(w, x + bw + m)]
+
+    def _process_tile(self, tile: np.ndarray) -> Dict[str, Any]:
+        enhancer, decoder = self._worker_state()
+        modules = enhancer.binarize_modules(tile)
+        if modules is None:
+            return {"payload": None, "vector": None}
+        return {
+            "payload": decoder.decode_modules(modules, scale=self.decode_scale),
+            "vector": modules.tolist(),
+            "confidence": enhancer.last_confidence,
+            "localized": enhancer.localizer.last_result is not None,
+        }
+
+    def process_image(self, gray: np.ndarray) -> List[Dict[str, Any]]:
+        boxes = self.detect_regions(gray)
+        futures = [self._pool.submit(self._process_tile, self._tile(gray, b)) for b in boxes]
+        results = []
+        for index, (box, fut) in enumerate(zip(boxes, futures)):
+            r = fut.result()
+            r.update(index=index, bbox=[int(v) for v in box])
+            results.append(r)
+        return results
+
+    def process_path(self, path: str) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            return {"file": os.path.basename(path), "codes": [], "error": "cannot read image"}
+        codes = self.process_image(gray)
+        return {
+            "file": os.path.basename(path),
+            "width": int(gray.shape[1]),
+            "height": int(gray.shape[0]),
+            "codes": codes,
+            "elapsed_ms": round((time.perf_counter() - t0) * 1000.0, 2),
+        }
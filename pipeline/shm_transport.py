@@ -0,0 +1,260 @@
+import multiprocessing as mp
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+from typing import Any, Dict, Iterable, Iterator, List
+
+import numpy as np
+
+from pipeline.image_io import choose_reduction, load_gray, read_image_size, source_size
+from pipeline.qr_enhancer import QREnhancer
+
+# 共有バッファ1枠の上限（8bit グレースケールで 32M 画素 ≒ A3 600dpi まで）
+DEFAULT_SLOT_BYTES = 32 * 1024 * 1024
+# 共有メモリ全体の上限。Docker 既定の /dev/shm は 64MiB で、超えて書くと SIGBUS で落ちる
+DEFAULT_MAX_SHM_BYTES = 48 * 1024 * 1024
+# 枠サイズを見積もる時にヘッダを読む枚数（全件は読まない）
+_SIZE_SAMPLES = 64
+
+
+def estimate_slot_bytes(paths: List[str], module: int, target_ppm, samples: int = _SIZE_SAMPLES) -> int:
+    """
+    ヘッダの画素数から、読み込み後（縮小込み）の最大バイト数を見積もる。
+    paths から等間隔に samples 枚だけ読む。見積もりを超える画像は "path" 渡しになるだけ。
+    """
+    step = max(1, len(paths) // samples)
+    largest = 0
+    for path in paths[::step]:
+        size = read_image_size(path)
+        if size is None:
+            continue
+        w, h = size
+        factor = choose_reduction(w, h, module, target_ppm) if target_ppm else 1
+        largest = max(largest, -(-w // factor) * -(-h // factor))
+    return largest
+
+
+def _reader_main(paths: List[str], shm_name: str, slot_bytes: int, module: int, target_ppm,
+                 free_q, work_q, n_workers: int) -> None:
+    """
+    画像を順にデコードし、空いた枠に書いてワーカーへ (枠番号, 形) だけを渡す。
+    枠に入らない大きさの画像はパスだけ渡してワーカー側で読ませる（配列は送らない）。
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        for idx, path in enumerate(paths):
+            img, scale = load_gray(path, module, target_ppm)
+            if img is None:
+                work_q.put(("error", idx, path, "読み込み失敗"))
+                continue
+            if img.nbytes > slot_bytes:
+                work_q.put(("path", idx, path, scale))
+                continue
+            slot = free_q.get()   # 空きが出るまで待つ（先読みは枠数まで）
+            view = np.ndarray(img.shape, dtype=np.uint8, buffer=shm.buf, offset=slot * slot_bytes)
+            view[...] = img
+            del view
+            work_q.put(("slot", idx, path, scale, slot, img.shape))
+    finally:
+        for _ in range(n_workers):
+            work_q.put(None)
+        shm.close()
+
+
+def _process(enhancer: QREnhancer, decoder, validator, img: np.ndarray, scale: int, path: str,
+             decode: bool) -> Dict[str, Any]:
+    """1枚分の処理。戻り値は小さい配列とスカラーだけ（img への参照は残さない）。"""
+    modules = enhancer.binarize_modules(img)
+    if modules is None:
+        return {"error": "処理失敗"}
+    payload = None
+    decoded = False
+    if scale > 1:
+        # 縮小読み込みで読めない場合はフル解像度でやり直す（QRPipeline._vectorize_one と同じ判断）
+        payload = decoder.decode_modules(modules) if validator.validate(modules).ok else None
+        decoded = payload is not None
+        if not decoded:
+            full, scale = load_gray(path, enhancer.module, None)
+            modules = enhancer.binarize_modules(full) if full is not None else None
+            if modules is None:
+                return {"error": "処理失敗"}
+    if decode and not decoded:
+        payload = decoder.decode_modules(modules)
+    w, h = source_size(path, enhancer.last_shape, scale, enhancer.localizer is not None)
+    return {
+        "modules": np.array(modules, dtype=np.uint8),
+        "confidence": np.array(enhancer.last_confidence, dtype=np.float32),
+        "top_row_avgs": enhancer.get_top_row_avgs(),
+        "width": w,
+        "height": h,
+        "scale": scale,
+        "payload": payload,
+    }
+
+
+def _worker_main(shm_name: str, slot_bytes: int, enhancer_params: dict, decode: bool,
+                 free_q, work_q, result_q) -> None:
+    """共有バッファ上の view に直接 QREnhancer / QRCodeDecoder をかけ、結果だけを返す。"""
+    from pipeline.qr_decode import QRCodeDecoder
+    from pipeline.qr_validate import StructureValidator
+
+    enhancer = QREnhancer(**enhancer_params)
+    decoder = QRCodeDecoder(module=enhancer.module, target_ppm=enhancer.target_ppm)
+    validator = StructureValidator()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        while True:
+            msg = work_q.get()
+            if msg is None:
+                break
+            kind, idx, path = msg[:3]
+            t0 = time.perf_counter()
+            nbytes = 0
+            try:
+                if kind == "error":
+                    result = {"error": msg[3]}
+                elif kind == "path":
+                    img, scale = load_gray(path, enhancer.module, enhancer.target_ppm)
+                    result = _process(enhancer, decoder, validator, img, scale, path, decode)
+                else:
+                    scale, slot, shape = msg[3:]
+                    view = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=slot * slot_bytes)
+                    nbytes = view.nbytes
+                    try:
+                        result = _process(enhancer, decoder, validator, view, scale, path, decode)
+                    finally:
+                        # view を消してから枠を返す（返した後は reader が上書きする）
+                        del view
+                        free_q.put(slot)
+            except Exception as e:   # 1枚の失敗で全体を止めない
+                result = {"error": f"{type(e).__name__}: {e}"}
+            result.update(index=idx, file=path, shm_bytes=nbytes,
+                          elapsed_ms=(time.perf_counter() - t0) * 1000.0)
+            result_q.put(result)
+    finally:
+        shm.close()
+
+
+class SharedMemoryRunner:
+    """
+    複数プロセスで鮮明化（＋デコード）するための画像受け渡し。
+
+    - 親が slots 枠分の共有メモリ（multiprocessing.shared_memory）を1つ確保して所有する。
+      枠サイズは最初の imap で入力画像のヘッダから見積もり、全体を max_shm_bytes 以下に抑える
+      （/dev/shm を超えると書き込み側が SIGBUS で落ちるため）。枠に入らない画像はパスで渡す
+    - 読み込みプロセスが画像をデコードして空き枠に書き、ワーカーには (枠番号, 形) だけを送る
+    - ワーカーは枠の view に直接 QREnhancer / QRCodeDecoder をかけ、33×33 の行列・確信度・
+      ペイロードだけを返してから枠を空きに戻す（プロセス間で画像配列を pickle しない）
+    - 枠の再利用はワーカーが返した後だけなので、処理中の画像が上書きされることはない
+    - 共有メモリは close()（with を抜けた時）に親が unlink する
+
+    imap は入力順に結果を返す。stats に処理枚数・共有メモリ経由の画素バイト数などを数える。
+    """
+
+    def __init__(
+        self,
+        enhancer_params: dict | None = None,
+        processes: int | None = None,
+        slots: int | None = None,
+        slot_bytes: int | None = None,
+        max_shm_bytes: int = DEFAULT_MAX_SHM_BYTES,
+        decode: bool = True,
+        start_method: str | None = None,
+    ):
+        self.enhancer_params = dict(enhancer_params or {})
+        self.enhancer_params["verbose"] = False
+        self.module = int(self.enhancer_params.get("module", 33))
+        self.target_ppm = self.enhancer_params.get("target_ppm")
+        self.processes = max(1, processes or os.cpu_count() or 1)
+        self.slots = slots or 2 * self.processes
+        self.slot_bytes = slot_bytes
+        self.max_shm_bytes = max_shm_bytes
+        self.decode = decode
+        self._ctx = mp.get_context(start_method)
+        self._shm: shared_memory.SharedMemory | None = None
+        self.stats = {"images": 0, "errors": 0, "oversize": 0, "shm_bytes": 0}
+
+    def imap(self, paths: Iterable[str], timeout: float = 1.0) -> Iterator[Dict[str, Any]]:
+        """
+        paths を処理して入力順に結果の dict を返す。
+        dict は file / modules / confidence / top_row_avgs / width / height / scale / payload /
+        elapsed_ms（失敗時は error）。
+        """
+        paths = list(paths)
+        if not paths:
+            return
+        free_q = self._ctx.Queue()
+        work_q = self._ctx.Queue(maxsize=self.slots + self.processes)
+        result_q = self._ctx.Queue()
+        self._ensure_shm(paths)
+        for slot in range(self.slots):
+            free_q.put(slot)
+
+        procs = [self._ctx.Process(
+            target=_reader_main, name="qr-shm-reader", daemon=True,
+            args=(paths, self._shm.name, self.slot_bytes, self.module, self.target_ppm,
+                  free_q, work_q, self.processes),
+        )]
+        procs += [self._ctx.Process(
+            target=_worker_main, name=f"qr-shm-worker-{k}", daemon=True,
+            args=(self._shm.name, self.slot_bytes, self.enhancer_params, self.decode, free_q, work_q, result_q),
+        ) for k in range(self.processes)]
+        for p in procs:
+            p.start()
+
+        pending: Dict[int, Dict[str, Any]] = {}
+        next_idx = 0
+        try:
+            while next_idx < len(paths):
+                try:
+                    res = result_q.get(timeout=timeout)
+                except queue.Empty:
+                    dead = [p for p in procs if p.exitcode not in (None, 0)]
+                    if dead:
+                        raise RuntimeError(f"{dead[0].name} が異常終了しました (exitcode={dead[0].exitcode})")
+                    continue
+                self._count(res)
+                pending[res["index"]] = res
+                while next_idx in pending:
+                    yield pending.pop(next_idx)
+                    next_idx += 1
+        finally:
+            for p in procs:
+                if next_idx < len(paths):   # 途中で抜けた場合は待たずに止める
+                    p.terminate()
+                p.join()
+            for q in (free_q, work_q, result_q):
+                q.close()
+                q.join_thread()
+
+    def _ensure_shm(self, paths: List[str]) -> None:
+        """共有メモリを未確保なら、枠サイズを決めて確保する（2回目以降の imap は使い回す）。"""
+        if self._shm is not None:
+            return
+        slot_bytes = self.slot_bytes or estimate_slot_bytes(paths, self.module, self.target_ppm)
+        slot_bytes = min(slot_bytes or DEFAULT_SLOT_BYTES, DEFAULT_SLOT_BYTES)
+        # 全体が上限を超えるなら枠数を減らし、1枠でも超えるなら枠を縮める（はみ出しは "path" 渡し）
+        self.slots = max(1, min(self.slots, self.max_shm_bytes // slot_bytes))
+        self.slot_bytes = max(1, min(slot_bytes, self.max_shm_bytes // self.slots))
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slots * self.slot_bytes)
+
+    def _count(self, res: Dict[str, Any]) -> None:
+        self.stats["images"] += 1
+        self.stats["shm_bytes"] += res["shm_bytes"]
+        if "error" in res:
+            self.stats["errors"] += 1
+        elif res["shm_bytes"] == 0:
+            self.stats["oversize"] += 1
+
+    def close(self) -> None:
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self) -> "SharedMemoryRunner":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,245 @@
+import argparse
+import json
+import math
+from typing import Iterable, List
+
+import numpy as np
+
+
+class TopRowStatistics:
+    """
+    トップ行セル平均のストリーミング統計（メモリは画像枚数に依存しない）。
+
+    - 固定ビンのヒストグラム（0〜255 を bins 分割。分位点もここから求める）
+    - Welford 法による平均・分散（全体と列ごと）
+    - 列ごとのしきい値未満（黒判定）件数
+    - merge() でワーカー/シャード間の集計を合成でき、JSON に保存・復元できる
+    """
+
+    VALUE_RANGE = (0.0, 256.0)
+
+    def __init__(self, module: int, thresh: float, bins: int = 1024):
+        self.module = int(module)
+        self.thresh = float(thresh)
+        self.bins = int(bins)
+        self.hist = np.zeros(self.bins, dtype=np.int64)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.images = 0
+        self.col_count = np.zeros(self.module, dtype=np.int64)
+        self.col_mean = np.zeros(self.module, dtype=np.float64)
+        self.col_m2 = np.zeros(self.module, dtype=np.float64)
+        self.col_below = np.zeros(self.module, dtype=np.int64)
+
+    # ---------- 更新 ----------
+    def update(self, avgs: Iterable[float]) -> None:
+        """1画像分のトップ行セル平均（列順、NaN は欠損）を取り込む。"""
+        x = np.asarray(list(avgs), dtype=np.float64)[: self.module]
+        cols = np.arange(x.size)
+        valid = ~np.isnan(x)
+        x, cols = x[valid], cols[valid]
+        self.images += 1
+        if x.size == 0:
+            return
+
+        # 列ごと（各列は1画像につき高々1サンプル）
+        n_old = self.col_count[cols]
+        delta = x - self.col_mean[cols]
+        self.col_count[cols] = n_old + 1
+        self.col_mean[cols] += delta / (n_old + 1)
+        self.col_m2[cols] += delta * (x - self.col_mean[cols])
+        self.col_below[cols] += (x < self.thresh)
+
+        # 全体（この画像分をまとめて Chan の式で合成）
+        self._merge_moments(x.size, float(x.mean()), float(((x - x.mean()) ** 2).sum()))
+        self.min = min(self.min, float(x.min()))
+        self.max = max(self.max, float(x.max()))
+        idx = np.clip((x * (self.bins / self.VALUE_RANGE[1])).astype(np.int64), 0, self.bins - 1)
+        self.hist += np.bincount(idx, minlength=self.bins)
+
+    def _merge_moments(self, n_b: int, mean_b: float, m2_b: float) -> None:
+        n_a = self.count
+        n = n_a + n_b
+        if n == 0:
+            return
+        delta = mean_b - self.mean
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta * delta * n_a * n_b / n
+        self.count = n
+
+    def merge(self, other: "TopRowStatistics") -> "TopRowStatistics":
+        """other の集計をこのインスタンスへ合成する（自身を返す）。"""
+        if (other.module, other.bins) != (self.module, self.bins):
+            raise ValueError("module/bins が異なる統計は合成できません")
+        if other.thresh != self.thresh:
+            raise ValueError("しきい値が異なる統計は合成できません")
+        self._merge_moments(other.count, other.mean, other.m2)
+        self.hist += other.hist
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.images += other.images
+
+        n_a, n_b = self.col_count, other.col_count
+        n = n_a + n_b
+        safe = np.where(n > 0, n, 1)
+        delta = other.col_mean - self.col_mean
+        self.col_mean = self.col_mean + delta * n_b / safe
+        self.col_m2 = self.col_m2 + other.col_m2 + delta * delta * n_a * n_b / safe
+        self.col_count = n
+        self.col_below = self.col_below + other.col_below
+        return self
+
+    # ---------- 参照 ----------
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+    def column_std(self) -> np.ndarray:
+        return np.sqrt(np.where(self.col_count > 1, self.col_m2 / np.maximum(self.col_count - 1, 1), 0.0))
+
+    def quantile(self, q: float) -> float:
+        """ヒストグラムから分位点を線形補間で求める（誤差はビン幅 256/bins 以内）。"""
+        if self.count == 0:
+            return math.nan
+        cum = np.cumsum(self.hist)
+        target = q * cum[-1]
+        i = int(np.searchsorted(cum, target, side="left"))
+        i = min(i, self.bins - 1)
+        prev = cum[i - 1] if i > 0 else 0
+        width = self.VALUE_RANGE[1] / self.bins
+        frac = (target - prev) / self.hist[i] if self.hist[i] > 0 else 0.0
+        value = (i + frac) * width
+        return float(min(max(value, self.min), self.max))
+
+    def coarse_hist(self, bins: int = 64) -> tuple[np.ndarray, np.ndarray]:
+        """描画用に粗いビンへまとめた (counts, edges)。bins は self.bins の約数。"""
+        if self.bins % bins:
+            raise ValueError("bins must divide the base bin count")
+        counts = self.hist.reshape(bins, -1).sum(axis=1)
+        edges = np.linspace(self.VALUE_RANGE[0], self.VALUE_RANGE[1], bins + 1)
+        return counts, edges
+
+    # ---------- 保存 ----------
+    def to_dict(self) -> dict:
+        return {
+            "module": self.module,
+            "thresh": self.thresh,
+            "bins": self.bins,
+            "images": self.images,
+            "count": self.count,
+            "mean": self.mean,
+            "m2": self.m2,
+            "std": self.std,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "quantiles": {
+                str(q): (self.quantile(q) if self.count else None)
+                for q in (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+            },
+            "hist": self.hist.tolist(),
+            "columns": {
+                "count": self.col_count.tolist(),
+                "mean": self.col_mean.tolist(),
+                "m2": self.col_m2.tolist(),
+                "below_thresh": self.col_below.tolist(),
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "TopRowStatistics":
+        st = cls(d["module"], d["thresh"], bins=d["bins"])
+        st.images = int(d["images"])
+        st.count = int(d["count"])
+        st.mean = float(d["mean"])
+        st.m2 = float(d["m2"])
+        st.min = math.inf if d.get("min") is None else float(d["min"])
+        st.max = -math.inf if d.get("max") is None else float(d["max"])
+        st.hist = np.asarray(d["hist"], dtype=np.int64)
+        cols = d["columns"]
+        st.col_count = np.asarray(cols["count"], dtype=np.int64)
+        st.col_mean = np.asarray(cols["mean"], dtype=np.float64)
+        st.col_m2 = np.asarray(cols["m2"], dtype=np.float64)
+        st.col_below = np.asarray(cols["below_thresh"], dtype=np.int64)
+        return st
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "TopRowStatistics":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    @classmethod
+    def merge_files(cls, paths: List[str]) -> "TopRowStatistics":
+        it = iter(paths)
+        total = cls.load(next(it))
+        for p in it:
+            total.merge(cls.load(p))
+        return total
+
+
+def plot_top_row_statistics(stats: TopRowStatistics, out_path: str) -> None:
+    """集計済みの統計から sikiiti.png を描く（生サンプルは使わない）。"""
+    import matplotlib.pyplot as plt
+
+    thresh = stats.thresh
+    fig = plt.figure(figsize=(10, 6), layout="constrained")
+    ax1 = fig.add_subplot(2, 1, 1)
+    ax2 = fig.add_subplot(2, 1, 2)
+
+    cols = np.arange(stats.module)
+    has = stats.col_count > 0
+    mean = np.where(has, stats.col_mean, np.nan)
+    std = stats.column_std()
+    ax1.plot(cols, mean, marker="o", linewidth=1, color="#377eb8", label="mean intensity")
+    ax1.fill_between(cols, mean - std, mean + std, color="#377eb8", alpha=0.2, label="±1 std")
+    ax1.axhline(thresh, color="r", linestyle="--", label=f"threshold={thresh:g}")
+    ax1.set_title(f"Top-row cell means by column ({stats.images} images)")
+    ax1.set_xlabel("column (gx)")
+    ax1.set_ylabel("mean intensity (0-255)")
+    ax1.set_ylim(0, 255)
+    ax1.grid(True, alpha=0.3)
+    ax1.legend(loc="best")
+
+    counts, edges = stats.coarse_hist(64)
+    ax2.stairs(counts, edges, fill=True, color="#4C72B0", alpha=0.9)
+    ax2.axvline(thresh, color="r", linestyle="--", label=f"threshold={thresh:g}")
+    for q, ls in ((0.05, ":"), (0.5, "-."), (0.95, ":")):
+        ax2.axvline(stats.quantile(q), color="#555555", linestyle=ls, linewidth=1,
+                    label=f"p{int(q * 100)}={stats.quantile(q):.1f}")
+    ax2.set_title(f"Distribution of top-row cell means (n={stats.count}, mean={stats.mean:.1f}, std={stats.std:.1f})")
+    ax2.set_xlabel("mean intensity")
+    ax2.set_ylabel("count")
+    ax2.set_xlim(0, 255)
+    ax2.grid(True, alpha=0.3)
+    ax2.legend(loc="best")
+
+    fig.suptitle("Top-row statistics (aggregated)", fontsize=14)
+    fig.savefig(out_path, dpi=150)
+    plt.close(fig)
+
+
+def main(argv: List[str] | None = None) -> None:
+    ap = argparse.ArgumentParser(description="シャードごとの sikiiti.json を合成して再描画する")
+    ap.add_argument("inputs", nargs="+", help="合成する sikiiti.json")
+    ap.add_argument("--out", default="qr_statistics/sikiiti.json")
+    ap.add_argument("--plot", default="qr_statistics/sikiiti.png")
+    args = ap.parse_args(argv)
+
+    stats = TopRowStatistics.merge_files(args.inputs)
+    stats.save(args.out)
+    plot_top_row_statistics(stats, args.plot)
+    print(f"[TopRow-Combined] {len(args.inputs)} 件を合成: '{args.out}', '{args.plot}'")
+
+
+if __name__ == "__main__":
+    main()
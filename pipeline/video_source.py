@@ -0,0 +1,211 @@
+import os
+import time
+from typing import Any, Dict, Iterator, List
+
+import cv2
+import numpy as np
+
+from pipeline.calibration import ThresholdCalibrator
+from pipeline.qr_decode import QRCodeDecoder
+from pipeline.qr_enhancer import QREnhancer, cell_means
+from pipeline.qr_localizer import QRLocalizer
+
+VIDEO_EXTS = (".mp4", ".mov", ".avi", ".mkv", ".m4v", ".webm")
+
+
+def _to_gray(frame: np.ndarray) -> np.ndarray:
+    if frame.ndim == 3:
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return frame
+
+
+class VideoQRSource:
+    """
+    動画クリップ（ローカルファイル）をフレーム単位で読み、QR をデコードする。
+
+    - 直前に処理したフレームとの差分（縮小サムネイルの平均絶対差）が diff_thresh 未満なら
+      ほぼ同じフレームとしてスキップ
+    - 差分が move_thresh 未満（コードが動いていない）なら、直前フレームの位置検出結果
+      （射影変換）としきい値をそのまま使う。動いたら検出・しきい値推定をやり直す
+    - 同じペイロードが stable_count 回続けて読めたら、そのクリップは打ち切る
+      （スキップした重複フレームは直前と同じ結果として数える）
+    """
+
+    def __init__(
+        self,
+        enhancer_params: dict | None = None,
+        decoder: QRCodeDecoder | None = None,
+        frame_step: int = 1,          # 何フレームごとに読むか（間は grab のみでデコードしない）
+        max_frames: int | None = None,
+        diff_thresh: float = 2.0,     # これ未満は重複フレーム（0〜255 の平均絶対差）
+        move_thresh: float = 8.0,     # これ未満は「動いていない」とみなして位置検出を再利用
+        stable_count: int = 2,
+        thumb_size: int = 64,
+        localize: bool = True,
+        decode_scale: int = 4,
+    ):
+        params = dict(enhancer_params or {})
+        params.pop("localize", None)
+        params.pop("target_ppm", None)
+        params["verbose"] = False
+        # 位置検出は再利用のためこちらで持つ（enhancer 側では行わない）
+        self.enhancer = QREnhancer(localize=False, **params)
+        self.module = self.enhancer.module
+        self.decoder = decoder or QRCodeDecoder(module=self.module)
+        self.localizer = (
+            QRLocalizer(module=self.module, finder_size=self.enhancer.finder_size,
+                        time_budget_ms=params.get("localize_budget_ms", 50.0))
+            if localize else None
+        )
+        self.calibrator = ThresholdCalibrator(module=self.module, finder_size=self.enhancer.finder_size)
+        self.defaults = {
+            "top_row_thresh": self.enhancer.top_row_thresh,
+            "avg_thresh": self.enhancer.avg_thresh,
+        }
+        self.frame_step = max(1, int(frame_step))
+        self.max_frames = max_frames
+        self.diff_thresh = diff_thresh
+        self.move_thresh = move_thresh
+        self.stable_count = max(1, int(stable_count))
+        self.thumb_size = thumb_size
+        self.decode_scale = decode_scale
+
+    # ---------- フレーム読み出し ----------
+    def frames(self, path: str) -> Iterator[tuple[int, np.ndarray]]:
+        """(フレーム番号, グレースケール画像) を frame_step ごとに返す。"""
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise IOError(f"動画を開けません: {path}")
+        try:
+            index = 0
+            while self.max_frames is None or index < self.max_frames:
+                if index % self.frame_step:
+                    # 間引くフレームはデコードしない
+                    if not cap.grab():
+                        break
+                else:
+                    ok, frame = cap.read()
+                    if not ok:
+                        break
+                    yield index, _to_gray(frame)
+                index += 1
+        finally:
+            cap.release()
+
+    def _thumb(self, gray: np.ndarray) -> np.ndarray:
+        return cv2.resize(gray, (self.thumb_size, self.thumb_size), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def _fit_thresholds(self, img: np.ndarray) -> None:
+        """このフレーム（正規化済み）のセル平均からしきい値を推定して enhancer に反映する。"""
+        self.calibrator.reset()
+        if min(img.shape) >= self.module:
+            self.calibrator.add_cell_means(cell_means(img, self.module))
+        self.enhancer.load_profile(self.calibrator.fit(self.defaults))
+
+    def _decode_frame(self, gray: np.ndarray, reuse, refit: bool,
+                      result: Dict[str, Any]) -> tuple[np.ndarray | None, str | None, bool]:
+        """1フレームを (モジュール行列, ペイロード, 前フレームの変換を使ったか) にする。"""
+        img = gray
+        reused = False
+        if self.localizer is not None:
+            img = self.localizer.normalize(gray, reuse=reuse)
+            reused = reuse is not None and self.localizer.last_result is reuse
+            if reused:
+                result["localization_reused"] += 1
+        reused = reused or not refit
+
+        # しきい値はコードが動いた時だけ推定し直す
+        if refit:
+            self._fit_thresholds(img)
+            result["threshold_refits"] += 1
+
+        modules = self.enhancer.binarize_modules(img)
+        if modules is None:
+            return None, None, reused
+        return modules, self.decoder.decode_modules(modules, scale=self.decode_scale), reused
+
+    # ---------- クリップ単位の処理 ----------
+    def process_clip(self, path: str) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        result: Dict[str, Any] = {
+            "clip": os.path.basename(path),
+            "decoded": False,
+            "payload": None,
+            "frame": None,
+            "frames_read": 0,
+            "frames_processed": 0,
+            "frames_skipped": 0,
+            "localization_reused": 0,
+            "threshold_refits": 0,
+            "elapsed_ms": 0.0,
+            "vector": None,
+        }
+        prev_thumb: np.ndarray | None = None
+        prev_loc = None
+        have_thresholds = False
+        last_payload: str | None = None
+        last_frame, last_modules = None, None   # last_payload が最初に読めたフレーム
+        streak = 0
+
+        try:
+            for index, gray in self.frames(path):
+                result["frames_read"] += 1
+                thumb = self._thumb(gray)
+                diff = float(np.abs(thumb - prev_thumb).mean()) if prev_thumb is not None else None
+
+                if diff is not None and diff < self.diff_thresh:
+                    # 重複フレームは処理せず、直前の結果がもう一度得られたものとして数える
+                    result["frames_skipped"] += 1
+                    if last_payload is not None:
+                        streak += 1
+                        if streak >= self.stable_count:
+                            result.update(decoded=True, payload=last_payload, frame=last_frame,
+                                          vector=last_modules.tolist())
+                            break
+                    continue
+                prev_thumb = thumb
+                still = diff is not None and diff < self.move_thresh
+
+                modules, payload, reused = self._decode_frame(gray, prev_loc if still else None,
+                                                              refit=not (still and have_thresholds),
+                                                              result=result)
+                if reused and payload is None:
+                    # 再利用した変換・しきい値で読めなければ検出からやり直す
+                    modules, payload, _ = self._decode_frame(gray, None, refit=True, result=result)
+                have_thresholds = True
+                prev_loc = self.localizer.last_result if self.localizer is not None else None
+                result["frames_processed"] += 1
+
+                if payload is None:
+                    streak, last_payload = 0, None
+                    continue
+                streak = streak + 1 if payload == last_payload else 1
+                if payload != last_payload:
+                    last_frame, last_modules = index, modules
+                last_payload = payload
+                if streak >= self.stable_count:
+                    result.update(
+                        decoded=True,
+                        payload=payload,
+                        frame=last_frame,
+                        vector=last_modules.tolist(),
+                    )
+                    break
+        except IOError as e:
+            result["error"] = str(e)
+
+        result["elapsed_ms"] = round((time.perf_counter() - t0) * 1000.0, 2)
+        return result
+
+    def process_dir(self, video_dir: str) -> List[Dict[str, Any]]:
+        results = []
+        for name in sorted(os.listdir(video_dir)):
+            if not name.lower().endswith(VIDEO_EXTS):
+                continue
+            print(f"\n[Video] '{name}'")
+            r = self.process_clip(os.path.join(video_dir, name))
+            state = f"デコード成功 (frame={r['frame']}): {r['payload']}" if r["decoded"] else "安定したデコードなし"
+            print(f"  {state} / 読込 {r['frames_read']}, 処理 {r['frames_processed']}, "
+                  f"スキップ {r['frames_skipped']}, 位置再利用 {r['localization_reused']}, {r['elapsed_ms']} ms")
+            results.append(r)
+        return results
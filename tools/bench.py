@@ -0,0 +1,420 @@
+# tools/bench.py
+"""
+性能の回帰検出用ベンチマーク。
+
+固定のローカルコーパス（既定 qr_bench/、なければ固定シードで合成した QR 画像を作る）に対して
+以下を計測し、スループット（件/秒）・計測中のピーク RSS・デコード成功率を基準ファイルと比べる。
+
+- QREnhancer.binarize / binary_to_modules / render_modules
+- QRCodeDecoder.decode_from_path
+- エディタの描画ヘルパ（render_png_from_json / get_original_png）
+- 各 PDF レポート（evaluate_pdf / overlay_pdf / analysis_pdf）とコンタクトシート（contact_sheet）
+
+    python -m tools.bench                      # 基準と比較（基準がなければ作成）
+    python -m tools.bench --update             # 基準を書き直す
+    python -m tools.bench --only binarize,decode_from_path --tolerance 0.3
+
+いずれかの指標が許容幅を超えて悪化したら終了コード 1 を返す。
+依存ライブラリ（pyzbar, fpdf など）が読み込めない項目は skipped として比較しない。
+"""
+from __future__ import annotations
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import cv2
+import numpy as np
+
+from pipeline.qr_enhancer import QREnhancer, binary_to_modules, render_modules
+
+DEFAULT_CORPUS = "qr_bench"
+DEFAULT_BASELINE = os.path.join("qr_statistics", "bench_baseline.json")
+INPUT_EXTS = (".png", ".jpg", ".jpeg")
+
+
+# ---------- コーパス ----------
+def build_corpus(root: Path, n_files: int = 40, module: int = 33, seed: int = 0) -> None:
+    """
+    root に version 4（33×33）の QR 画像を n_files 枚作る。
+    固定シードでノイズ・ぼけ・コントラスト低下を加え、鮮明化の効く入力に近づける。
+    """
+    rng = np.random.default_rng(seed)
+    root.mkdir(parents=True, exist_ok=True)
+    params = cv2.QRCodeEncoder_Params()
+    params.version = (module - 17) // 4
+    encoder = cv2.QRCodeEncoder_create(params)
+    for i in range(1, n_files + 1):
+        qr = encoder.encode(f"bench-{seed}-{i:05d}")
+        side = int(rng.integers(300, 700))
+        img = cv2.resize(qr, (side, side), interpolation=cv2.INTER_NEAREST).astype(np.float32)
+        img = cv2.GaussianBlur(img, (0, 0), sigmaX=side / 400.0)
+        img = img * rng.uniform(0.6, 0.9) + rng.uniform(10, 40) + rng.normal(0, 8, img.shape)
+        cv2.imwrite(str(root / f"{i}.png"), np.clip(img, 0, 255).astype(np.uint8))
+
+
+# ---------- 計測 ----------
+def _rss_bytes() -> int | None:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _PeakRss:
+    """with ブロック中の RSS を一定間隔で見て最大値を取る（/proc がなければプロセス全体の最大値）。"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _rss_bytes() or 0)
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "_PeakRss":
+        if _rss_bytes() is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._thread.is_alive():
+            self._stop.set()
+            self._thread.join()
+        self.peak = max(self.peak, _rss_bytes() or 0)
+        if self.peak == 0:
+            # Linux の ru_maxrss は KiB
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(fn: Callable[[], tuple[int, int | None]], repeat: int) -> Dict[str, Any]:
+    """
+    fn を repeat 回実行し、1回あたり時間の中央値からスループットを出す。
+    fn は (処理件数, 成功件数 or None) を返す。成功件数は最後の1回のもの。
+    """
+    times: List[float] = []
+    # 処理中のログ（[TopRow] など）は計測の邪魔なので捨てる
+    with _PeakRss() as rss, contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            items, ok = fn()
+            times.append(time.perf_counter() - t0)
+    seconds = statistics.median(times)
+    result = {
+        "items": items,
+        "seconds": round(seconds, 6),
+        "throughput": round(items / seconds, 3) if seconds > 0 else None,
+        "peak_rss_mb": round(rss.peak / (1024 * 1024), 1),
+    }
+    if ok is not None:
+        result["success_rate"] = round(ok / items, 4) if items else None
+    return result
+
+
+# ---------- ベンチマーク ----------
+class BenchSuite:
+    """
+    corpus の画像からベクトル・再生成画像・evaluate.json を作業ディレクトリに用意し、
+    各処理を同じ入力で計測する。
+    """
+
+    def __init__(self, corpus: Path, workdir: Path, module: int = 33, target_ppm: int | None = 8):
+        # PDF レポートは作業ディレクトリに移って動かすので絶対パスで持つ
+        self.corpus = corpus.resolve()
+        self.workdir = workdir
+        self.module = module
+        self.target_ppm = target_ppm
+        self.paths = sorted(str(p) for p in corpus.iterdir() if p.suffix.lower() in INPUT_EXTS)
+        if not self.paths:
+            raise FileNotFoundError(f"コーパス '{corpus}' に画像がありません。")
+        self.enhancer = QREnhancer(module=module, target_ppm=target_ppm)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.binaries = [b for b in (self.enhancer.binarize(p) for p in self.paths) if b is not None]
+        self.grids = [binary_to_modules(b, module) for b in self.binaries]
+        self._decoder = None
+        self._prepared = False
+
+    def _get_decoder(self):
+        if self._decoder is None:
+            from pipeline.qr_decode import QRCodeDecoder
+            self._decoder = QRCodeDecoder(module=self.module, target_ppm=self.target_ppm)
+        return self._decoder
+
+    def _prepare_workdir(self) -> None:
+        """エディタと PDF レポート用に qr_vector / qr_raimu / evaluate.json を作る。"""
+        if self._prepared:
+            return
+        from pipeline.recon_io import write_reconstruction
+
+        vec_dir = self.workdir / "qr_vector"
+        raimu_dir = self.workdir / "qr_raimu"
+        for d in (vec_dir, raimu_dir, self.workdir / "evaluate"):
+            d.mkdir(parents=True, exist_ok=True)
+        try:
+            decoder = self._get_decoder()
+        except ImportError:
+            decoder = None
+
+        records = []
+        for path in self.paths:
+            name = os.path.basename(path)
+            stem = os.path.splitext(name)[0]
+            h, w = cv2.imread(path, cv2.IMREAD_GRAYSCALE).shape
+            grid = self.enhancer.modules_from_path(path)
+            with (vec_dir / f"{stem}.json").open("w", encoding="utf-8") as f:
+                json.dump({"file": name, "module": self.module, "width": w, "height": h,
+                           "vector": grid.tolist()}, f, ensure_ascii=False)
+            recon = write_reconstruction(str(raimu_dir / stem), grid, w, h, "png8")
+            orig = decoder.decode_from_path(path) if decoder is not None else None
+            rec = decoder.decode_reconstruction(recon) if decoder is not None else None
+            records.append({"file": os.path.basename(recon), "original": orig, "reconstructed": rec,
+                            "match": orig is not None and orig == rec})
+        with (self.workdir / "evaluate.json").open("w", encoding="utf-8") as f:
+            json.dump(records, f, indent=4, ensure_ascii=False)
+        self._prepared = True
+
+    @contextlib.contextmanager
+    def _in_workdir(self):
+        """PDF レポートは相対パス（evaluate/…）に書くので作業ディレクトリで動かす。出力は捨てる。"""
+        cwd = os.getcwd()
+        os.chdir(self.workdir)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                yield
+        finally:
+            os.chdir(cwd)
+
+    # --- 個々の計測対象（(件数, 成功件数 or None) を返す関数を作る） ---
+    def bench_binarize(self):
+        def run():
+            for p in self.paths:
+                self.enhancer.binarize(p)
+            return len(self.paths), None
+        return run
+
+    def bench_binary_to_modules(self):
+        def run():
+            for b in self.binaries:
+                binary_to_modules(b, self.module)
+            return len(self.binaries), None
+        return run
+
+    def bench_render_modules(self):
+        shapes = [b.shape for b in self.binaries]
+
+        def run():
+            for grid, (h, w) in zip(self.grids, shapes):
+                render_modules(grid, w, h)
+            return len(self.grids), None
+        return run
+
+    def bench_decode_from_path(self):
+        decoder = self._get_decoder()
+
+        def run():
+            ok = sum(1 for p in self.paths if decoder.decode_from_path(p) is not None)
+            return len(self.paths), ok
+        return run
+
+    def _editor(self):
+        self._prepare_workdir()
+        from tools.qr_vector_editor_flask import editor_app
+        editor_app.configure_dirs(
+            vector_dir=self.workdir / "qr_vector",
+            orig_dir=self.corpus,
+            output_dir=self.workdir / "qr_raimu",
+            results_db=self.workdir / "results.sqlite3",
+        )
+        return editor_app, sorted(p.name for p in (self.workdir / "qr_vector").glob("*.json"))
+
+    def bench_editor_render(self):
+        editor_app, names = self._editor()
+
+        def run():
+            for n in names:
+                editor_app.render_png_from_json(n)
+            return len(names), None
+        return run
+
+    def bench_editor_original(self):
+        editor_app, names = self._editor()
+
+        def run():
+            for n in names:
+                editor_app.get_original_png(n)
+            return len(names), None
+        return run
+
+    def _report(self, make: Callable[[str, str, str], Callable[[], None]]):
+        self._prepare_workdir()
+        with self._in_workdir():
+            go = make("evaluate.json", str(self.corpus), "qr_raimu")
+
+        def run():
+            with self._in_workdir():
+                go()
+            return len(self.paths), None
+        return run
+
+    def bench_pdf_evaluate(self):
+        from evaluate.evaluate_pdf import Evaluator
+        return self._report(lambda j, t, r: Evaluator(json_path=j, tobako_dir=t, raimu_dir=r).run)
+
+    def bench_pdf_overlay(self):
+        from evaluate.overlay_pdf import Evaluator
+        return self._report(lambda j, t, r: Evaluator(json_path=j, tobako_dir=t, raimu_dir=r).run)
+
+    def bench_pdf_analysis(self):
+        from evaluate.analysis_pdf import QRAnalysisReport
+
+        def make(j, t, r):
+            report = QRAnalysisReport(json_path=j, tobako_dir=t, raimu_dir=r)
+            return lambda: report.generate_pdf("evaluate/analysis_report.pdf")
+        return self._report(make)
+
+    def bench_contact_sheet(self):
+        from evaluate.contact_sheet import ContactSheetReport
+
+        def make(j, t, r):
+            report = ContactSheetReport(json_path=j, tobako_dir=t, raimu_dir=r)
+            return lambda: report.generate(os.path.join("evaluate", "contact_sheet"))
+        return self._report(make)
+
+
+BENCHMARKS = {
+    "binarize": "bench_binarize",
+    "binary_to_modules": "bench_binary_to_modules",
+    "render_modules": "bench_render_modules",
+    "decode_from_path": "bench_decode_from_path",
+    "editor_render": "bench_editor_render",
+    "editor_original": "bench_editor_original",
+    "pdf_evaluate": "bench_pdf_evaluate",
+    "pdf_overlay": "bench_pdf_overlay",
+    "pdf_analysis": "bench_pdf_analysis",
+    "contact_sheet": "bench_contact_sheet",
+}
+
+
+def run_suite(suite: BenchSuite, names: List[str], repeat: int) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    for name in names:
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                fn = getattr(suite, BENCHMARKS[name])()
+        except ImportError as e:
+            results[name] = {"skipped": str(e)}
+            print(f"  {name}: skipped ({e})")
+            continue
+        # 1回目は読み込みやキャッシュの初期化を含むので捨てる
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn()
+        results[name] = measure(fn, repeat)
+        r = results[name]
+        rate = f" success={r['success_rate']}" if "success_rate" in r else ""
+        print(f"  {name}: {r['throughput']} 件/s ({r['seconds'] * 1000:.1f} ms/{r['items']} 件) "
+              f"rss={r['peak_rss_mb']} MB{rate}")
+    return results
+
+
+# ---------- 基準との比較 ----------
+def compare(current: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            tolerance: float, rss_tolerance: float, success_tolerance: float) -> List[str]:
+    """許容幅を超えて悪化した指標の説明を返す（空なら合格）。基準にない項目・skipped は比べない。"""
+    failures: List[str] = []
+    for name, cur in current.items():
+        base = baseline.get(name)
+        if base is None or "skipped" in cur or "skipped" in base:
+            continue
+        if cur.get("throughput") and base.get("throughput"):
+            floor = base["throughput"] * (1.0 - tolerance)
+            if cur["throughput"] < floor:
+                failures.append(f"{name}: throughput {cur['throughput']} < {floor:.3f} "
+                                f"(基準 {base['throughput']}, 許容 -{tolerance:.0%})")
+        if cur.get("peak_rss_mb") and base.get("peak_rss_mb"):
+            ceil = base["peak_rss_mb"] * (1.0 + rss_tolerance)
+            if cur["peak_rss_mb"] > ceil:
+                failures.append(f"{name}: peak_rss_mb {cur['peak_rss_mb']} > {ceil:.1f} "
+                                f"(基準 {base['peak_rss_mb']}, 許容 +{rss_tolerance:.0%})")
+        if cur.get("success_rate") is not None and base.get("success_rate") is not None:
+            floor = base["success_rate"] - success_tolerance
+            if cur["success_rate"] < floor:
+                failures.append(f"{name}: success_rate {cur['success_rate']} < {floor:.4f} "
+                                f"(基準 {base['success_rate']})")
+    return failures
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="鮮明化・デコード・エディタ・PDF 生成の性能回帰ベンチマーク")
+    ap.add_argument("--corpus", default=DEFAULT_CORPUS, help="入力画像のディレクトリ（なければ合成して作る）")
+    ap.add_argument("--files", type=int, default=40, help="合成する場合の枚数")
+    ap.add_argument("--module", type=int, default=33)
+    ap.add_argument("--baseline", default=DEFAULT_BASELINE, help="基準ファイル（JSON）")
+    ap.add_argument("--update", action="store_true", help="今回の結果で基準を書き直す")
+    ap.add_argument("--only", default=None, help=f"カンマ区切りで対象を絞る（{', '.join(BENCHMARKS)}）")
+    ap.add_argument("--repeat", type=int, default=3, help="各項目の計測回数（中央値を使う）")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="スループット低下の許容割合")
+    ap.add_argument("--rss-tolerance", type=float, default=0.25, help="ピーク RSS 増加の許容割合")
+    ap.add_argument("--success-tolerance", type=float, default=0.0, help="成功率低下の許容幅（絶対値）")
+    ap.add_argument("--json", dest="json_out", default=None, help="今回の結果を保存するパス")
+    args = ap.parse_args(argv)
+
+    names = list(BENCHMARKS) if not args.only else [n.strip() for n in args.only.split(",") if n.strip()]
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        ap.error(f"unknown benchmark: {', '.join(unknown)}")
+
+    corpus = Path(args.corpus)
+    if not corpus.exists():
+        print(f"コーパス '{corpus}' がないため {args.files} 枚を合成します（固定シード）。")
+        build_corpus(corpus, args.files, args.module)
+
+    with tempfile.TemporaryDirectory(prefix="qr_bench_") as tmp:
+        suite = BenchSuite(corpus, Path(tmp), module=args.module)
+        print(f"[Bench] corpus={corpus} ({len(suite.paths)} 枚), repeat={args.repeat}")
+        current = run_suite(suite, names, args.repeat)
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2, ensure_ascii=False)
+
+    baseline_path = Path(args.baseline)
+    if args.update or not baseline_path.exists():
+        baseline = {}
+        if baseline_path.exists():
+            with baseline_path.open("r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        # --only で一部だけ測った場合も他の項目の基準は残す
+        baseline.update(current)
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        with baseline_path.open("w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, ensure_ascii=False)
+        print(f"[Bench] 基準を '{baseline_path}' に保存しました。")
+        return 0
+
+    with baseline_path.open("r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    failures = compare(current, baseline, args.tolerance, args.rss_tolerance, args.success_tolerance)
+    if failures:
+        print("[Bench] 回帰を検出しました:")
+        for line in failures:
+            print(f"  - {line}")
+        return 1
+    print("[Bench] 基準からの回帰はありません。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
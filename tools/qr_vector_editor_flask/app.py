@@ -6,16 +6,21 @@ from pathlib import Path
 from flask import Flask, render_template, request, jsonify, send_file, send_from_directory, abort
 
 # 重要：ロジックを別モジュールに集約
+from . import editor_app
 from .editor_app import (
-    list_json_items,
+    query_json_items,
     load_json_file,
     get_original_png,
     render_png_from_json,
     toggle_cell_and_save,
+    toggle_cell_and_decode,
+    decode_vector,
+    decode_json_file,
     save_whole_json,
     export_png_from_json,
-    OUTPUT_DIR,  # for download endpoint
 )
+from .enhance_api import bp as enhance_bp
+from .jobs_api import bp as jobs_bp
 
 # Flask のテンプレ/静的パスをこのファイル相対に固定
 THIS_DIR = Path(__file__).resolve().parent
@@ -24,6 +29,10 @@ app = Flask(
     static_folder=str(THIS_DIR / "static"),
     template_folder=str(THIS_DIR / "templates"),
 )
+# POST /api/enhance（鮮明化サービス）をエディタと同じサーバで提供
+app.register_blueprint(enhance_bp)
+# /api/jobs（Step0〜3・修復をバックグラウンドで実行し、進捗を SSE で配信）
+app.register_blueprint(jobs_bp)
 
 
 @app.route("/")
@@ -44,8 +53,24 @@ def edit(name: str):
 # -------- API --------
 @app.get("/api/list")
 def api_list():
-    items = list_json_items()
-    return jsonify(items)
+    # ?prefix=&sort=name|module|width|height|stem&order=asc|desc&offset=&limit=
+    # 後方互換のためレスポンスは配列のまま。総件数は X-Total-Count ヘッダで返す
+    try:
+        offset = int(request.args.get("offset", "0"))
+        limit_arg = request.args.get("limit")
+        limit = int(limit_arg) if limit_arg else None
+        items, total = query_json_items(
+            prefix=request.args.get("prefix") or None,
+            sort=request.args.get("sort", "name"),
+            descending=request.args.get("order", "asc") == "desc",
+            offset=offset,
+            limit=limit,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    resp = jsonify(items)
+    resp.headers["X-Total-Count"] = str(total)
+    return resp
 
 
 @app.get("/api/load")
@@ -101,12 +126,17 @@ def api_toggle():
     if filename is None or gx is None or gy is None:
         return jsonify({"error": "missing fields"}), 400
     try:
+        if data.get("decode"):
+            new_val, decoded = toggle_cell_and_decode(filename, int(gx), int(gy))
+            return jsonify({"ok": True, "value": int(new_val), "decode": decoded})
         new_val = toggle_cell_and_save(filename, int(gx), int(gy))
         return jsonify({"ok": True, "value": int(new_val)})
     except FileNotFoundError:
         return jsonify({"error": "json not found"}), 404
     except IndexError:
         return jsonify({"error": "index out of range"}), 400
+    except ImportError as e:
+        return jsonify({"error": f"decoder unavailable: {e}"}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -122,8 +152,42 @@ def api_save():
     if not filename or vector is None or module is None or width is None or height is None:
         return jsonify({"error": "missing fields"}), 400
     try:
+        decoded = decode_vector(vector) if data.get("decode") else None
         saved = save_whole_json(filename, vector, int(module), int(width), int(height))
+        if decoded is not None:
+            return jsonify({"ok": True, "saved": saved, "decode": decoded})
         return jsonify({"ok": True, "saved": saved})
+    except ImportError as e:
+        return jsonify({"error": f"decoder unavailable: {e}"}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.post("/api/decode")
+def api_decode():
+    # {"vector": [[...]]} ならその行列を、{"file": "x.json"} なら保存済みベクトルをデコード
+    data = request.get_json(silent=True) or {}
+    filename = data.get("file")
+    vector = data.get("vector")
+    if vector is None and not filename:
+        return jsonify({"error": "param 'file' or 'vector' required"}), 400
+    lo, hi = editor_app.DECODE_SCALE_RANGE
+    try:
+        scale = int(data.get("scale", editor_app.DECODE_SCALE))
+    except (TypeError, ValueError):
+        return jsonify({"error": "param 'scale' must be an integer"}), 400
+    if not lo <= scale <= hi:
+        return jsonify({"error": f"param 'scale' must be in {lo}..{hi}"}), 400
+    try:
+        if vector is not None:
+            result = decode_vector(vector, scale=scale)
+        else:
+            result = decode_json_file(filename, scale=scale)
+        return jsonify(result)
+    except FileNotFoundError:
+        return jsonify({"error": "json not found"}), 404
+    except ImportError as e:
+        return jsonify({"error": f"decoder unavailable: {e}"}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -144,7 +208,8 @@ def api_export_png():
 
 @app.get("/download/<path:fname>")
 def download(fname: str):
-    return send_from_directory(OUTPUT_DIR, fname, as_attachment=True)
+    # configure_dirs で差し替えられる場合があるので毎回モジュールから参照
+    return send_from_directory(editor_app.OUTPUT_DIR, fname, as_attachment=True)
 
 
 # tools/qr_vector_editor_flask/app.py 末尾付近
@@ -1,6 +1,9 @@
 # tools/qr_vector_editor_flask/editor_app.py
 from __future__ import annotations
 import json
+import os
+import threading
+import time
 from io import BytesIO
 from pathlib import Path
 from typing import List, Optional, Dict, Any
@@ -8,15 +11,39 @@ from typing import List, Optional, Dict, Any
 import numpy as np
 from PIL import Image
 
+from pipeline.buffer_pool import local_pool
+from pipeline.dir_index import DirIndex, IMAGE_EXTS
+from pipeline.qr_enhancer import render_modules
+from pipeline.recon_io import write_reconstruction
+from pipeline.results_db import ResultsDB
+
 # ルート相対（このファイルからの相対パスにしておく）
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 VECTOR_DIR = BASE_DIR / "qr_vector"
 ORIG_DIR = BASE_DIR / "qr_tobakosan"
 OUTPUT_DIR = BASE_DIR / "qr_raimu"
+RESULTS_DB_PATH = BASE_DIR / "qr_statistics" / "results.sqlite3"
 
 VECTOR_DIR.mkdir(exist_ok=True, parents=True)
 OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
 
+# ファイル単位の書き込みロック（toggle の読み→反転→書きを直列化して更新の取りこぼしを防ぐ）
+_FILE_LOCKS: Dict[str, threading.Lock] = {}
+_FILE_LOCKS_GUARD = threading.Lock()
+
+# /api/export_png で OUTPUT_DIR に書き出す形式（pipeline.recon_io.RECON_FORMATS のいずれか）
+EXPORT_FORMAT = "png1"
+
+# ライブデコード用（pyzbar を使うので初回呼び出し時に読み込む）
+DECODE_SCALE = 4
+DECODE_SCALE_RANGE = (1, 16)   # /api/decode で受け付ける scale（大きすぎる描画を防ぐ）
+_DECODER = None
+
+# 編集内容の記録先（初回の保存時に開き、プロセスごとに1つの "editor" 実行としてまとめる）
+_RESULTS_DB: ResultsDB | None = None
+_EDITOR_RUN_ID: int | None = None
+_RESULTS_DB_GUARD = threading.Lock()
+
 
 # ---------- 基本I/O ----------
 def _load_json(path: Path) -> Dict[str, Any]:
@@ -25,35 +52,104 @@ def _load_json(path: Path) -> Dict[str, Any]:
 
 
 def _save_json(obj: Dict[str, Any], path: Path) -> None:
+    # 一時ファイルに書いてから置き換え（読み手が書きかけの JSON を見ないように）
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as f:
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
         json.dump(obj, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _file_lock(filename: str) -> threading.Lock:
+    with _FILE_LOCKS_GUARD:
+        lock = _FILE_LOCKS.get(filename)
+        if lock is None:
+            lock = _FILE_LOCKS[filename] = threading.Lock()
+        return lock
+
+
+def configure_dirs(
+    vector_dir: Path | str | None = None,
+    orig_dir: Path | str | None = None,
+    output_dir: Path | str | None = None,
+    results_db: Path | str | None = None,
+) -> None:
+    """対象ディレクトリを差し替える（負荷試験や別コーパスでの起動用）。"""
+    global VECTOR_DIR, ORIG_DIR, OUTPUT_DIR, RESULTS_DB_PATH, _RESULTS_DB, _EDITOR_RUN_ID
+    if vector_dir is not None:
+        VECTOR_DIR = Path(vector_dir)
+        VECTOR_DIR.mkdir(exist_ok=True, parents=True)
+    if orig_dir is not None:
+        ORIG_DIR = Path(orig_dir)
+    if output_dir is not None:
+        OUTPUT_DIR = Path(output_dir)
+        OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
+    if results_db is not None:
+        with _RESULTS_DB_GUARD:
+            RESULTS_DB_PATH = Path(results_db)
+            _RESULTS_DB = None
+            _EDITOR_RUN_ID = None
+    _INDEX.invalidate()
 
 
-def _find_alt_original(stem: str) -> Optional[Path]:
-    for ext in (".png", ".jpg", ".jpeg", ".PNG", ".JPG", ".JPEG"):
-        p = ORIG_DIR / f"{stem}{ext}"
-        if p.exists():
-            return p
-    return None
+def _results_db(for_write: bool = False) -> tuple[ResultsDB, int | None]:
+    global _RESULTS_DB, _EDITOR_RUN_ID
+    with _RESULTS_DB_GUARD:
+        if _RESULTS_DB is None:
+            _RESULTS_DB = ResultsDB(str(RESULTS_DB_PATH))
+        if for_write and _EDITOR_RUN_ID is None:
+            _EDITOR_RUN_ID = _RESULTS_DB.begin_run("editor")
+        return _RESULTS_DB, _EDITOR_RUN_ID
+
+
+def _record_vector(filename: str, obj: Dict[str, Any]) -> None:
+    """
+    明示的に保存（/api/save）したベクトルを results.sqlite3 にも書く。セルの反転ごとには書かない。
+    ファイルロックの外で呼ぶ。実行の終了時刻は最後に保存した時刻に更新する。
+    """
+    db, run_id = _results_db(for_write=True)
+    db.add_vector(run_id, Path(filename).stem, obj.get("file") or filename, obj["vector"],
+                  obj["width"], obj["height"], obj.get("confidence"), obj.get("duplicate_of"))
+    db.end_run(run_id)
+
+
+def _match_by_stem(stems: List[str]) -> Dict[str, bool]:
+    """stems の最新の Step2 での一致結果（DB がまだなければ空）。一覧の1ページ分だけを引く。"""
+    if not stems or (_RESULTS_DB is None and not RESULTS_DB_PATH.exists()):
+        return {}
+    db, _ = _results_db()
+    return db.match_by_name(stems)
+
+
+def _read_json_header(path: Path, chunk_size: int = 4096) -> Dict[str, Any]:
+    """
+    JSON 先頭の "vector" より前だけを読み、ヘッダ項目（file/module/width/height）を返す。
+    vector 本体はパースしない。想定外の並びの場合は全体パースにフォールバック。
+    """
+    with path.open("r", encoding="utf-8") as f:
+        head = f.read(chunk_size)
+    idx = head.find('"vector"')
+    if idx > 0:
+        prefix = head[:idx].rstrip().rstrip(",")
+        try:
+            obj = json.loads(prefix + "}")
+            if isinstance(obj, dict):
+                return obj
+        except ValueError:
+            pass
+    obj = _load_json(path)
+    obj.pop("vector", None)
+    return obj
 
 
 def _rebuild_image_from_vector(vector: List[List[int]], width: int, height: int, module: int) -> Image.Image:
-    """1=黒(0), 0=白(255) でセル塗りつぶしして Pillow Image(L) を返す"""
-    img = np.ones((height, width), dtype=np.uint8) * 255
-    cell_w = max(1, width // module)
-    cell_h = max(1, height // module)
-    grid = np.array(vector, dtype=int)
-
-    for gy in range(module):
-        y0 = gy * cell_h
-        y1 = (gy + 1) * cell_h if gy < module - 1 else height
-        for gx in range(module):
-            x0 = gx * cell_w
-            x1 = (gx + 1) * cell_w if gx < module - 1 else width
-            val = 0 if grid[gy, gx] == 1 else 255
-            img[y0:y1, x0:x1] = val
-    return Image.fromarray(img, mode="L")
+    """
+    1=黒(0), 0=白(255) でセル塗りつぶしして Pillow Image(L) を返す。
+    描画先はスレッドごとのバッファ（次の描画で上書きされる）なので、すぐ保存・エンコードすること。
+    """
+    buf = local_pool().get("editor_render", (height, width), np.uint8)
+    grid = np.asarray(vector, dtype=np.uint8)[:module, :module]
+    return Image.fromarray(render_modules(grid, width, height, out=buf), mode="L")
 
 
 def _image_to_png_bytes(im: Image.Image) -> bytes:
@@ -62,44 +158,174 @@ def _image_to_png_bytes(im: Image.Image) -> bytes:
     return buf.getvalue()
 
 
-# ---------- 公開API(ロジック) ----------
-def list_json_items() -> List[Dict[str, Any]]:
-    def _key(p: Path):
-        stem = p.stem
+# ---------- メタデータ索引 ----------
+def _natural_key(name: str):
+    stem = Path(name).stem
+    try:
+        return (0, int(stem), "")
+    except ValueError:
+        return (1, 0, stem)
+
+
+class VectorIndex:
+    """
+    qr_vector/*.json のヘッダ情報（module/width/height/stem/元画像名）の索引。
+
+    - ディレクトリ mtime が変わった時だけ再走査し、変更のあったファイルのヘッダだけ読み直す
+    - 上書き保存（ディレクトリ mtime が変わらない）も拾うため rescan_interval 秒ごとに stat 走査
+    - qr_vector / qr_tobakosan の走査は DirIndex に任せ、元画像は stem から索引で引く
+    """
+
+    def __init__(self, rescan_interval: float = 30.0):
+        self.rescan_interval = rescan_interval
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}   # json名 -> {"sig":(mtime_ns,size), "meta":{...}}
+        self._sorted_names: List[str] = []
+        self._vec_dir_sig: tuple | None = None
+        self._orig_dir_sig: tuple | None = None
+        self._vectors = DirIndex(VECTOR_DIR)
+        self._originals = DirIndex(ORIG_DIR)
+        self._last_scan = 0.0
+
+    @staticmethod
+    def _dir_sig(path: Path) -> tuple | None:
         try:
-            return (0, int(stem))
-        except ValueError:
-            return (1, stem)
+            st = path.stat()
+        except FileNotFoundError:
+            return None
+        return (str(path), st.st_mtime_ns)
+
+    def invalidate(self, name: str | None = None) -> None:
+        """name 指定ならその1件、None なら全体を次回アクセス時に読み直す。"""
+        with self._lock:
+            if name is None:
+                self._vec_dir_sig = None
+                self._orig_dir_sig = None
+            else:
+                self._entries.pop(name, None)
+                self._vec_dir_sig = None
 
-    files = sorted(VECTOR_DIR.glob("*.json"), key=_key)
-    items: List[Dict[str, Any]] = []
-    for p in files:
-        name = p.name
+    def find_original(self, stem: str) -> Optional[Path]:
+        """stem に対応する元画像（.png / .jpg / .jpeg の優先順）。"""
+        self.refresh()
+        f = self._originals.find_stem(stem, IMAGE_EXTS)
+        return Path(f.path) if f is not None else None
+
+    def _build_meta(self, path: Path) -> Dict[str, Any]:
+        name = path.name
         try:
-            obj = _load_json(p)
-            module = int(obj.get("module", 0))
-            w = int(obj.get("width", 0))
-            h = int(obj.get("height", 0))
+            obj = _read_json_header(path)
             file_field = obj.get("file", "")
-            stem = Path(file_field).stem if file_field else p.stem
-            orig = _find_alt_original(stem)
-            items.append({
+            stem = Path(file_field).stem if file_field else path.stem
+            orig = self._originals.find_stem(stem, IMAGE_EXTS)
+            orig_name = orig.name if orig is not None else None
+            return {
                 "json": name,
-                "module": module,
-                "width": w,
-                "height": h,
-                "original_exists": bool(orig),
-                "original_name": orig.name if orig else None,
+                "module": int(obj.get("module", 0)),
+                "width": int(obj.get("width", 0)),
+                "height": int(obj.get("height", 0)),
+                "original_exists": orig_name is not None,
+                "original_name": orig_name,
                 "stem": stem,
-            })
+            }
         except Exception:
-            items.append({
+            return {
                 "json": name, "module": None, "width": None, "height": None,
-                "original_exists": False, "original_name": None, "stem": p.stem
-            })
+                "original_exists": False, "original_name": None, "stem": path.stem
+            }
+
+    def refresh(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            vec_sig = self._dir_sig(VECTOR_DIR)
+            orig_sig = self._dir_sig(ORIG_DIR)
+            orig_changed = orig_sig != self._orig_dir_sig
+            if (
+                vec_sig == self._vec_dir_sig
+                and not orig_changed
+                and now - self._last_scan < self.rescan_interval
+            ):
+                return
+
+            # configure_dirs で差し替えられていれば索引も作り直す
+            if self._originals.path != str(ORIG_DIR):
+                self._originals = DirIndex(ORIG_DIR)
+            if self._vectors.path != str(VECTOR_DIR):
+                self._vectors = DirIndex(VECTOR_DIR)
+            if orig_changed:
+                self._originals.refresh()
+            self._vectors.refresh()
+
+            entries: Dict[str, Dict[str, Any]] = {}
+            for e in self._vectors.entries(".json"):
+                if not e.name.endswith(".json"):
+                    continue
+                sig = (e.mtime_ns, e.size)
+                old = self._entries.get(e.name)
+                if old is not None and old["sig"] == sig and not orig_changed:
+                    entries[e.name] = old
+                else:
+                    entries[e.name] = {"sig": sig, "meta": self._build_meta(Path(e.path))}
+
+            self._entries = entries
+            self._sorted_names = sorted(entries, key=_natural_key)
+            self._vec_dir_sig = vec_sig
+            self._orig_dir_sig = orig_sig
+            self._last_scan = now
+
+    def query(
+        self,
+        prefix: str | None = None,
+        sort: str = "name",
+        descending: bool = False,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> tuple[List[Dict[str, Any]], int]:
+        """prefix 絞り込み・ソート・ページングした (items, 総件数) を返す。"""
+        self.refresh()
+        with self._lock:
+            names = self._sorted_names
+            if prefix:
+                names = [n for n in names if n.startswith(prefix)]
+            metas = [self._entries[n]["meta"] for n in names]
+
+        if sort != "name":
+            if sort not in SORT_KEYS:
+                raise ValueError(f"unknown sort key: {sort}")
+            # None は末尾に寄せる（名前順は安定ソートで保持）
+            metas = sorted(metas, key=lambda m: (m[sort] is None, m[sort] if m[sort] is not None else 0))
+        if descending:
+            metas = metas[::-1]
+
+        total = len(metas)
+        offset = max(0, int(offset))
+        end = total if limit is None else offset + max(0, int(limit))
+        page = metas[offset:end]
+        # match は最新の Step2 の結果（未評価なら None）
+        match = _match_by_stem([Path(m["json"]).stem for m in page])
+        return [dict(m, match=match.get(Path(m["json"]).stem)) for m in page], total
+
+
+SORT_KEYS = ("name", "module", "width", "height", "stem")
+_INDEX = VectorIndex()
+
+
+# ---------- 公開API(ロジック) ----------
+def list_json_items() -> List[Dict[str, Any]]:
+    items, _ = _INDEX.query()
     return items
 
 
+def query_json_items(
+    prefix: str | None = None,
+    sort: str = "name",
+    descending: bool = False,
+    offset: int = 0,
+    limit: int | None = None,
+) -> tuple[List[Dict[str, Any]], int]:
+    return _INDEX.query(prefix=prefix, sort=sort, descending=descending, offset=offset, limit=limit)
+
+
 def load_json_file(filename: str) -> Dict[str, Any]:
     path = VECTOR_DIR / filename
     obj = _load_json(path)
@@ -112,7 +338,7 @@ def get_original_png(filename: str, size: int = 256) -> bytes:
     # filename は JSON 名
     obj = load_json_file(filename)
     stem = Path(obj.get("file", "")).stem or Path(filename).stem
-    opath = _find_alt_original(stem)
+    opath = _INDEX.find_original(stem)
     if not opath:
         raise FileNotFoundError("original not found")
     im = Image.open(opath).convert("L")
@@ -124,54 +350,93 @@ def render_png_from_json(filename: str, size: int = 256) -> bytes:
     obj = load_json_file(filename)
     vector = obj["vector"]
     module = int(obj["module"])
-    w = int(obj["width"])
-    h = int(obj["height"])
-    im = _rebuild_image_from_vector(vector, width=w, height=h, module=module)
-    im = im.resize((size, size), resample=Image.NEAREST)
-    return _image_to_png_bytes(im)
+    # プレビューは size×size に直接描く（元サイズで描いてから縮小しない）
+    im = _rebuild_image_from_vector(vector, width=size, height=size, module=module)
+    # 画素は 0/255 だけなので 1bit PNG で返す（見た目は同じで転送量が小さい）
+    return _image_to_png_bytes(im.convert("1", dither=Image.Dither.NONE))
 
 
-def toggle_cell_and_save(filename: str, gx: int, gy: int) -> int:
+def _get_decoder():
+    global _DECODER
+    if _DECODER is None:
+        from pipeline.qr_decode import QRCodeDecoder
+        _DECODER = QRCodeDecoder()
+    return _DECODER
+
+
+def decode_vector(vector: List[List[int]], scale: int = DECODE_SCALE) -> Dict[str, Any]:
+    """
+    メモリ上の module 行列を小さく描画してその場でデコードする（qr_raimu には書かない）。
+    """
+    decoder = _get_decoder()
+    t0 = time.perf_counter()
+    payload = decoder.decode_modules(vector, scale=scale)
+    elapsed_ms = (time.perf_counter() - t0) * 1000.0
+    return {
+        "ok": payload is not None,
+        "payload": payload,
+        "decode_ms": round(elapsed_ms, 3),
+    }
+
+
+def decode_json_file(filename: str, scale: int = DECODE_SCALE) -> Dict[str, Any]:
+    obj = load_json_file(filename)
+    return decode_vector(obj["vector"], scale=scale)
+
+
+def _toggle_cell(filename: str, gx: int, gy: int) -> tuple[int, Dict[str, Any]]:
     path = VECTOR_DIR / filename
-    obj = _load_json(path)
-    vec = obj.get("vector")
-    module = int(obj.get("module", 0))
-    if vec is None or module <= 0:
-        raise ValueError("invalid json structure")
-    try:
-        current = int(vec[gy][gx])
-        new_val = 1 - current
-        vec[gy][gx] = new_val
-    except Exception as e:
-        raise IndexError("index out of range") from e
-    obj["vector"] = vec
-    _save_json(obj, path)
-    return int(new_val)
+    with _file_lock(path.name):
+        obj = _load_json(path)
+        vec = obj.get("vector")
+        module = int(obj.get("module", 0))
+        if vec is None or module <= 0:
+            raise ValueError("invalid json structure")
+        try:
+            if gx < 0 or gy < 0:
+                raise IndexError
+            current = int(vec[gy][gx])
+            new_val = 1 - current
+            vec[gy][gx] = new_val
+        except Exception as e:
+            raise IndexError("index out of range") from e
+        obj["vector"] = vec
+        _save_json(obj, path)
+    return int(new_val), obj
+
+
+def toggle_cell_and_save(filename: str, gx: int, gy: int) -> int:
+    new_val, _ = _toggle_cell(filename, gx, gy)
+    return new_val
+
+
+def toggle_cell_and_decode(filename: str, gx: int, gy: int) -> tuple[int, Dict[str, Any]]:
+    """セルを反転して保存し、反転後の行列のデコード結果も返す。"""
+    _get_decoder()  # デコーダが使えない場合は保存前に失敗させる
+    new_val, obj = _toggle_cell(filename, gx, gy)
+    return new_val, decode_vector(obj["vector"])
 
 
 def save_whole_json(filename: str, vector: List[List[int]], module: int, width: int, height: int) -> str:
+    """
+    vector / module / width / height だけを書き換えて保存する。既存 JSON のそれ以外の項目
+    （file・confidence・index / bbox・duplicate_of・repair など）はそのまま残す。
+    """
     path = VECTOR_DIR / filename
-    obj = {
-        "file": Path(filename).with_suffix(".png").name,
-        "module": int(module),
-        "width": int(width),
-        "height": int(height),
-        "vector": vector,
-    }
-    _save_json(obj, path)
+    with _file_lock(path.name):
+        obj = _load_json(path) if path.exists() else {"file": Path(filename).with_suffix(".png").name}
+        obj.update(module=int(module), width=int(width), height=int(height), vector=vector)
+        _save_json(obj, path)
+    _record_vector(path.name, obj)
+    _INDEX.invalidate(path.name)
     return str(path)
 
 
-def export_png_from_json(filename: str, out_name: Optional[str] = None) -> str:
+def export_png_from_json(filename: str, out_name: Optional[str] = None, fmt: Optional[str] = None) -> str:
+    """OUTPUT_DIR に再生成画像を書き出す。拡張子は形式（既定は EXPORT_FORMAT）で決まる。"""
     obj = load_json_file(filename)
-    vector = obj["vector"]
     module = int(obj["module"])
-    w = int(obj["width"])
-    h = int(obj["height"])
-    im = _rebuild_image_from_vector(vector, width=w, height=h, module=module)
-    if not out_name:
-        out_name = Path(filename).with_suffix(".png").name
-    out_path = OUTPUT_DIR / out_name
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    im.save(out_path)
-    return str(out_path)
+    grid = np.asarray(obj["vector"], dtype=np.uint8)[:module, :module]
+    out_stem = OUTPUT_DIR / Path(out_name or filename).with_suffix("")
+    out_stem.parent.mkdir(parents=True, exist_ok=True)
+    return write_reconstruction(str(out_stem), grid, int(obj["width"]), int(obj["height"]), fmt or EXPORT_FORMAT)
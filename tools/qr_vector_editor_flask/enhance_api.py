@@ -0,0 +1,86 @@
+# tools/qr_vector_editor_flask/enhance_api.py
+from __future__ import annotations
+import os
+import threading
+
+from flask import Blueprint, Flask, request, jsonify
+
+# POST /api/enhance : 画像バイト列を受け取り、module ベクトル・デコード結果・処理時間を返す
+#   - 単体: Content-Type: application/octet-stream で画像そのものを body に載せる
+#   - 複数: multipart/form-data で "image" フィールドを複数添付（順番どおりに配列で返す）
+# ディスクには一切書かない（cv2.imdecode でメモリ上だけで処理）
+bp = Blueprint("enhance", __name__)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+_scheduler_kwargs: dict = {}
+
+REQUEST_TIMEOUT_SEC = float(os.environ.get("QR_ENHANCE_TIMEOUT", "10"))
+
+
+def configure(**kwargs) -> None:
+    """MicroBatchScheduler の引数（enhancer_params, workers, max_batch, max_wait_ms ...）を設定する。"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.close()
+            _scheduler = None
+        _scheduler_kwargs.clear()
+        _scheduler_kwargs.update(kwargs)
+
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            # pyzbar を読むので初回リクエスト時に生成
+            from pipeline.enhance_service import MicroBatchScheduler
+            _scheduler = MicroBatchScheduler(**_scheduler_kwargs)
+        return _scheduler
+
+
+@bp.post("/api/enhance")
+def api_enhance():
+    try:
+        from pipeline.enhance_service import ServiceBusy
+        scheduler = get_scheduler()
+    except ImportError as e:
+        return jsonify({"error": f"enhancer unavailable: {e}"}), 503
+
+    files = request.files.getlist("image")
+    try:
+        if files:
+            results = scheduler.enhance_many([f.read() for f in files], timeout=REQUEST_TIMEOUT_SEC)
+            return jsonify({"ok": True, "results": results})
+
+        data = request.get_data(cache=False)
+        if not data:
+            return jsonify({"error": "image bytes required"}), 400
+        result = scheduler.enhance(data, timeout=REQUEST_TIMEOUT_SEC)
+        return jsonify(result), (200 if result.get("ok") else 400)
+    except ServiceBusy as e:
+        return jsonify({"error": str(e)}), 503
+    except TimeoutError:
+        return jsonify({"error": "timeout"}), 504
+
+
+def create_app() -> Flask:
+    """エディタ無しで鮮明化エンドポイントだけを提供する Flask アプリ。"""
+    app = Flask(__name__)
+    app.register_blueprint(bp)
+
+    @app.get("/health")
+    def health():
+        return jsonify({"ok": True})
+
+    return app
+
+
+def start(host: str | None = None, port: int | None = None):
+    h = host or os.environ.get("FLASK_RUN_HOST", "0.0.0.0")
+    p = int(port or os.environ.get("QR_ENHANCE_PORT", "5001"))
+    create_app().run(host=h, port=p, debug=False, use_reloader=False, threaded=True)
+
+
+if __name__ == "__main__":
+    start()
@@ -0,0 +1,210 @@
+# tools/qr_vector_editor_flask/jobs_api.py
+from __future__ import annotations
+import json
+import os
+import threading
+
+from flask import Blueprint, Response, jsonify, request, send_from_directory, stream_with_context
+
+from pipeline.jobs import JobBusy, JobRunner
+
+# パイプラインのステップをバックグラウンドで実行するジョブ API
+#   POST /api/jobs                 {"step": "step1", "params": {...}} → 202 {"id": ...}（同じ step が実行中なら 409、
+#                                  PARAM_SPECS にない・範囲外の params は 400）
+#   GET  /api/jobs                 最近のジョブ一覧
+#   GET  /api/jobs/<id>            進捗（done / total / failures / throughput / eta_sec ...）
+#   GET  /api/jobs/<id>/events     進捗を Server-Sent Events で配信（終了で "end" イベント）
+#   POST /api/jobs/<id>/cancel     キャンセル要求（次の1件の区切りで止まる）
+#   GET  /reports/contact_sheet/<file>  contact_sheet ジョブの出力（qr_statistics/contact_sheet の index.html とアトラス画像）
+# ステップ本体はジョブ用のスレッドプールで動くので、リクエストスレッドは待たされない
+bp = Blueprint("jobs", __name__)
+
+_runner: JobRunner | None = None
+_runner_lock = threading.Lock()
+_pipeline_factory = None
+
+SSE_HEARTBEAT_SEC = 15.0
+STATISTICS_DIR = "qr_statistics"
+# contact_sheet ジョブの出力先（クライアントからは変えられない）
+CONTACT_SHEET_DIR = os.path.join(STATISTICS_DIR, "contact_sheet")
+
+# ジョブごとに受け付ける params: 名前 → (型, 最小, 最大, None を許すか)
+# パスを指す引数（out_dir / json_path / tobako_dir など）は受け付けない
+PARAM_SPECS = {
+    "step0": {"sample_size": (int, 1, 10000, False)},
+    "step1": {
+        "batch_size": (int, 1, 256, False),
+        "dedup_radius": (int, 0, 255, True),
+        "processes": (int, 1, 64, False),
+        "router": (bool, None, None, False),
+    },
+    "step2": {"skip_rejected": (bool, None, None, False)},
+    "step3": {},
+    "contact_sheet": {
+        "thumb": (int, 16, 256, False),
+        "cols": (int, 1, 64, False),
+        "rows": (int, 1, 256, False),
+        "workers": (int, 1, 32, False),
+        "jpeg_quality": (int, 10, 100, False),
+    },
+    "repair": {},
+}
+
+
+def configure(pipeline_factory=None, workers: int = 2) -> None:
+    """ジョブで使う QRPipeline の作り方（既定は main.build_pipeline）とワーカー数を設定する。"""
+    global _runner, _pipeline_factory
+    with _runner_lock:
+        if _runner is not None:
+            _runner.close()
+        _runner = JobRunner(workers=workers)
+        _pipeline_factory = pipeline_factory
+
+
+def get_runner() -> JobRunner:
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+        return _runner
+
+
+def _make_pipeline():
+    if _pipeline_factory is not None:
+        return _pipeline_factory()
+    from main import build_pipeline
+    return build_pipeline()
+
+
+def _pipeline_step(method: str):
+    def run(params: dict, progress):
+        pipeline = _make_pipeline()
+        pipeline.on_progress = progress
+        result = getattr(pipeline, method)(**params)
+        return result if isinstance(result, (dict, type(None))) else {"items": len(result)}
+    return run
+
+
+def _run_reports(params: dict, progress):
+    """Step3: PDF レポートを順に作る（1本を1件として数える）。"""
+    import evaluate.analysis_pdf as analysis_pdf
+    import evaluate.evaluate_pdf as evaluate_pdf
+    import evaluate.overlay_pdf as overlay_pdf
+
+    reports = [("evaluate_pdf", evaluate_pdf), ("overlay_pdf", overlay_pdf), ("analysis_pdf", analysis_pdf)]
+    progress({"phase": "reports", "total": len(reports)})
+    for name, module in reports:
+        module.main()
+        progress({"done": name, "ok": True})
+
+
+def _run_contact_sheet(params: dict, progress):
+    """Step3 の軽量版: コンタクトシート（アトラス画像＋index.html）を作る。"""
+    from evaluate.contact_sheet import ContactSheetReport
+
+    return {"index": ContactSheetReport(**params).generate(CONTACT_SHEET_DIR, progress=progress)}
+
+
+STEPS = {
+    "step0": _pipeline_step("step0_calibrate_thresholds"),
+    "step1": _pipeline_step("step1_make_vectors"),
+    "step2": _pipeline_step("step2_build_images_and_evaluate"),
+    "step3": _run_reports,
+    "contact_sheet": _run_contact_sheet,
+    "repair": _pipeline_step("step_repair_vectors"),
+}
+
+
+def _check_params(step: str, params: dict) -> str | None:
+    """PARAM_SPECS に合わない params ならエラーメッセージを返す。"""
+    spec = PARAM_SPECS.get(step, {})
+    for key, value in params.items():
+        if key not in spec:
+            return f"unknown param for {step}: {key} (allowed: {', '.join(sorted(spec)) or 'none'})"
+        kind, lo, hi, nullable = spec[key]
+        if value is None:
+            if not nullable:
+                return f"param '{key}' must not be null"
+            continue
+        # JSON の true/false は int として通さない
+        if type(value) is not kind:
+            return f"param '{key}' must be {kind.__name__}"
+        if lo is not None and not lo <= value <= hi:
+            return f"param '{key}' must be in {lo}..{hi}"
+    return None
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@bp.post("/api/jobs")
+def api_jobs_submit():
+    data = request.get_json(silent=True) or {}
+    step = data.get("step")
+    params = data.get("params") or {}
+    if step not in STEPS:
+        return jsonify({"error": f"unknown step: {step}", "steps": sorted(STEPS)}), 400
+    if not isinstance(params, dict):
+        return jsonify({"error": "params must be an object"}), 400
+    error = _check_params(step, params)
+    if error is not None:
+        return jsonify({"error": error}), 400
+    try:
+        job = get_runner().submit(step, STEPS[step], params)
+    except JobBusy as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify(job.snapshot()), 202
+
+
+@bp.get("/api/jobs")
+def api_jobs_list():
+    return jsonify([job.snapshot() for job in get_runner().jobs()])
+
+
+@bp.get("/api/jobs/<job_id>")
+def api_jobs_get(job_id: str):
+    job = get_runner().get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job.snapshot())
+
+
+@bp.post("/api/jobs/<job_id>/cancel")
+def api_jobs_cancel(job_id: str):
+    job = get_runner().get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    job.cancel()
+    return jsonify(job.snapshot()), 202
+
+
+@bp.get("/reports/contact_sheet/<path:filename>")
+def contact_sheet_file(filename: str):
+    return send_from_directory(os.path.abspath(CONTACT_SHEET_DIR), filename)
+
+
+@bp.get("/api/jobs/<job_id>/events")
+def api_jobs_events(job_id: str):
+    job = get_runner().get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+
+    def stream():
+        version = -1
+        while True:
+            current = job.wait_change(version, timeout=SSE_HEARTBEAT_SEC)
+            if current == version and not job.finished:
+                yield ": keep-alive\n\n"
+                continue
+            version = current
+            snap = job.snapshot()
+            if job.finished:
+                yield _sse("end", snap)
+                return
+            yield _sse("progress", snap)
+
+    resp = Response(stream_with_context(stream()), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
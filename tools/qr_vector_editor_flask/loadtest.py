@@ -0,0 +1,338 @@
+# tools/qr_vector_editor_flask/loadtest.py
+"""
+QRベクター編集ツール（Flask）の負荷試験ハーネス。
+
+合成した qr_vector / qr_tobakosan コーパスに対して /api/list, /api/render,
+/api/original, /api/toggle を実運用に近い比率で並行に叩き、ルートごとの
+スループットと p50/p95/p99 レイテンシを出す。併せて同一 JSON への同時 toggle で
+更新の取りこぼし（lost update）が起きないかを検査する。
+
+ネットワーク不要（既定は Flask test client、--serve でローカルに実サーバを立てる）。
+
+    python -m tools.qr_vector_editor_flask.loadtest --threads 8 --duration 10
+    python -m tools.qr_vector_editor_flask.loadtest --serve --max-p99-ms 200
+
+取りこぼし・エラー・p99 超過があれば終了コード 1 を返す。
+"""
+from __future__ import annotations
+import argparse
+import json
+import logging
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+from PIL import Image
+
+from . import editor_app
+from .app import app
+
+# ルートの出現比率（一覧は時々、描画系が大半、編集はそれなり）
+DEFAULT_MIX = {"list": 0.05, "render": 0.45, "original": 0.30, "toggle": 0.20}
+
+
+# ---------- 合成コーパス ----------
+def build_corpus(root: Path, n_files: int, module: int = 33, cell_px: int = 10, seed: int = 0) -> List[str]:
+    """root 以下に qr_vector/*.json と qr_tobakosan/*.png を n_files 件生成し、JSON 名の一覧を返す。"""
+    rng = np.random.default_rng(seed)
+    vec_dir = root / "qr_vector"
+    orig_dir = root / "qr_tobakosan"
+    vec_dir.mkdir(parents=True, exist_ok=True)
+    orig_dir.mkdir(parents=True, exist_ok=True)
+
+    size = module * cell_px
+    names: List[str] = []
+    for i in range(1, n_files + 1):
+        grid = (rng.random((module, module)) < 0.5).astype(np.uint8)
+        with (vec_dir / f"{i}.json").open("w", encoding="utf-8") as f:
+            json.dump(
+                {"file": f"{i}.png", "module": module, "width": size, "height": size, "vector": grid.tolist()},
+                f, ensure_ascii=False,
+            )
+        img = np.where(grid == 1, 0, 255).astype(np.uint8)
+        img = np.repeat(np.repeat(img, cell_px, axis=0), cell_px, axis=1)
+        Image.fromarray(img, mode="L").save(orig_dir / f"{i}.png")
+        names.append(f"{i}.json")
+    return names
+
+
+# ---------- クライアント ----------
+class _Client:
+    """test client と HTTP を同じ形で扱う薄いラッパ。戻り値は (status, body bytes)。"""
+
+    def __init__(self, base_url: str | None):
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self._tc = None if base_url else app.test_client()
+
+    def get(self, path: str) -> tuple[int, bytes]:
+        if self._tc is not None:
+            r = self._tc.get(path)
+            return r.status_code, r.data
+        try:
+            with urllib.request.urlopen(self.base_url + path, timeout=30) as r:
+                return r.status, r.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def post_json(self, path: str, payload: Dict[str, Any]) -> tuple[int, bytes]:
+        if self._tc is not None:
+            r = self._tc.post(path, json=payload)
+            return r.status_code, r.data
+        req = urllib.request.Request(
+            self.base_url + path,
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=30) as r:
+                return r.status, r.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+# ---------- 計測 ----------
+class _Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def add(self, route: str, ms: float, ok: bool) -> None:
+        with self._lock:
+            self.latencies.setdefault(route, []).append(ms)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, Dict[str, float]]:
+        out: Dict[str, Dict[str, float]] = {}
+        for route, lat in sorted(self.latencies.items()):
+            a = np.asarray(lat, dtype=float)
+            p50, p95, p99 = np.percentile(a, [50, 95, 99])
+            out[route] = {
+                "count": int(a.size),
+                "errors": int(self.errors.get(route, 0)),
+                "rps": round(a.size / elapsed, 2) if elapsed > 0 else 0.0,
+                "p50_ms": round(float(p50), 3),
+                "p95_ms": round(float(p95), 3),
+                "p99_ms": round(float(p99), 3),
+                "max_ms": round(float(a.max()), 3),
+            }
+        return out
+
+
+def _timed(rec: _Recorder, route: str, fn: Callable[[], tuple[int, bytes]]) -> tuple[int, bytes]:
+    t0 = time.perf_counter()
+    status, body = fn()
+    rec.add(route, (time.perf_counter() - t0) * 1000.0, 200 <= status < 300)
+    return status, body
+
+
+# ---------- シナリオ ----------
+def run_mixed(
+    base_url: str | None,
+    names: List[str],
+    module: int,
+    threads: int,
+    duration: float,
+    mix: Dict[str, float],
+    thumb_size: int = 96,
+    seed: int = 0,
+) -> tuple[_Recorder, float]:
+    """mix の比率でルートを選びながら threads 本で duration 秒叩く。"""
+    rec = _Recorder()
+    stop = time.perf_counter() + duration
+    routes = list(mix)
+    weights = [mix[r] for r in routes]
+
+    def worker(idx: int):
+        rnd = random.Random(seed + idx)
+        client = _Client(base_url)
+        # toggle は同じセルを2回反転して元に戻す（コーパスを壊さない）
+        while time.perf_counter() < stop:
+            route = rnd.choices(routes, weights)[0]
+            name = rnd.choice(names)
+            if route == "list":
+                _timed(rec, route, lambda: client.get("/api/list?limit=200"))
+            elif route == "render":
+                _timed(rec, route, lambda: client.get(f"/api/render?file={name}&size={thumb_size}"))
+            elif route == "original":
+                _timed(rec, route, lambda: client.get(f"/api/original?file={name}&size={thumb_size}"))
+            elif route == "toggle":
+                payload = {"file": name, "gx": rnd.randrange(module), "gy": rnd.randrange(module)}
+                for _ in range(2):
+                    _timed(rec, route, lambda: client.post_json("/api/toggle", payload))
+
+    t0 = time.perf_counter()
+    ths = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(threads)]
+    for t in ths:
+        t.start()
+    for t in ths:
+        t.join()
+    return rec, time.perf_counter() - t0
+
+
+def run_toggle_contention(
+    base_url: str | None,
+    name: str,
+    module: int,
+    threads: int,
+    toggles_per_thread: int,
+) -> Dict[str, Any]:
+    """
+    同じ JSON の別々のセルを各スレッドが繰り返し反転し、取りこぼしを数える。
+
+    各スレッドは自分のセルだけを触るので、直列化されていれば応答値は必ず交互になり、
+    最終値は (初期値 xor 反転回数の奇偶) になる。どちらかが崩れたら lost update。
+    """
+    client = _Client(base_url)
+    status, body = client.get(f"/api/load?file={name}")
+    if status != 200:
+        return {"error": f"cannot load {name}: {status}"}
+    initial = json.loads(body)["vector"]
+
+    cells = [(i % module, (i // module) % module) for i in range(threads)]
+    non_alternating = [0] * threads
+    failed = [0] * threads
+
+    def worker(idx: int):
+        c = _Client(base_url)
+        gx, gy = cells[idx]
+        expected = 1 - int(initial[gy][gx])
+        for _ in range(toggles_per_thread):
+            st, b = c.post_json("/api/toggle", {"file": name, "gx": gx, "gy": gy})
+            if st != 200:
+                failed[idx] += 1
+                continue
+            value = int(json.loads(b)["value"])
+            if value != expected:
+                non_alternating[idx] += 1
+            expected = 1 - value
+
+    ths = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(threads)]
+    for t in ths:
+        t.start()
+    for t in ths:
+        t.join()
+
+    status, body = client.get(f"/api/load?file={name}")
+    final = json.loads(body)["vector"] if status == 200 else initial
+    mismatched = 0
+    for idx, (gx, gy) in enumerate(cells):
+        applied = toggles_per_thread - failed[idx]
+        want = int(initial[gy][gx]) ^ (applied % 2)
+        if int(final[gy][gx]) != want:
+            mismatched += 1
+
+    return {
+        "file": name,
+        "threads": threads,
+        "toggles_per_thread": toggles_per_thread,
+        "failed_requests": sum(failed),
+        "non_alternating_responses": sum(non_alternating),
+        "final_mismatched_cells": mismatched,
+        "lost_updates": sum(non_alternating) + mismatched,
+    }
+
+
+# ---------- 実サーバ ----------
+def _serve_in_background() -> tuple[str, Callable[[], None]]:
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # アクセスログで結果表が埋もれないように
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    th = threading.Thread(target=server.serve_forever, daemon=True)
+    th.start()
+    return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+
+def _print_table(summary: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'route':<10}{'count':>8}{'err':>6}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for route, s in summary.items():
+        print(
+            f"{route:<10}{s['count']:>8}{s['errors']:>6}{s['rps']:>10.1f}"
+            f"{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}{s['max_ms']:>10.2f}"
+        )
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="QRベクター編集ツールの負荷試験")
+    ap.add_argument("--files", type=int, default=200, help="合成コーパスの件数")
+    ap.add_argument("--module", type=int, default=33)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--duration", type=float, default=5.0, help="混合負荷の秒数")
+    ap.add_argument("--contention-threads", type=int, default=16)
+    ap.add_argument("--contention-toggles", type=int, default=25)
+    ap.add_argument("--serve", action="store_true", help="127.0.0.1 の空きポートで実サーバを起動して叩く")
+    ap.add_argument("--max-p99-ms", type=float, default=None, help="いずれかのルートの p99 がこれを超えたら失敗")
+    ap.add_argument("--json", dest="json_out", default=None, help="結果を JSON で保存するパス")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="qr_loadtest_") as tmp:
+        root = Path(tmp)
+        names = build_corpus(root, args.files, module=args.module, seed=args.seed)
+        editor_app.configure_dirs(
+            vector_dir=root / "qr_vector",
+            orig_dir=root / "qr_tobakosan",
+            output_dir=root / "qr_raimu",
+            # 編集の記録も一時ディレクトリへ（既定の qr_statistics/results.sqlite3 に書かない）
+            results_db=root / "results.sqlite3",
+        )
+
+        base_url, shutdown = (None, None)
+        if args.serve:
+            base_url, shutdown = _serve_in_background()
+        try:
+            print(f"--- 混合負荷: threads={args.threads}, duration={args.duration}s, target={base_url or 'test-client'} ---")
+            rec, elapsed = run_mixed(
+                base_url, names, args.module, args.threads, args.duration, DEFAULT_MIX, seed=args.seed
+            )
+            summary = rec.summary(elapsed)
+            _print_table(summary)
+            total = sum(s["count"] for s in summary.values())
+            print(f"合計: {total} req / {elapsed:.2f}s = {total / elapsed:.1f} req/s")
+
+            print(f"--- 同時 toggle 検査: threads={args.contention_threads} x {args.contention_toggles} ---")
+            contention = run_toggle_contention(
+                base_url, names[0], args.module, args.contention_threads, args.contention_toggles
+            )
+            print(json.dumps(contention, ensure_ascii=False))
+        finally:
+            if shutdown:
+                shutdown()
+
+    failures: List[str] = []
+    if contention.get("error") or contention.get("lost_updates", 0) > 0:
+        failures.append("lost updates detected")
+    errors = sum(s["errors"] for s in summary.values())
+    if errors:
+        failures.append(f"{errors} request errors")
+    if args.max_p99_ms is not None:
+        slow = [r for r, s in summary.items() if s["p99_ms"] > args.max_p99_ms]
+        if slow:
+            failures.append(f"p99 > {args.max_p99_ms} ms: {', '.join(slow)}")
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(
+                {"routes": summary, "elapsed_s": elapsed, "contention": contention, "failures": failures},
+                f, ensure_ascii=False, indent=2,
+            )
+
+    if failures:
+        print("失敗: " + " / ".join(failures))
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,7 @@
   const editorEl = document.getElementById("editor");
   const metaEl = document.getElementById("meta");
   const statusEl = document.getElementById("status");
+  const decodeEl = document.getElementById("decode-status");
   const zoomInput = document.getElementById("zoom");
   const zoomVal = document.getElementById("zoom-val");
   const origLargeEl = document.getElementById("orig-large");
@@ -21,10 +22,34 @@
     if (msg) setTimeout(() => (statusEl.textContent = ""), 1600);
   }
 
+  // 一覧はページ単位で取得し、スクロール末尾で続きを読む
+  const PAGE_SIZE = 200;
+  let listOffset = 0;
+  let listTotal = null;
+  let listLoading = false;
+
   async function loadList() {
-    const res = await fetch("/api/list");
-    const files = await res.json();
     fileListEl.innerHTML = "";
+    listOffset = 0;
+    listTotal = null;
+    await loadMore();
+  }
+
+  async function loadMore() {
+    if (listLoading || (listTotal !== null && listOffset >= listTotal)) return;
+    listLoading = true;
+    try {
+      const res = await fetch(`/api/list?offset=${listOffset}&limit=${PAGE_SIZE}`);
+      const files = await res.json();
+      listTotal = parseInt(res.headers.get("X-Total-Count") || "0", 10);
+      listOffset += files.length;
+      appendItems(files);
+    } finally {
+      listLoading = false;
+    }
+  }
+
+  function appendItems(files) {
     const thumbSize = 96;
 
     files.forEach(it => {
@@ -68,6 +93,13 @@
     });
   }
 
+  const listPaneEl = fileListEl.closest(".list-pane");
+  listPaneEl.addEventListener("scroll", () => {
+    if (listPaneEl.scrollTop + listPaneEl.clientHeight >= listPaneEl.scrollHeight - 200) {
+      loadMore();
+    }
+  });
+
   async function selectFile(filename) {
     const res = await fetch(`/api/load?file=${encodeURIComponent(filename)}`);
     const obj = await res.json();
@@ -88,6 +120,7 @@
     origLargeEl.src = `/api/original?file=${encodeURIComponent(filename)}&size=${calcDisplaySize()}`;
 
     drawAll();
+    decodeCurrent();
   }
 
   function calcDisplaySize() {
@@ -138,7 +171,7 @@
   }
 
   async function toggleAndSave(gx, gy) {
-    const payload = { file: current.filename, gx, gy };
+    const payload = { file: current.filename, gx, gy, decode: true };
     const resp = await fetch("/api/toggle", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
@@ -152,6 +185,28 @@
     vector[gy][gx] = r.value;
     drawAll();
     setStatus(`保存: (${gx}, ${gy}) → ${r.value}`);
+    showDecode(r.decode);
+  }
+
+  function showDecode(d) {
+    if (!d) {
+      decodeEl.textContent = "";
+      return;
+    }
+    decodeEl.style.color = d.ok ? "#2f855a" : "#c53030";
+    decodeEl.textContent = d.ok
+      ? `decode OK (${d.decode_ms.toFixed(1)} ms): ${d.payload}`
+      : `decode NG (${d.decode_ms.toFixed(1)} ms)`;
+  }
+
+  async function decodeCurrent() {
+    const resp = await fetch("/api/decode", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ vector }),
+    });
+    const r = await resp.json();
+    showDecode(resp.ok ? r : null);
   }
 
   canvas.addEventListener("click", (evt) => {
@@ -170,6 +225,59 @@
     }
   });
 
+  // ---------- ジョブ（Step1〜3 をバックグラウンド実行） ----------
+  const jobStatusEl = document.getElementById("job-status");
+  const jobCancelBtn = document.getElementById("job-cancel");
+  let jobId = null;
+
+  function showJob(j) {
+    const eta = j.eta_sec != null ? ` / 残り ${j.eta_sec}s` : "";
+    const rate = j.throughput != null ? ` / ${j.throughput} 件/s` : "";
+    const fail = j.failures ? ` / 失敗 ${j.failures}` : "";
+    const err = j.error ? ` / ${j.error}` : "";
+    jobStatusEl.textContent = `${j.step} ${j.state} ${j.phase || ""} ${j.done}/${j.total}${rate}${eta}${fail}${err}`;
+  }
+
+  function watchJob(id) {
+    jobId = id;
+    jobCancelBtn.classList.remove("hidden");
+    const es = new EventSource(`/api/jobs/${id}/events`);
+    es.addEventListener("progress", (e) => showJob(JSON.parse(e.data)));
+    es.addEventListener("end", (e) => {
+      const j = JSON.parse(e.data);
+      showJob(j);
+      es.close();
+      jobId = null;
+      jobCancelBtn.classList.add("hidden");
+      if (j.state === "done" && j.step === "step1") loadList();
+      if (j.state === "done" && j.step === "contact_sheet" && j.result && j.result.index) {
+        jobStatusEl.insertAdjacentHTML(
+          "beforeend", ' <a href="/reports/contact_sheet/index.html" target="_blank">一覧を開く</a>');
+      }
+    });
+  }
+
+  document.querySelectorAll(".jobs button[data-step]").forEach((btn) => {
+    btn.addEventListener("click", async () => {
+      const resp = await fetch("/api/jobs", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ step: btn.dataset.step }),
+      });
+      const r = await resp.json();
+      if (!resp.ok) {
+        jobStatusEl.textContent = r.error || "ジョブを開始できませんでした";
+        return;
+      }
+      showJob(r);
+      watchJob(r.id);
+    });
+  });
+
+  jobCancelBtn.addEventListener("click", () => {
+    if (jobId) fetch(`/api/jobs/${jobId}/cancel`, { method: "POST" });
+  });
+
   // 初期化
   loadList().then(() => {
     if (typeof PRESELECT === "string" && PRESELECT.length > 0) {